@@ -9,8 +9,8 @@ from pydantic import ValidationError, BaseModel
 from pydantic.v1 import BaseSettings
 from sqlalchemy import insert, update, select
 
-from app.core.constants import API_VERSION, DEFAULT_CREATE_IMAGE_MODEL, DEFAULT_FILTER_MODELS, DEFAULT_MODEL, DEFAULT_STREAM_CHUNK_SIZE, DEFAULT_STREAM_LONG_TEXT_THRESHOLD, DEFAULT_STREAM_MAX_DELAY, DEFAULT_STREAM_MIN_DELAY, DEFAULT_STREAM_SHORT_TEXT_THRESHOLD, DEFAULT_TIMEOUT, MAX_RETRIES
-from app.log.logger import get_config_logger
+from app.core.constants import API_VERSION, DEFAULT_ADMISSION_MAX_WAIT_SECONDS, DEFAULT_ADMISSION_PRIORITY, DEFAULT_ADMISSION_QUEUE_SIZE, DEFAULT_BATCH_MAX_CONCURRENCY, DEFAULT_BATCH_STORAGE_DIR, DEFAULT_BULK_MAX_WINDOW, DEFAULT_CLIENT_MAX_CONCURRENT_STREAMS, DEFAULT_CLIENT_RPM_LIMIT, DEFAULT_CLIENT_TPM_LIMIT, DEFAULT_CONTEXT_CACHE_MAX_PER_KEY, DEFAULT_CONTEXT_CACHE_MIN_TOKENS, DEFAULT_CONTEXT_CACHE_TTL_SECONDS, DEFAULT_CREATE_IMAGE_MODEL, DEFAULT_EMBEDDING_CACHE_PATH, DEFAULT_EMBEDDING_MAX_CONCURRENCY, DEFAULT_FILTER_MODELS, DEFAULT_KEY_AFFINITY_MODE, DEFAULT_KEY_COOLDOWN_SECONDS, DEFAULT_KEY_MAX_CONCURRENT_REQUESTS, DEFAULT_MODEL, DEFAULT_PREFLIGHT_MAX_INPUT_TOKENS, DEFAULT_REQUEST_LOG_RETENTION_DAYS, DEFAULT_STATS_HOUR_RETENTION_DAYS, DEFAULT_STATS_MINUTE_RETENTION_DAYS, DEFAULT_STATS_ROLLUP_INTERVAL_SECONDS, DEFAULT_STREAM_CHUNK_SIZE, DEFAULT_STREAM_LONG_TEXT_THRESHOLD, DEFAULT_STREAM_MAX_DELAY, DEFAULT_STREAM_MIN_DELAY, DEFAULT_STREAM_SHORT_TEXT_THRESHOLD, DEFAULT_TIMEOUT, DEFAULT_TOKEN_USAGE_FLUSH_INTERVAL_SECONDS, DEFAULT_TRACE_BUFFER_SIZE, DEFAULT_TRACE_SAMPLE_RATE, MAX_RETRIES
+from app.log.logger import Logger, get_config_logger
 # 延迟导入以避免循环依赖，仅在 sync_initial_settings 中使用
 # from app.database.connection import database
 # from app.database.models import Settings as SettingsModel
@@ -88,6 +88,55 @@ class Settings(BaseSettings):
     CHECK_INTERVAL_HOURS: int = 1 # 默认检查间隔为1小时
     TIMEZONE: str = "Asia/Shanghai" # 默认时区
 
+    # 请求日志聚合与保留配置
+    STATS_ROLLUP_INTERVAL_SECONDS: int = DEFAULT_STATS_ROLLUP_INTERVAL_SECONDS # 原始日志聚合间隔
+    REQUEST_LOG_RETENTION_DAYS: int = DEFAULT_REQUEST_LOG_RETENTION_DAYS # 原始请求日志保留天数
+    STATS_MINUTE_RETENTION_DAYS: int = DEFAULT_STATS_MINUTE_RETENTION_DAYS # 分钟聚合保留天数 (至少1天)
+    STATS_HOUR_RETENTION_DAYS: int = DEFAULT_STATS_HOUR_RETENTION_DAYS # 小时聚合保留天数
+    TOKEN_USAGE_FLUSH_INTERVAL_SECONDS: int = DEFAULT_TOKEN_USAGE_FLUSH_INTERVAL_SECONDS # token 用量写入数据库的间隔
+
+    # 日志配置 (修改后无需重启)
+    LOG_LEVEL: str = "info" # 默认日志级别
+    LOG_LEVEL_OVERRIDES: List[str] = [] # 单个 logger 的级别，如 ["gemini=debug", "database=warning"]
+    LOG_FORMAT: str = "text" # text 或 json (JSON Lines)
+    LOG_REQUEST_BODY_SAMPLE_RATE: float = 1.0 # DEBUG 级别下记录请求体的采样率
+    LOG_REQUEST_BODY_MAX_CHARS: int = 2000 # 记录请求体的最大字符数
+
+    # 请求追踪配置
+    TRACE_SAMPLE_RATE: float = DEFAULT_TRACE_SAMPLE_RATE # API 请求的追踪采样率，0 表示关闭
+    TRACE_BUFFER_SIZE: int = DEFAULT_TRACE_BUFFER_SIZE # 内存中保留的最近追踪数
+
+    # 客户端配额配置 (按 ALLOWED_TOKENS 中的每个令牌分别计算，0 表示不限制)
+    CLIENT_RPM_LIMIT: int = DEFAULT_CLIENT_RPM_LIMIT # 每分钟请求数
+    CLIENT_TPM_LIMIT: int = DEFAULT_CLIENT_TPM_LIMIT # 每分钟 token 数，请求完成后按实际用量扣减
+    CLIENT_MAX_CONCURRENT_STREAMS: int = DEFAULT_CLIENT_MAX_CONCURRENT_STREAMS # 并发流式请求数
+    CLIENT_LIMIT_OVERRIDES: List[str] = [] # 单个客户端的限额，如 ["<client_id>=rpm:60,tpm:100000,streams:2"]
+
+    # 准入控制配置
+    KEY_COOLDOWN_SECONDS: int = DEFAULT_KEY_COOLDOWN_SECONDS # 密钥被上游限流 (429) 后暂停使用的秒数，0 表示不冷却
+    KEY_MAX_CONCURRENT_REQUESTS: int = DEFAULT_KEY_MAX_CONCURRENT_REQUESTS # 每个可用密钥的并发请求数，0 表示不限制
+    ADMISSION_QUEUE_SIZE: int = DEFAULT_ADMISSION_QUEUE_SIZE # 无可用容量时最多排队的请求数
+    ADMISSION_MAX_WAIT_SECONDS: float = DEFAULT_ADMISSION_MAX_WAIT_SECONDS # 请求最长排队时间，可由 X-Request-Timeout 请求头缩短
+    ADMISSION_DEFAULT_PRIORITY: int = DEFAULT_ADMISSION_PRIORITY # 默认优先级 (0-9，越小越优先)
+    ADMISSION_CLIENT_PRIORITIES: List[str] = [] # 单个客户端的优先级，如 ["<client_id>=1"]
+
+    # 上游上下文缓存配置
+    CONTEXT_CACHE_ENABLED: bool = False # 为重复出现的长前缀 (systemInstruction、tools 和开头的 contents) 创建上游缓存
+    CONTEXT_CACHE_MIN_TOKENS: int = DEFAULT_CONTEXT_CACHE_MIN_TOKENS # 估算 token 数达到该值的前缀才会缓存
+    CONTEXT_CACHE_TTL_SECONDS: int = DEFAULT_CONTEXT_CACHE_TTL_SECONDS # 上游缓存的有效期
+    CONTEXT_CACHE_MAX_PER_KEY: int = DEFAULT_CONTEXT_CACHE_MAX_PER_KEY # 每个密钥最多持有的缓存数
+
+    # 密钥亲和配置
+    KEY_AFFINITY_MODE: str = DEFAULT_KEY_AFFINITY_MODE # 同一会话固定使用的密钥：off (轮询)、header (X-Conversation-Id 请求头)、client (客户端令牌)、conversation (会话开头的消息)
+
+    # 批处理配置
+    BATCH_STORAGE_DIR: str = DEFAULT_BATCH_STORAGE_DIR # 上传文件、批处理对象和结果文件的存放目录
+    BATCH_MAX_CONCURRENCY: int = DEFAULT_BATCH_MAX_CONCURRENCY # 所有批处理同时进行的上游请求数
+    BULK_MAX_WINDOW: int = DEFAULT_BULK_MAX_WINDOW # /v1/bulk/chat/completions 每个连接同时进行的请求数上限
+    EMBEDDING_MAX_CONCURRENCY: int = DEFAULT_EMBEDDING_MAX_CONCURRENCY # batchEmbedContents 拆分后每个请求同时发往上游的子批次数
+    EMBEDDING_CACHE_PATH: str = DEFAULT_EMBEDDING_CACHE_PATH # 嵌入缓存的 SQLite 文件路径，留空则不缓存
+    PREFLIGHT_MAX_INPUT_TOKENS: int = DEFAULT_PREFLIGHT_MAX_INPUT_TOKENS # 估算输入 token 数超过该值的请求在本地拒绝，0 表示不检查
+
     # Pydantic V1 BaseSettings 仍然会尝试加载 .env，但我们已经在上面显式加载了
     # 保留 Config 以防 Pydantic 内部需要它，但可以移除 env_file 指定
     class Config:
@@ -101,8 +150,21 @@ class Settings(BaseSettings):
         if not self.AUTH_TOKEN and self.ALLOWED_TOKENS:
             self.AUTH_TOKEN = self.ALLOWED_TOKENS[0]
 
+
+def apply_logging_settings(config: Settings) -> None:
+    """将日志相关配置应用到日志系统"""
+    Logger.configure(
+        level=config.LOG_LEVEL,
+        overrides=config.LOG_LEVEL_OVERRIDES,
+        log_format=config.LOG_FORMAT,
+        request_body_sample_rate=config.LOG_REQUEST_BODY_SAMPLE_RATE,
+        request_body_max_chars=config.LOG_REQUEST_BODY_MAX_CHARS,
+    )
+
+
 # 创建全局配置实例
 settings = Settings()
+apply_logging_settings(settings)
 
 # 不再设置系统环境变量，只在应用级别使用代理
 logger.info("代理配置将仅在应用级别使用，不设置系统环境变量")
@@ -314,6 +376,10 @@ async def sync_initial_settings():
     except Exception as e:
         logger.error(f"An unexpected error occurred during initial settings sync: {e}")
     finally:
+        from app.core.security import auth_index
+
+        apply_logging_settings(settings)
+        auth_index.rebuild(settings)
         if database.is_connected:
              try:
                  # Don't disconnect if it's managed elsewhere (e.g., FastAPI lifespan)
@@ -1,6 +1,7 @@
 """
 应用程序工厂模块，负责创建和配置FastAPI应用程序实例
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -12,9 +13,15 @@ from app.exception.exceptions import setup_exception_handlers
 from app.router.routes import setup_routers
 from app.service.key.key_manager import get_key_manager_instance
 from app.core.initialization import initialize_app
+from app.core.metrics import monitor_event_loop_lag
 from app.database.connection import connect_to_db, disconnect_from_db
 from app.database.initialization import initialize_database
 from app.scheduler.key_checker import start_scheduler, stop_scheduler # 导入调度器函数
+from app.service.batch.batch_service import batch_manager
+from app.service.client.api_client import close_shared_clients
+from app.service.embedding.embedding_cache import embedding_cache
+from app.service.usage.usage_tracker import token_usage_tracker
+from app.utils.json_codec import CodecJSONResponse
 
 logger = get_application_logger()
 
@@ -50,15 +57,33 @@ async def lifespan(app: FastAPI):
     start_scheduler()
     logger.info("Scheduler started successfully.")
 
+    # 启动事件循环延迟监控
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+
+    # 继续执行上次退出时未完成的批处理
+    await batch_manager.resume()
+
     yield  # 应用程序运行期间
     
     # 关闭事件
     logger.info("Application shutting down...")
+
+    loop_lag_task.cancel()
+
+    # 停止批处理，进度已写入磁盘
+    await batch_manager.stop()
+
+    # 关闭共享的上游连接池与嵌入缓存
+    await close_shared_clients()
+    embedding_cache.close()
     
     # 停止调度器
     stop_scheduler()
     logger.info("Scheduler stopped.")
 
+    # 写入尚未落库的 token 用量
+    await token_usage_tracker.flush()
+
     # 断开数据库连接
     await disconnect_from_db()
 
@@ -77,7 +102,8 @@ def create_app() -> FastAPI:
         title="Gemini Balance API",
         description="Gemini API代理服务，支持负载均衡和密钥管理",
         version="1.0.0",
-        lifespan=lifespan
+        lifespan=lifespan,
+        default_response_class=CodecJSONResponse,
     )
     
     # 配置静态文件
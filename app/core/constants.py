@@ -40,3 +40,102 @@ DEFAULT_STREAM_CHUNK_SIZE = 5
 # 正则表达式模式
 IMAGE_URL_PATTERN = r'!\[(.*?)\]\((.*?)\)'
 DATA_URL_PATTERN = r'data:([^;]+);base64,(.+)'
+
+# 错误日志查询相关常量
+ERROR_LOG_COUNT_CACHE_TTL = 60  # 错误日志总数缓存时间（秒）
+ERROR_LOG_COUNT_CACHE_SIZE = 256  # 错误日志总数缓存的最大条目数
+ERROR_LOG_SEARCH_MODES = ["fulltext", "prefix"]
+
+# 请求日志聚合与保留相关常量
+REQUEST_LATENCY_BUCKETS_MS = [100, 500, 1000, 3000, 10000, 30000]  # 与聚合表的直方图列一一对应
+STATS_ROLLUP_BATCH_SIZE = 5000  # 每个事务聚合的原始日志行数
+STATS_ROLLUP_MAX_BATCHES = 200  # 单次聚合任务最多处理的批次数
+RETENTION_DELETE_BATCH_SIZE = 5000  # 每批删除的行数
+RETENTION_MAX_BATCHES = 20  # 单次清理任务每张表最多删除的批次数
+DEFAULT_REQUEST_LOG_RETENTION_DAYS = 7
+DEFAULT_STATS_MINUTE_RETENTION_DAYS = 2
+DEFAULT_STATS_HOUR_RETENTION_DAYS = 400
+DEFAULT_STATS_ROLLUP_INTERVAL_SECONDS = 60
+DEFAULT_TOKEN_USAGE_FLUSH_INTERVAL_SECONDS = 30
+
+# API 调用详情原始记录分页
+API_CALL_RECORDS_DEFAULT_LIMIT = 100
+API_CALL_RECORDS_MAX_LIMIT = 500
+
+# 错误日志请求载荷存储
+PAYLOAD_INLINE_DATA_KEYS = ("inline_data", "inlineData")  # 存储前以哈希代替其中 data 字段的键
+ERROR_PAYLOAD_HASH_CACHE_SIZE = 1024  # 进程内记录最近已写入载荷哈希的条目数
+
+# 请求载荷构造
+FUNCTION_DECLARATION_CACHE_SIZE = 256  # 按 tools 内容缓存的已转换工具块数
+CONVERSION_CACHE_SIZE = 256  # 缓存已转换消息前缀的会话数
+CONVERSION_CACHE_ANCHOR_MESSAGES = 2  # 以会话开头的几条消息作为前缀缓存的键
+
+# 监控指标
+LATENCY_BUCKETS_SECONDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]
+EVENT_LOOP_LAG_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1]
+EVENT_LOOP_LAG_CHECK_INTERVAL = 0.5  # 事件循环延迟检测间隔（秒）
+
+# Token 用量统计查询
+TOKEN_USAGE_MAX_QUERY_HOURS = 24 * 31
+
+# 请求追踪
+DEFAULT_TRACE_SAMPLE_RATE = 0.01
+DEFAULT_TRACE_BUFFER_SIZE = 200
+TRACE_QUERY_MAX_LIMIT = 500  # 单次查询返回的最大追踪数
+
+# 客户端配额，0 表示不限制
+DEFAULT_CLIENT_RPM_LIMIT = 0
+DEFAULT_CLIENT_TPM_LIMIT = 0
+DEFAULT_CLIENT_MAX_CONCURRENT_STREAMS = 0
+
+# 准入控制与密钥冷却
+DEFAULT_KEY_COOLDOWN_SECONDS = 60
+DEFAULT_KEY_MAX_CONCURRENT_REQUESTS = 0  # 0 表示不限制
+DEFAULT_ADMISSION_QUEUE_SIZE = 200
+DEFAULT_ADMISSION_MAX_WAIT_SECONDS = 30
+DEFAULT_ADMISSION_PRIORITY = 5
+ADMISSION_PRIORITY_RANGE = (0, 9)  # 数值越小优先级越高
+ADMISSION_EWMA_ALPHA = 0.2  # 请求占用时长的指数加权平均系数
+ADMISSION_INITIAL_SERVICE_SECONDS = 2.0  # 尚无样本时假定的请求占用时长
+ADMISSION_RECHECK_INTERVAL = 1.0  # 有请求排队时重新检查容量的最长间隔（秒）
+
+# 上游上下文缓存 (cachedContents)
+DEFAULT_CONTEXT_CACHE_MIN_TOKENS = 4096
+DEFAULT_CONTEXT_CACHE_TTL_SECONDS = 300
+DEFAULT_CONTEXT_CACHE_MAX_PER_KEY = 10
+CONTEXT_CACHE_MIN_REUSE = 2  # 同一前缀出现多少次后创建缓存
+CONTEXT_CACHE_MAX_ENTRIES = 256  # 进程内跟踪的缓存条目上限，淘汰时删除上游缓存
+CONTEXT_CACHE_SIGHTINGS_SIZE = 4096  # 记录前缀出现次数的条目数
+CONTEXT_CACHE_REJECT_SECONDS = 600  # 创建失败的前缀在此时间内不再尝试
+CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS = 15  # 剩余有效期不足该秒数的缓存不再使用
+CONTEXT_CACHE_BYTES_PER_TOKEN = 4  # 按序列化字节数估算 token 数
+
+# 密钥亲和
+DEFAULT_KEY_AFFINITY_MODE = "off"
+KEY_AFFINITY_HEADER = "X-Conversation-Id"  # header 模式下携带会话标识的请求头
+KEY_AFFINITY_VIRTUAL_NODES = 100  # 每个密钥在哈希环上的虚拟节点数
+KEY_AFFINITY_LOAD_FACTOR = 1.25  # 密钥进行中的请求数上限为平均值的倍数
+
+# 批处理 (/v1/files、/v1/batches)
+DEFAULT_BATCH_STORAGE_DIR = "data/batches"
+DEFAULT_BATCH_MAX_CONCURRENCY = 4
+BATCH_MAX_FILE_BYTES = 200 * 1024 * 1024  # 单个上传文件的大小上限
+BATCH_MAX_REQUESTS = 50000  # 单个批处理的请求数上限
+BATCH_COMPLETION_WINDOW = "24h"  # 唯一支持的 completion_window
+BATCH_COMPLETION_WINDOW_SECONDS = 24 * 3600
+BATCH_PROGRESS_SAVE_INTERVAL = 5  # 运行中的批处理对象写回磁盘的最短间隔（秒）
+DEFAULT_BULK_MAX_WINDOW = 16
+BULK_MAX_LINE_BYTES = 10 * 1024 * 1024  # /v1/bulk/chat/completions 请求体中单行的大小上限
+DEFAULT_EMBEDDING_MAX_CONCURRENCY = 8
+DEFAULT_EMBEDDING_CACHE_PATH = ""
+EMBEDDING_BATCH_MAX_REQUESTS = 100  # 上游 batchEmbedContents 单次请求的条数上限
+EMBEDDING_CACHE_MAX_ENTRIES = 1000000  # 磁盘嵌入缓存的条目上限，超出时删除最早写入的条目
+EMBEDDING_CACHE_PRUNE_INTERVAL = 10000  # 每写入多少条检查一次缓存条目数
+UPSTREAM_POOL_MAX_CONNECTIONS = 100  # 共享上游客户端的连接数上限
+UPSTREAM_POOL_MAX_KEEPALIVE = 20  # 共享上游客户端保留的空闲连接数
+DEFAULT_PREFLIGHT_MAX_INPUT_TOKENS = 0
+PREFLIGHT_BYTES_PER_TOKEN = 4  # 预检时按 UTF-8 字节数估算文本的 token 数
+PREFLIGHT_MEDIA_PART_TOKENS = 258  # 预检时每个图片等媒体部分计入的 token 数
+COUNT_TOKENS_CACHE_SIZE = 4096  # countTokens 结果缓存的条目数
+COUNT_TOKENS_CACHE_TTL_SECONDS = 3600
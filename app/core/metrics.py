@@ -0,0 +1,342 @@
+"""
+Prometheus 指标模块
+
+不依赖 prometheus_client，按 Prometheus 文本格式 (0.0.4) 输出。
+带标签的指标通过 labels(*values) 获取子指标，子指标按标签值元组缓存，
+热路径上应在模块级或对象上预先取得子指标，避免每次请求构造标签字典。
+"""
+import asyncio
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from app.core.constants import (
+    EVENT_LOOP_LAG_BUCKETS,
+    EVENT_LOOP_LAG_CHECK_INTERVAL,
+    LATENCY_BUCKETS_SECONDS,
+)
+from app.log.logger import get_metrics_logger
+
+logger = get_metrics_logger()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@lru_cache(maxsize=4096)
+def key_label(api_key: str) -> str:
+    """将 API 密钥转换为可公开的标签值 (sha256 前 8 位)"""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def set_total(self, value: float) -> None:
+        """用外部已有的累计值覆盖当前值，供采集回调使用"""
+        self.value = value
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric(ABC):
+    """指标族基类"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.label_names:
+            # 无标签指标在首次观测前也导出 0 值
+            self.labels()
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一个子指标"""
+
+    def labels(self, *values: str):
+        """按位置传入标签值，返回缓存的子指标"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def clear(self) -> None:
+        """移除所有子指标，用于由采集回调整体重建的指标"""
+        self._children = {}
+
+    def _label_string(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._label_string(values)} {_format_value(child.value)}"
+            for values, child in list(self._children.items())
+        ]
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS_SECONDS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = self._label_string(values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = self._label_string(values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """注册采集回调，每次导出前调用，用于刷新按需计算的指标"""
+        self._collectors.append(collector)
+
+    def expose(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+UPSTREAM_REQUEST_DURATION = registry.register(Histogram(
+    "gemini_upstream_request_duration_seconds",
+    "Latency of upstream Gemini API calls.",
+    ("model", "key", "status"),
+))
+STREAM_TIME_TO_FIRST_TOKEN = registry.register(Histogram(
+    "gemini_stream_time_to_first_token_seconds",
+    "Time from sending a streaming request to receiving the first chunk.",
+    ("model",),
+))
+UPSTREAM_RETRIES = registry.register(Counter(
+    "gemini_upstream_retries_total",
+    "Upstream calls retried after a failure.",
+))
+KEY_FAILOVERS = registry.register(Counter(
+    "gemini_key_failovers_total",
+    "Retries that switched to a different API key.",
+))
+ACTIVE_STREAMS = registry.register(Gauge(
+    "gemini_active_streams",
+    "Streaming responses currently being proxied.",
+))
+KEY_FAILURE_COUNT = registry.register(Gauge(
+    "gemini_key_failure_count",
+    "Current failure count of each API key.",
+    ("key",),
+))
+KEY_VALID = registry.register(Gauge(
+    "gemini_key_valid",
+    "Whether each API key is below MAX_FAILURES (1) or disabled (0).",
+    ("key",),
+))
+DB_LOG_WRITES_IN_FLIGHT = registry.register(Gauge(
+    "gemini_db_log_writes_in_flight",
+    "Request/error log writes currently waiting on the database.",
+))
+CACHE_HITS = registry.register(Counter(
+    "gemini_cache_hits_total",
+    "In-process cache hits.",
+    ("cache",),
+))
+CACHE_MISSES = registry.register(Counter(
+    "gemini_cache_misses_total",
+    "In-process cache misses.",
+    ("cache",),
+))
+EVENT_LOOP_LAG = registry.register(Histogram(
+    "gemini_event_loop_lag_seconds",
+    "Delay between when a periodic event loop callback was due and when it ran.",
+    buckets=EVENT_LOOP_LAG_BUCKETS,
+))
+ADMISSION_QUEUE_DEPTH = registry.register(Gauge(
+    "gemini_admission_queue_depth",
+    "Requests waiting for API key capacity.",
+))
+ADMISSION_IN_FLIGHT = registry.register(Gauge(
+    "gemini_admission_in_flight",
+    "Admitted requests currently holding API key capacity.",
+))
+ADMISSION_QUEUE_WAIT = registry.register(Histogram(
+    "gemini_admission_queue_wait_seconds",
+    "Time admitted requests spent waiting in the queue.",
+))
+ADMISSION_SHED = registry.register(Counter(
+    "gemini_admission_shed_total",
+    "Requests rejected with 503 by admission control.",
+    ("reason",),
+))
+CONTEXT_CACHE_EVENTS = registry.register(Counter(
+    "gemini_context_cache_events_total",
+    "Upstream context cache events (hit, created, create_failed, invalidated, evicted, expired).",
+    ("event",),
+))
+
+BATCH_REQUESTS = registry.register(Counter(
+    "gemini_batch_requests_total",
+    "Batch requests executed, by outcome (completed, failed).",
+    ("outcome",),
+))
+
+
+def observe_upstream_request(model: str, api_key: str, success: bool, duration: float) -> None:
+    """记录一次上游请求的耗时"""
+    UPSTREAM_REQUEST_DURATION.labels(model, key_label(api_key), "success" if success else "error").observe(duration)
+
+
+def _collect_cache_stats() -> None:
+    from app.utils.cache import iter_caches
+
+    for cache in iter_caches():
+        CACHE_HITS.labels(cache.name).set_total(cache.hits)
+        CACHE_MISSES.labels(cache.name).set_total(cache.misses)
+
+
+def _collect_key_states() -> None:
+    from app.service.key import key_manager
+
+    manager = key_manager._singleton_instance
+    KEY_FAILURE_COUNT.clear()
+    KEY_VALID.clear()
+    if manager is None:
+        return
+    for key, fail_count in list(manager.key_failure_counts.items()):
+        label = key_label(key)
+        KEY_FAILURE_COUNT.labels(label).set(fail_count)
+        KEY_VALID.labels(label).set(1 if fail_count < manager.MAX_FAILURES else 0)
+
+
+registry.add_collector(_collect_cache_stats)
+registry.add_collector(_collect_key_states)
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_CHECK_INTERVAL) -> None:
+    """周期性休眠并记录实际唤醒时间与预期时间的偏差"""
+    lag = EVENT_LOOP_LAG.labels()
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, time.perf_counter() - expected))
@@ -1,4 +1,7 @@
-from typing import Optional
+import hashlib
+import hmac
+from functools import lru_cache
+from typing import Dict, Optional
 
 from fastapi import Header, HTTPException
 
@@ -8,14 +11,80 @@ from app.log.logger import get_security_logger
 logger = get_security_logger()
 
 
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class ClientIdentity:
+    """通过认证的客户端身份"""
+
+    __slots__ = ("client_id", "is_admin")
+
+    def __init__(self, client_id: str, is_admin: bool):
+        self.client_id = client_id
+        self.is_admin = is_admin
+
+
+class AuthIndex:
+    """
+    令牌索引，配置变更时整体重建
+
+    以令牌的 sha256 摘要为键查找客户端身份：查找耗时与令牌内容无关，
+    不会像逐个比较明文那样泄露匹配前缀的长度。管理令牌使用 hmac.compare_digest 比较。
+    """
+
+    def __init__(self):
+        self._clients: Dict[bytes, ClientIdentity] = {}
+        self._admin_digest: Optional[bytes] = None
+
+    def rebuild(self, config) -> None:
+        """根据 ALLOWED_TOKENS 和 AUTH_TOKEN 重建索引"""
+        clients: Dict[bytes, ClientIdentity] = {}
+        for token in config.ALLOWED_TOKENS:
+            if token:
+                clients[_token_digest(token)] = ClientIdentity(get_client_id(token), is_admin=False)
+        admin_digest = None
+        if config.AUTH_TOKEN:
+            admin_digest = _token_digest(config.AUTH_TOKEN)
+            clients[admin_digest] = ClientIdentity(get_client_id(config.AUTH_TOKEN), is_admin=True)
+        # 整体替换，并发请求只会看到旧索引或新索引
+        self._clients, self._admin_digest = clients, admin_digest
+        logger.debug(f"Auth index rebuilt with {len(clients)} tokens")
+
+    def lookup(self, token: Optional[str]) -> Optional[ClientIdentity]:
+        """查找令牌对应的客户端身份，无效令牌返回 None"""
+        if not token:
+            return None
+        return self._clients.get(_token_digest(token))
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """判断令牌是否为管理令牌 (AUTH_TOKEN)"""
+        admin_digest = self._admin_digest
+        if not token or admin_digest is None:
+            return False
+        return hmac.compare_digest(_token_digest(token), admin_digest)
+
+
 def verify_auth_token(token: str) -> bool:
-    return token == settings.AUTH_TOKEN
+    return auth_index.is_admin(token)
+
+
+@lru_cache(maxsize=1024)
+def get_client_id(token: Optional[str]) -> str:
+    """根据客户端令牌生成不可逆的客户端标识 (sha256 前 16 位)，用于统计"""
+    if not token:
+        return ""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+auth_index = AuthIndex()
+auth_index.rebuild(settings)
 
 
 class SecurityService:
 
     async def verify_key(self, key: str):
-        if key not in settings.ALLOWED_TOKENS and key != settings.AUTH_TOKEN:
+        if auth_index.lookup(key) is None:
             logger.error("Invalid key")
             raise HTTPException(status_code=401, detail="Invalid key")
         return key
@@ -34,7 +103,7 @@ class SecurityService:
             )
 
         token = authorization.replace("Bearer ", "")
-        if token not in settings.ALLOWED_TOKENS and token != settings.AUTH_TOKEN:
+        if auth_index.lookup(token) is None:
             logger.error("Invalid token")
             raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -48,10 +117,7 @@ class SecurityService:
             logger.error("Missing x-goog-api-key header")
             raise HTTPException(status_code=401, detail="Missing x-goog-api-key header")
 
-        if (
-            x_goog_api_key not in settings.ALLOWED_TOKENS
-            and x_goog_api_key != settings.AUTH_TOKEN
-        ):
+        if auth_index.lookup(x_goog_api_key) is None:
             logger.error("Invalid x-goog-api-key")
             raise HTTPException(status_code=401, detail="Invalid x-goog-api-key")
 
@@ -64,7 +130,7 @@ class SecurityService:
             logger.error("Missing auth_token header")
             raise HTTPException(status_code=401, detail="Missing auth_token header")
         token = authorization.replace("Bearer ", "")
-        if token != settings.AUTH_TOKEN:
+        if not auth_index.is_admin(token):
             logger.error("Invalid auth_token")
             raise HTTPException(status_code=401, detail="Invalid auth_token")
 
@@ -75,7 +141,7 @@ class SecurityService:
     ) -> str:
         """验证URL中的key或请求头中的x-goog-api-key"""
         # 如果URL中的key有效，直接返回
-        if key in settings.ALLOWED_TOKENS or key == settings.AUTH_TOKEN:
+        if auth_index.lookup(key) is not None:
             return key
         
         # 否则检查请求头中的x-goog-api-key
@@ -83,8 +149,8 @@ class SecurityService:
             logger.error("Invalid key and missing x-goog-api-key header")
             raise HTTPException(status_code=401, detail="Invalid key and missing x-goog-api-key header")
         
-        if x_goog_api_key not in settings.ALLOWED_TOKENS and x_goog_api_key != settings.AUTH_TOKEN:
+        if auth_index.lookup(x_goog_api_key) is None:
             logger.error("Invalid key and invalid x-goog-api-key")
             raise HTTPException(status_code=401, detail="Invalid key and invalid x-goog-api-key")
         
-        return x_goog_api_key
\ No newline at end of file
+        return x_goog_api_key
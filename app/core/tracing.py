@@ -0,0 +1,149 @@
+"""
+请求追踪模块
+
+按 TRACE_SAMPLE_RATE 对 API 请求采样，为采样到的请求生成追踪 ID，并记录
+密钥选择、载荷构造、上游建连、首字节、流结束等阶段的耗时。
+当前请求的追踪对象保存在 contextvar 中，未采样时各记录函数只做一次 contextvar 读取。
+完成的追踪保存在内存环形缓冲区中，供管理页面查看。
+"""
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from app.config.config import settings
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_recent_traces: Deque["Trace"] = deque(maxlen=max(settings.TRACE_BUFFER_SIZE, 1))
+
+
+class Span:
+    """追踪中的一个阶段，duration_ms 为 None 表示时间点事件"""
+
+    __slots__ = ("name", "start_ms", "duration_ms", "attributes")
+
+    def __init__(self, name: str, start_ms: float, attributes: Dict[str, Any]):
+        self.name = name
+        self.start_ms = start_ms
+        self.duration_ms: Optional[float] = None
+        self.attributes = attributes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "start_ms": round(self.start_ms, 2),
+            "duration_ms": round(self.duration_ms, 2) if self.duration_ms is not None else None,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """单个请求的追踪记录，所有时间均相对于追踪开始时刻"""
+
+    __slots__ = ("trace_id", "name", "started_at", "_start", "duration_ms", "status", "attributes", "spans")
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status: Optional[str] = None
+        self.attributes = attributes
+        self.spans: List[Span] = []
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.spans.append(Span(name, self.elapsed_ms(), attributes))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration_ms, 2) if self.duration_ms is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+def start_trace(name: str, **attributes: Any) -> Optional[Trace]:
+    """
+    按采样率开始一个追踪并设为当前追踪
+
+    Returns:
+        Optional[Trace]: 未被采样时返回 None
+    """
+    sample_rate = settings.TRACE_SAMPLE_RATE
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return None
+    trace = Trace(name, attributes)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, status: str) -> None:
+    """结束追踪并放入最近追踪缓冲区"""
+    global _recent_traces
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+    trace.duration_ms = trace.elapsed_ms()
+    trace.status = status
+    buffer_size = max(settings.TRACE_BUFFER_SIZE, 1)
+    if _recent_traces.maxlen != buffer_size:
+        _recent_traces = deque(_recent_traces, maxlen=buffer_size)
+    _recent_traces.append(trace)
+
+
+def current_trace() -> Optional[Trace]:
+    """获取当前请求的追踪，未采样时返回 None"""
+    return _current_trace.get()
+
+
+def trace_event(name: str, **attributes: Any) -> None:
+    """在当前追踪中记录一个时间点事件"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_event(name, **attributes)
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Iterator[None]:
+    """在当前追踪中记录一个阶段的耗时"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    span = Span(name, trace.elapsed_ms(), attributes)
+    trace.spans.append(span)
+    try:
+        yield
+    except BaseException as e:
+        span.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        span.duration_ms = trace.elapsed_ms() - span.start_ms
+
+
+def get_recent_traces(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """按时间倒序返回最近完成的追踪"""
+    traces = list(_recent_traces)
+    traces.reverse()
+    if limit is not None:
+        traces = traces[:limit]
+    return [trace.to_dict() for trace in traces]
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    """按追踪 ID 查找最近完成的追踪"""
+    for trace in list(_recent_traces):
+        if trace.trace_id == trace_id:
+            return trace.to_dict()
+    return None
@@ -3,7 +3,7 @@
 """
 from dotenv import dotenv_values
 
-from sqlalchemy import inspect
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 
 from app.database.connection import engine, Base
@@ -26,6 +26,59 @@ def create_tables():
         raise
 
 
+def ensure_indexes():
+    """
+    为已存在的表补建模型中新增的索引
+
+    create_all 只会为新建的表创建索引，已有表需要单独补齐。
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(engine)
+                logger.info(f"Created missing index {index.name} on {table.name}")
+            except Exception as e:
+                # 索引创建失败不影响启动，查询会退化为全表扫描
+                logger.error(f"Failed to create index {index.name} on {table.name}: {str(e)}")
+
+
+def ensure_columns():
+    """
+    为已存在的表补建模型中新增的列
+
+    新增列一律以可空列追加，已有行取 NULL。
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            statement = (
+                f"ALTER TABLE {preparer.quote(table.name)} "
+                f"ADD COLUMN {preparer.quote(column.name)} {column_type} NULL"
+            )
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(statement))
+                logger.info(f"Added missing column {column.name} to {table.name}")
+            except Exception as e:
+                logger.error(f"Failed to add column {column.name} to {table.name}: {str(e)}")
+                raise
+
+
 def import_env_to_settings():
     """
     将.env文件中的配置项导入到t_settings表中
@@ -69,6 +122,10 @@ def initialize_database():
     try:
         # 创建表
         create_tables()
+
+        # 补建列和索引
+        ensure_columns()
+        ensure_indexes()
         
         # 导入环境变量
         import_env_to_settings()
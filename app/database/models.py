@@ -2,7 +2,8 @@
 数据库模型模块
 """
 import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, Boolean # 添加 Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, JSON, Boolean, Index, LargeBinary, UniqueConstraint # 添加 Boolean
+from sqlalchemy.dialects.mysql import LONGBLOB
 
 from app.database.connection import Base
 
@@ -36,12 +37,39 @@ class ErrorLog(Base):
     error_type = Column(String(50), nullable=True, comment="错误类型")
     error_log = Column(Text, nullable=True, comment="错误日志")
     error_code = Column(Integer, nullable=True, comment="错误代码")
-    request_msg = Column(JSON, nullable=True, comment="请求消息")
+    request_msg = Column(JSON, nullable=True, comment="请求消息 (旧数据)")
+    request_msg_hash = Column(String(64), nullable=True, comment="请求载荷哈希，对应 t_error_payloads")
     request_time = Column(DateTime, default=datetime.datetime.now, comment="请求时间")
+
+    __table_args__ = (
+        # 列表页按时间倒序 + 游标分页
+        Index("idx_error_logs_request_time_id", "request_time", "id"),
+        # 按密钥前缀搜索并按时间过滤
+        Index("idx_error_logs_gemini_key_request_time", "gemini_key", "request_time"),
+        # 错误类型/内容全文检索 (仅 MySQL)
+        Index("ft_error_logs_error_type_error_log", "error_type", "error_log", mysql_prefix="FULLTEXT"),
+        Index("idx_error_logs_request_msg_hash", "request_msg_hash"),
+    )
     
     def __repr__(self):
         return f"<ErrorLog(id='{self.id}', gemini_key='{self.gemini_key}')>"
 
+
+class ErrorPayload(Base):
+    """
+    错误日志请求载荷表，按内容哈希去重，压缩存储
+    """
+    __tablename__ = "t_error_payloads"
+
+    payload_hash = Column(String(64), primary_key=True, comment="精简后载荷的 sha256")
+    encoding = Column(String(10), nullable=False, comment="压缩编码 (zstd/gzip)")
+    size = Column(Integer, nullable=False, comment="压缩前字节数")
+    payload = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"), nullable=False, comment="压缩后的载荷")
+    created_at = Column(DateTime, default=datetime.datetime.now, comment="创建时间")
+
+    def __repr__(self):
+        return f"<ErrorPayload(hash='{self.payload_hash[:12]}', size='{self.size}')>"
+
 # 新增 RequestLog 模型
 class RequestLog(Base):
     """
@@ -56,6 +84,107 @@ class RequestLog(Base):
     is_success = Column(Boolean, nullable=False, comment="请求是否成功")
     status_code = Column(Integer, nullable=True, comment="API响应状态码")
     latency_ms = Column(Integer, nullable=True, comment="请求耗时(毫秒)")
+    # 以下为流式请求最后一次尝试的时延统计，非流式请求为空
+    connect_ms = Column(Integer, nullable=True, comment="上游建连耗时(毫秒)")
+    ttfb_ms = Column(Integer, nullable=True, comment="上游首字节耗时(毫秒)")
+    ttft_ms = Column(Integer, nullable=True, comment="首个数据块输出耗时(毫秒)")
+    chunk_count = Column(Integer, nullable=True, comment="输出数据块数")
+    bytes_out = Column(BigInteger, nullable=True, comment="输出字节数")
+    gap_p50_ms = Column(Integer, nullable=True, comment="数据块间隔P50(毫秒)")
+    gap_p95_ms = Column(Integer, nullable=True, comment="数据块间隔P95(毫秒)")
+    gap_p99_ms = Column(Integer, nullable=True, comment="数据块间隔P99(毫秒)")
+
+    __table_args__ = (
+        Index("idx_request_log_request_time", "request_time"),
+    )
 
     def __repr__(self):
         return f"<RequestLog(id='{self.id}', key='{self.api_key[:4]}...', success='{self.is_success}')>"
+
+
+class RequestStatsMixin:
+    """
+    请求日志聚合表的公共字段
+
+    按 (bucket_time, api_key, model_name) 聚合，api_key/model_name 为空时存空字符串以保证唯一约束生效。
+    耗时直方图为非累计计数，latency_le_Nms 表示 (上一个边界, N] 区间内的请求数。
+    """
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bucket_time = Column(DateTime, nullable=False, comment="时间桶起点")
+    api_key = Column(String(100), nullable=False, default="", comment="使用的API密钥")
+    model_name = Column(String(100), nullable=False, default="", comment="模型名称")
+    success_count = Column(Integer, nullable=False, default=0, comment="成功次数")
+    failure_count = Column(Integer, nullable=False, default=0, comment="失败次数")
+    latency_sum_ms = Column(BigInteger, nullable=False, default=0, comment="耗时总和(毫秒)")
+    latency_le_100ms = Column(Integer, nullable=False, default=0, comment="耗时<=100ms次数")
+    latency_le_500ms = Column(Integer, nullable=False, default=0, comment="耗时(100,500]ms次数")
+    latency_le_1000ms = Column(Integer, nullable=False, default=0, comment="耗时(500,1000]ms次数")
+    latency_le_3000ms = Column(Integer, nullable=False, default=0, comment="耗时(1000,3000]ms次数")
+    latency_le_10000ms = Column(Integer, nullable=False, default=0, comment="耗时(3000,10000]ms次数")
+    latency_le_30000ms = Column(Integer, nullable=False, default=0, comment="耗时(10000,30000]ms次数")
+    latency_gt_30000ms = Column(Integer, nullable=False, default=0, comment="耗时>30000ms次数")
+
+
+class RequestStatsMinute(RequestStatsMixin, Base):
+    """
+    请求日志按分钟聚合表
+    """
+    __tablename__ = "t_request_stats_minute"
+    __table_args__ = (
+        UniqueConstraint("bucket_time", "api_key", "model_name", name="uq_request_stats_minute_bucket"),
+    )
+
+    def __repr__(self):
+        return f"<RequestStatsMinute(bucket='{self.bucket_time}', model='{self.model_name}')>"
+
+
+class RequestStatsHour(RequestStatsMixin, Base):
+    """
+    请求日志按小时聚合表
+    """
+    __tablename__ = "t_request_stats_hour"
+    __table_args__ = (
+        UniqueConstraint("bucket_time", "api_key", "model_name", name="uq_request_stats_hour_bucket"),
+    )
+
+    def __repr__(self):
+        return f"<RequestStatsHour(bucket='{self.bucket_time}', model='{self.model_name}')>"
+
+
+class StatsRollupState(Base):
+    """
+    聚合任务进度表，记录已聚合到的最大请求日志 ID
+    """
+    __tablename__ = "t_stats_rollup_state"
+
+    name = Column(String(50), primary_key=True, comment="聚合任务名称")
+    last_request_log_id = Column(Integer, nullable=False, default=0, comment="已聚合的最大请求日志ID")
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, comment="更新时间")
+
+    def __repr__(self):
+        return f"<StatsRollupState(name='{self.name}', last_id='{self.last_request_log_id}')>"
+
+
+class TokenUsage(Base):
+    """
+    Token 用量表，按小时、密钥、模型和客户端聚合
+    """
+    __tablename__ = "t_token_usage"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bucket_time = Column(DateTime, nullable=False, comment="统计时间桶 (小时)")
+    api_key = Column(String(100), nullable=False, default="", comment="使用的API密钥")
+    model_name = Column(String(100), nullable=False, default="", comment="模型名称")
+    client_id = Column(String(16), nullable=False, default="", comment="客户端标识 (令牌哈希)")
+    request_count = Column(Integer, nullable=False, default=0, comment="请求数")
+    prompt_tokens = Column(BigInteger, nullable=False, default=0, comment="输入token数")
+    completion_tokens = Column(BigInteger, nullable=False, default=0, comment="输出token数")
+    total_tokens = Column(BigInteger, nullable=False, default=0, comment="总token数")
+
+    __table_args__ = (
+        UniqueConstraint("bucket_time", "api_key", "model_name", "client_id", name="uq_token_usage_bucket"),
+        Index("idx_token_usage_bucket_time", "bucket_time"),
+    )
+
+    def __repr__(self):
+        return f"<TokenUsage(bucket='{self.bucket_time}', model='{self.model_name}', total='{self.total_tokens}')>"
@@ -1,15 +1,43 @@
 """
 数据库服务模块
 """
+import asyncio
 import json
-from typing import Dict, List, Optional, Any, Union
+import re
+from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime # Keep this import
 
-from sqlalchemy import select, insert, update, func
+from bisect import bisect_left
+from datetime import timedelta
+
+from sqlalchemy import select, insert, update, delete, func, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert, match as mysql_match
 
 from app.database.connection import database
-from app.database.models import Settings, ErrorLog, RequestLog # Import RequestLog
+from app.database.models import (
+    Settings,
+    ErrorLog,
+    ErrorPayload,
+    RequestLog,
+    RequestStatsHour,
+    RequestStatsMinute,
+    StatsRollupState,
+    TokenUsage,
+)
+from app.core.constants import (
+    ERROR_LOG_COUNT_CACHE_SIZE,
+    ERROR_LOG_COUNT_CACHE_TTL,
+    ERROR_PAYLOAD_HASH_CACHE_SIZE,
+    REQUEST_LATENCY_BUCKETS_MS,
+    RETENTION_DELETE_BATCH_SIZE,
+    RETENTION_MAX_BATCHES,
+    STATS_ROLLUP_BATCH_SIZE,
+    STATS_ROLLUP_MAX_BATCHES,
+)
+from app.core.metrics import DB_LOG_WRITES_IN_FLIGHT
 from app.log.logger import get_database_logger
+from app.utils.cache import LRUCache
+from app.utils.payload_codec import compress_payload, decompress_payload, serialize_payload
 
 logger = get_database_logger()
 
@@ -99,6 +127,39 @@ async def update_setting(key: str, value: str, description: Optional[str] = None
         return False
 
 
+# 最近已写入 t_error_payloads 的载荷哈希，重试产生的相同载荷无需再次压缩和写入
+_stored_payload_hashes = LRUCache(ERROR_PAYLOAD_HASH_CACHE_SIZE, name="error_payload_hashes")
+
+
+async def _store_error_payload(request_msg: Any) -> str:
+    """
+    精简、压缩并按哈希去重存储请求载荷
+
+    序列化和压缩在线程池中执行，避免阻塞事件循环。
+
+    Returns:
+        str: 载荷哈希
+    """
+    payload_hash, raw = await asyncio.to_thread(serialize_payload, request_msg)
+    if _stored_payload_hashes.get(payload_hash):
+        return payload_hash
+
+    encoding, blob = await asyncio.to_thread(compress_payload, raw)
+    await database.execute(
+        mysql_insert(ErrorPayload)
+        .values(
+            payload_hash=payload_hash,
+            encoding=encoding,
+            size=len(raw),
+            payload=blob,
+            created_at=datetime.now(),
+        )
+        .prefix_with("IGNORE")
+    )
+    _stored_payload_hashes.put(payload_hash, True)
+    return payload_hash
+
+
 async def add_error_log(
     gemini_key: Optional[str] = None,
     model_name: Optional[str] = None,
@@ -109,6 +170,9 @@ async def add_error_log(
 ) -> bool:
     """
     添加错误日志
+
+    请求消息中的内联二进制数据以哈希代替，压缩后存入 t_error_payloads，
+    相同载荷 (如同一请求的多次重试) 只存储一份。
     
     Args:
         gemini_key: Gemini API密钥
@@ -119,8 +183,9 @@ async def add_error_log(
     Returns:
         bool: 是否添加成功
     """
+    DB_LOG_WRITES_IN_FLIGHT.inc()
     try:
-        # 如果request_msg是字典，则转换为JSON字符串
+        # 如果request_msg是字符串，则尝试解析为JSON
         if isinstance(request_msg, dict):
             request_msg_json = request_msg
         elif isinstance(request_msg, str):
@@ -130,6 +195,10 @@ async def add_error_log(
                 request_msg_json = {"message": request_msg}
         else:
             request_msg_json = None
+
+        request_msg_hash = None
+        if request_msg_json is not None:
+            request_msg_hash = await _store_error_payload(request_msg_json)
         
         # 插入错误日志
         query = (
@@ -140,7 +209,7 @@ async def add_error_log(
                 error_log=error_log,
                 model_name=model_name,
                 error_code=error_code,
-                request_msg=request_msg_json,
+                request_msg_hash=request_msg_hash,
                 request_time=datetime.now()
             )
         )
@@ -150,6 +219,72 @@ async def add_error_log(
     except Exception as e:
         logger.error(f"Failed to add error log: {str(e)}")
         return False
+    finally:
+        DB_LOG_WRITES_IN_FLIGHT.dec()
+
+
+def encode_error_log_cursor(log: Dict[str, Any]) -> str:
+    """
+    根据列表中最后一条日志生成下一页游标
+
+    Args:
+        log: 包含 id 和 request_time 的日志字典
+
+    Returns:
+        str: 形如 "<request_time ISO>_<id>" 的游标
+    """
+    return f"{log['request_time'].isoformat()}_{log['id']}"
+
+
+def decode_error_log_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析错误日志游标
+
+    Args:
+        cursor: encode_error_log_cursor 生成的游标
+
+    Returns:
+        Tuple[datetime, int]: (request_time, id)
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    time_part, _, id_part = cursor.rpartition("_")
+    if not time_part or not id_part:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return datetime.fromisoformat(time_part), int(id_part)
+
+
+def _build_fulltext_query(term: str, prefix: bool) -> str:
+    """将用户输入转换为 BOOLEAN MODE 全文检索表达式，要求所有词都出现"""
+    words = re.sub(r'[+\-<>()~*"@]', " ", term).split()
+    suffix = "*" if prefix else ""
+    return " ".join(f"+{word}{suffix}" for word in words)
+
+
+def _apply_error_log_filters(
+    query,
+    key_search: Optional[str] = None,
+    error_search: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    error_search_mode: str = "fulltext",
+):
+    """为错误日志查询追加过滤条件，所有条件都可以走索引"""
+    if key_search:
+        # 前缀匹配，可使用 (gemini_key, request_time) 索引
+        query = query.where(ErrorLog.gemini_key.startswith(key_search, autoescape=True))
+    if error_search:
+        against = _build_fulltext_query(error_search, prefix=error_search_mode == "prefix")
+        if against:
+            query = query.where(
+                mysql_match(ErrorLog.error_type, ErrorLog.error_log, against=against).in_boolean_mode()
+            )
+    if start_date:
+        query = query.where(ErrorLog.request_time >= start_date)
+    if end_date:
+        query = query.where(ErrorLog.request_time < end_date)
+    return query
 
 
 async def get_error_logs(
@@ -158,18 +293,22 @@ async def get_error_logs(
     key_search: Optional[str] = None,
     error_search: Optional[str] = None,
     start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    error_search_mode: str = "fulltext",
 ) -> List[Dict[str, Any]]:
     """
-    获取错误日志，支持搜索和日期过滤
+    获取错误日志，支持搜索、日期过滤和游标分页
 
     Args:
         limit (int): 限制数量
-        offset (int): 偏移量
-        key_search (Optional[str]): Gemini密钥搜索词 (模糊匹配)
-        error_search (Optional[str]): 错误类型或日志内容搜索词 (模糊匹配)
+        offset (int): 偏移量 (仅在未提供 cursor 时使用)
+        key_search (Optional[str]): Gemini密钥搜索词 (前缀匹配)
+        error_search (Optional[str]): 错误类型或日志内容搜索词 (全文检索)
         start_date (Optional[datetime]): 开始日期时间
         end_date (Optional[datetime]): 结束日期时间
+        cursor (Optional[str]): 上一页最后一条日志的游标，提供时忽略 offset
+        error_search_mode (str): 'fulltext' 按整词匹配，'prefix' 按词前缀匹配
 
     Returns:
         List[Dict[str, Any]]: 错误日志列表
@@ -184,24 +323,22 @@ async def get_error_logs(
             ErrorLog.error_code,
             ErrorLog.request_time
         )
-        
-        # Apply filters
-        if key_search:
-            query = query.where(ErrorLog.gemini_key.ilike(f"%{key_search}%"))
-        if error_search:
+        query = _apply_error_log_filters(
+            query, key_search, error_search, start_date, end_date, error_search_mode
+        )
+
+        if cursor:
+            cursor_time, cursor_id = decode_error_log_cursor(cursor)
             query = query.where(
-                (ErrorLog.error_type.ilike(f"%{error_search}%")) |
-                (ErrorLog.error_log.ilike(f"%{error_search}%"))
+                (ErrorLog.request_time < cursor_time)
+                | ((ErrorLog.request_time == cursor_time) & (ErrorLog.id < cursor_id))
             )
-        if start_date:
-            query = query.where(ErrorLog.request_time >= start_date)
-        if end_date:
-            # Use the datetime object directly for comparison
-            query = query.where(ErrorLog.request_time < end_date)
-
-        # Apply ordering, limit, and offset
-        query = query.order_by(ErrorLog.id.desc()).limit(limit).offset(offset)
-        
+
+        # 按 (request_time, id) 倒序，与索引顺序一致
+        query = query.order_by(ErrorLog.request_time.desc(), ErrorLog.id.desc()).limit(limit)
+        if not cursor and offset:
+            query = query.offset(offset)
+
         result = await database.fetch_all(query)
         return [dict(row) for row in result]
     except Exception as e:
@@ -209,49 +346,77 @@ async def get_error_logs(
         raise
 
 
+_error_log_count_cache = LRUCache(
+    maxsize=ERROR_LOG_COUNT_CACHE_SIZE, ttl_seconds=ERROR_LOG_COUNT_CACHE_TTL, name="error_log_count"
+)
+
+
 async def get_error_logs_count(
     key_search: Optional[str] = None,
     error_search: Optional[str] = None,
     start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None,
+    error_search_mode: str = "fulltext",
 ) -> int:
     """
     获取符合条件的错误日志总数
 
+    无过滤条件时返回表统计信息中的近似行数；有过滤条件时返回精确计数，
+    结果按过滤条件缓存 ERROR_LOG_COUNT_CACHE_TTL 秒。
+
     Args:
-        key_search (Optional[str]): Gemini密钥搜索词 (模糊匹配)
-        error_search (Optional[str]): 错误类型或日志内容搜索词 (模糊匹配)
+        key_search (Optional[str]): Gemini密钥搜索词 (前缀匹配)
+        error_search (Optional[str]): 错误类型或日志内容搜索词 (全文检索)
         start_date (Optional[datetime]): 开始日期时间
         end_date (Optional[datetime]): 结束日期时间
+        error_search_mode (str): 搜索模式，同 get_error_logs
 
     Returns:
         int: 日志总数
     """
-    try:
-        query = select(func.count()).select_from(ErrorLog)
+    cache_key = (key_search, error_search, start_date, end_date, error_search_mode)
+    cached = _error_log_count_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-        # Apply the same filters as get_error_logs
-        if key_search:
-            query = query.where(ErrorLog.gemini_key.ilike(f"%{key_search}%"))
-        if error_search:
-            query = query.where(
-                (ErrorLog.error_type.ilike(f"%{error_search}%")) |
-                (ErrorLog.error_log.ilike(f"%{error_search}%"))
+    try:
+        if not any((key_search, error_search, start_date, end_date)):
+            count = await _get_approximate_row_count(ErrorLog.__tablename__)
+        else:
+            query = _apply_error_log_filters(
+                select(func.count()).select_from(ErrorLog),
+                key_search, error_search, start_date, end_date, error_search_mode
             )
-        if start_date:
-            query = query.where(ErrorLog.request_time >= start_date)
-        if end_date:
-            # Use the datetime object directly for comparison
-            query = query.where(ErrorLog.request_time < end_date)
-
-        count_result = await database.fetch_one(query)
-        return count_result[0] if count_result else 0
+            count_result = await database.fetch_one(query)
+            count = count_result[0] if count_result else 0
+        _error_log_count_cache.put(cache_key, count)
+        return count
     except Exception as e:
         logger.exception(f"Failed to count error logs with filters: {str(e)}") # Use exception for stack trace
         raise
 
 
+async def _get_approximate_row_count(table_name: str) -> int:
+    """从 information_schema 读取表的估算行数，避免全表 COUNT(*)"""
+    query = text(
+        "SELECT TABLE_ROWS FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name"
+    )
+    row = await database.fetch_one(query, values={"table_name": table_name})
+    return int(row[0] or 0) if row else 0
+
+
 # 新增函数：获取单条错误日志详情
+async def _load_error_payload(payload_hash: str) -> Optional[Any]:
+    """读取并解压请求载荷，载荷不存在时返回 None"""
+    row = await database.fetch_one(
+        select(ErrorPayload.payload, ErrorPayload.encoding).where(ErrorPayload.payload_hash == payload_hash)
+    )
+    if row is None:
+        return None
+    return await asyncio.to_thread(decompress_payload, row["payload"], row["encoding"])
+
+
 async def get_error_log_details(log_id: int) -> Optional[Dict[str, Any]]:
     """
     根据 ID 获取单个错误日志的详细信息
@@ -268,6 +433,8 @@ async def get_error_log_details(log_id: int) -> Optional[Dict[str, Any]]:
         if result:
             # 将 request_msg (JSONB) 转换为字符串以便在 API 中返回
             log_dict = dict(result)
+            if log_dict.get('request_msg') is None and log_dict.get('request_msg_hash'):
+                log_dict['request_msg'] = await _load_error_payload(log_dict['request_msg_hash'])
             if 'request_msg' in log_dict and log_dict['request_msg'] is not None:
                 # 确保即使是 None 或非 JSON 数据也能处理
                 try:
@@ -288,7 +455,8 @@ async def add_request_log(
     is_success: bool,
     status_code: Optional[int] = None,
     latency_ms: Optional[int] = None,
-    request_time: Optional[datetime] = None
+    request_time: Optional[datetime] = None,
+    stream_timings: Optional[Dict[str, Optional[int]]] = None
 ) -> bool:
     """
     添加 API 请求日志
@@ -300,10 +468,12 @@ async def add_request_log(
         status_code: API 响应状态码
         latency_ms: 请求耗时(毫秒)
         request_time: 请求发生时间 (如果为 None, 则使用当前时间)
+        stream_timings: 流式请求的时延统计 (StreamTimings.as_log_fields() 的结果)
 
     Returns:
         bool: 是否添加成功
     """
+    DB_LOG_WRITES_IN_FLIGHT.inc()
     try:
         log_time = request_time if request_time else datetime.now()
 
@@ -313,7 +483,8 @@ async def add_request_log(
             api_key=api_key,
             is_success=is_success,
             status_code=status_code,
-            latency_ms=latency_ms
+            latency_ms=latency_ms,
+            **(stream_timings or {})
         )
         await database.execute(query)
         # logger.debug(f"Added request log: key={api_key[:4]}..., success={is_success}, model={model_name}") # Use debug level
@@ -321,3 +492,279 @@ async def add_request_log(
     except Exception as e:
         logger.error(f"Failed to add request log: {str(e)}")
         return False
+    finally:
+        DB_LOG_WRITES_IN_FLIGHT.dec()
+
+
+# 聚合任务在 t_stats_rollup_state 中的名称
+REQUEST_LOG_ROLLUP_NAME = "request_log"
+
+# 聚合表直方图列，顺序与 REQUEST_LATENCY_BUCKETS_MS 对应，最后一列为溢出桶
+LATENCY_HISTOGRAM_COLUMNS = [f"latency_le_{bound}ms" for bound in REQUEST_LATENCY_BUCKETS_MS] + [
+    f"latency_gt_{REQUEST_LATENCY_BUCKETS_MS[-1]}ms"
+]
+_STATS_ADDITIVE_COLUMNS = ["success_count", "failure_count", "latency_sum_ms"] + LATENCY_HISTOGRAM_COLUMNS
+
+
+async def get_rollup_watermark() -> int:
+    """
+    获取已聚合到的最大请求日志 ID
+
+    Returns:
+        int: 最大已聚合 ID，尚未聚合过时返回 0
+    """
+    query = select(StatsRollupState.last_request_log_id).where(
+        StatsRollupState.name == REQUEST_LOG_ROLLUP_NAME
+    )
+    row = await database.fetch_one(query)
+    return row[0] if row else 0
+
+
+def _aggregate_request_logs(rows: List[Any], truncate) -> Dict[Tuple[datetime, str, str], Dict[str, Any]]:
+    """按 (时间桶, 密钥, 模型) 聚合原始请求日志"""
+    aggregates: Dict[Tuple[datetime, str, str], Dict[str, Any]] = {}
+    for row in rows:
+        bucket_key = (truncate(row["request_time"]), row["api_key"] or "", row["model_name"] or "")
+        agg = aggregates.get(bucket_key)
+        if agg is None:
+            agg = {column: 0 for column in _STATS_ADDITIVE_COLUMNS}
+            agg["bucket_time"], agg["api_key"], agg["model_name"] = bucket_key
+            aggregates[bucket_key] = agg
+        if row["is_success"]:
+            agg["success_count"] += 1
+        else:
+            agg["failure_count"] += 1
+        latency_ms = row["latency_ms"] or 0
+        agg["latency_sum_ms"] += latency_ms
+        agg[LATENCY_HISTOGRAM_COLUMNS[bisect_left(REQUEST_LATENCY_BUCKETS_MS, latency_ms)]] += 1
+    return aggregates
+
+
+async def _upsert_request_stats(table, aggregates: Dict[Tuple[datetime, str, str], Dict[str, Any]]) -> None:
+    """将聚合结果累加写入聚合表"""
+    if not aggregates:
+        return
+    stmt = mysql_insert(table).values(list(aggregates.values()))
+    stmt = stmt.on_duplicate_key_update(
+        {column: getattr(table, column) + stmt.inserted[column] for column in _STATS_ADDITIVE_COLUMNS}
+    )
+    await database.execute(stmt)
+
+
+async def rollup_request_logs(
+    batch_size: int = STATS_ROLLUP_BATCH_SIZE,
+    max_batches: int = STATS_ROLLUP_MAX_BATCHES,
+) -> int:
+    """
+    将新增的原始请求日志聚合到分钟表和小时表
+
+    以日志 ID 为水位线，每批在一个事务内完成聚合写入和水位线推进；
+    水位线行加 FOR UPDATE 锁，多进程同时运行时不会重复累加。
+    晚写入的流式请求日志 (request_time 较早但 ID 较大) 会被累加到对应的历史时间桶中。
+
+    Args:
+        batch_size: 每批处理的原始日志行数
+        max_batches: 本次最多处理的批次数
+
+    Returns:
+        int: 本次聚合的原始日志行数
+    """
+    processed = 0
+    try:
+        for _ in range(max_batches):
+            async with database.transaction():
+                state = await database.fetch_one(
+                    select(StatsRollupState.last_request_log_id)
+                    .where(StatsRollupState.name == REQUEST_LOG_ROLLUP_NAME)
+                    .with_for_update()
+                )
+                if state is None:
+                    await database.execute(
+                        mysql_insert(StatsRollupState)
+                        .values(name=REQUEST_LOG_ROLLUP_NAME, last_request_log_id=0, updated_at=datetime.now())
+                        .prefix_with("IGNORE")
+                    )
+                    last_id = 0
+                else:
+                    last_id = state[0]
+
+                rows = await database.fetch_all(
+                    select(
+                        RequestLog.id,
+                        RequestLog.request_time,
+                        RequestLog.api_key,
+                        RequestLog.model_name,
+                        RequestLog.is_success,
+                        RequestLog.latency_ms,
+                    )
+                    .where(RequestLog.id > last_id)
+                    .order_by(RequestLog.id)
+                    .limit(batch_size)
+                )
+                if not rows:
+                    break
+
+                await _upsert_request_stats(
+                    RequestStatsMinute,
+                    _aggregate_request_logs(rows, lambda t: t.replace(second=0, microsecond=0)),
+                )
+                await _upsert_request_stats(
+                    RequestStatsHour,
+                    _aggregate_request_logs(rows, lambda t: t.replace(minute=0, second=0, microsecond=0)),
+                )
+                await database.execute(
+                    update(StatsRollupState)
+                    .where(StatsRollupState.name == REQUEST_LOG_ROLLUP_NAME)
+                    .values(last_request_log_id=rows[-1]["id"], updated_at=datetime.now())
+                )
+            processed += len(rows)
+            if len(rows) < batch_size:
+                break
+        return processed
+    except Exception as e:
+        logger.error(f"Failed to roll up request logs: {str(e)}")
+        raise
+
+
+async def _delete_in_batches(table, condition, batch_size: int, max_batches: int) -> int:
+    """按主键分批删除满足条件的行，避免长事务和大范围锁"""
+    deleted = 0
+    for _ in range(max_batches):
+        rows = await database.fetch_all(
+            select(table.id).where(condition).order_by(table.id).limit(batch_size)
+        )
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        await database.execute(delete(table).where(table.id.in_(ids)))
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+async def prune_request_logs(
+    retention_days: int,
+    batch_size: int = RETENTION_DELETE_BATCH_SIZE,
+    max_batches: int = RETENTION_MAX_BATCHES,
+) -> int:
+    """
+    分批删除超过保留期且已完成聚合的原始请求日志
+
+    Args:
+        retention_days: 原始日志保留天数
+        batch_size: 每批删除的行数
+        max_batches: 本次最多删除的批次数
+
+    Returns:
+        int: 删除的行数
+    """
+    try:
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        watermark = await get_rollup_watermark()
+        return await _delete_in_batches(
+            RequestLog,
+            (RequestLog.request_time < cutoff) & (RequestLog.id <= watermark),
+            batch_size,
+            max_batches,
+        )
+    except Exception as e:
+        logger.error(f"Failed to prune request logs: {str(e)}")
+        raise
+
+
+async def prune_request_stats(
+    minute_retention_days: int,
+    hour_retention_days: int,
+    batch_size: int = RETENTION_DELETE_BATCH_SIZE,
+    max_batches: int = RETENTION_MAX_BATCHES,
+) -> int:
+    """
+    分批删除超过保留期的分钟/小时聚合数据
+
+    Args:
+        minute_retention_days: 分钟聚合保留天数
+        hour_retention_days: 小时聚合保留天数
+        batch_size: 每批删除的行数
+        max_batches: 本次每张表最多删除的批次数
+
+    Returns:
+        int: 删除的总行数
+    """
+    try:
+        now = datetime.now()
+        deleted = await _delete_in_batches(
+            RequestStatsMinute,
+            RequestStatsMinute.bucket_time < now - timedelta(days=minute_retention_days),
+            batch_size,
+            max_batches,
+        )
+        deleted += await _delete_in_batches(
+            RequestStatsHour,
+            RequestStatsHour.bucket_time < now - timedelta(days=hour_retention_days),
+            batch_size,
+            max_batches,
+        )
+        return deleted
+    except Exception as e:
+        logger.error(f"Failed to prune request stats: {str(e)}")
+        raise
+
+
+_TOKEN_USAGE_ADDITIVE_COLUMNS = ["request_count", "prompt_tokens", "completion_tokens", "total_tokens"]
+_TOKEN_USAGE_GROUP_COLUMNS = {"key": "api_key", "model": "model_name", "client": "client_id"}
+
+
+async def add_token_usage(rows: List[Dict[str, Any]]) -> None:
+    """
+    累加写入 token 用量
+
+    Args:
+        rows: 每项包含 bucket_time, api_key, model_name, client_id 及各用量列
+    """
+    if not rows:
+        return
+    stmt = mysql_insert(TokenUsage).values(rows)
+    stmt = stmt.on_duplicate_key_update(
+        {column: getattr(TokenUsage, column) + stmt.inserted[column] for column in _TOKEN_USAGE_ADDITIVE_COLUMNS}
+    )
+    await database.execute(stmt)
+
+
+async def get_token_usage(start_time: datetime, group_by: List[str]) -> List[Dict[str, Any]]:
+    """
+    按维度汇总 start_time 之后的 token 用量
+
+    Args:
+        start_time: 起始时间 (按小时桶过滤)
+        group_by: 汇总维度，取值为 key, model, client
+
+    Returns:
+        List[Dict[str, Any]]: 每项包含各维度列和 request_count, prompt_tokens, completion_tokens, total_tokens，
+        按 total_tokens 倒序
+
+    Raises:
+        ValueError: 维度无效
+    """
+    invalid = [name for name in group_by if name not in _TOKEN_USAGE_GROUP_COLUMNS]
+    if invalid:
+        raise ValueError(f"Invalid group_by: {', '.join(invalid)}")
+    group_columns = [getattr(TokenUsage, _TOKEN_USAGE_GROUP_COLUMNS[name]) for name in group_by]
+    sums = [
+        func.sum(getattr(TokenUsage, column)).label(column) for column in _TOKEN_USAGE_ADDITIVE_COLUMNS
+    ]
+    query = (
+        select(*group_columns, *sums)
+        .where(TokenUsage.bucket_time >= start_time.replace(minute=0, second=0, microsecond=0))
+        .group_by(*group_columns)
+        .order_by(func.sum(TokenUsage.total_tokens).desc())
+    )
+    try:
+        rows = await database.fetch_all(query)
+    except Exception as e:
+        logger.error(f"Failed to get token usage: {str(e)}")
+        raise
+    return [
+        {key: (int(value) if key in _TOKEN_USAGE_ADDITIVE_COLUMNS else value) for key, value in dict(row).items()}
+        for row in rows
+    ]
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
-from app.core.constants import DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_TOP_K, DEFAULT_TOP_P
+from app.core.constants import BATCH_COMPLETION_WINDOW, DEFAULT_MODEL, DEFAULT_TEMPERATURE, DEFAULT_TOP_K, DEFAULT_TOP_P
 
 
 class ChatRequest(BaseModel):
@@ -14,6 +14,7 @@ class ChatRequest(BaseModel):
     top_p: Optional[float] = DEFAULT_TOP_P
     top_k: Optional[int] = DEFAULT_TOP_K
     stop: Optional[List[str]] = []
+    stream_options: Optional[dict] = None
 
 
 class EmbeddingRequest(BaseModel):
@@ -30,3 +31,10 @@ class ImageGenerationRequest(BaseModel):
     quality: Optional[str] = ""
     style: Optional[str] = ""
     response_format: Optional[str] = "url"
+
+
+class BatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str = BATCH_COMPLETION_WINDOW
+    metadata: Optional[Dict[str, str]] = None
@@ -2,6 +2,8 @@
 异常处理模块，定义应用程序中使用的自定义异常和异常处理器
 """
 
+from typing import Dict, Optional
+
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -15,10 +17,11 @@ logger = get_exceptions_logger()
 class APIError(Exception):
     """API错误基类"""
 
-    def __init__(self, status_code: int, detail: str, error_code: str = None):
+    def __init__(self, status_code: int, detail: str, error_code: str = None, headers: Optional[Dict[str, str]] = None):
         self.status_code = status_code
         self.detail = detail
         self.error_code = error_code or "api_error"
+        self.headers = headers
         super().__init__(self.detail)
 
 
@@ -70,12 +73,36 @@ class APIKeyError(APIError):
 class ServiceUnavailableError(APIError):
     """服务不可用错误"""
 
-    def __init__(self, detail: str = "Service temporarily unavailable"):
+    def __init__(self, detail: str = "Service temporarily unavailable", retry_after: Optional[int] = None):
         super().__init__(
-            status_code=503, detail=detail, error_code="service_unavailable"
+            status_code=503,
+            detail=detail,
+            error_code="service_unavailable",
+            headers={"Retry-After": str(retry_after)} if retry_after else None,
         )
 
 
+class RateLimitError(APIError):
+    """客户端超出配额错误，响应格式与 OpenAI 的 429 一致"""
+
+    def __init__(self, detail: str = "Rate limit reached", retry_after: int = 1):
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            error_code="rate_limit_exceeded",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class UpstreamKeyError(Exception):
+    """上游请求失败，api_key 为实际发出请求的密钥 (命中上下文缓存时与路由选择的密钥不同)"""
+
+    def __init__(self, api_key: str, message: str):
+        self.api_key = api_key
+        super().__init__(message)
+
+
 def setup_exception_handlers(app: FastAPI) -> None:
     """
     设置应用程序的异常处理器
@@ -88,9 +115,14 @@ def setup_exception_handlers(app: FastAPI) -> None:
     async def api_error_handler(request: Request, exc: APIError):
         """处理API错误"""
         logger.error(f"API Error: {exc.detail} (Code: {exc.error_code})")
+        error = {"code": exc.error_code, "message": exc.detail}
+        if isinstance(exc, RateLimitError):
+            # OpenAI SDK 依据 type 区分限流错误
+            error.update({"type": "rate_limit_error", "param": None})
         return JSONResponse(
             status_code=exc.status_code,
-            content={"error": {"code": exc.error_code, "message": exc.detail}},
+            content={"error": error},
+            headers=exc.headers,
         )
 
     @app.exception_handler(StarletteHTTPException)
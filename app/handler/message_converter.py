@@ -1,13 +1,20 @@
 # app/services/chat/message_converter.py
 
 from abc import ABC, abstractmethod
-import json
 import re
 from typing import Any, Dict, List, Optional, Tuple
 import requests
 import base64
 
-from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, SUPPORTED_ROLES
+from app.core.constants import (
+    CONVERSION_CACHE_ANCHOR_MESSAGES,
+    CONVERSION_CACHE_SIZE,
+    DATA_URL_PATTERN,
+    IMAGE_URL_PATTERN,
+    SUPPORTED_ROLES,
+)
+from app.utils import json_codec
+from app.utils.cache import LRUCache
 
 
 class MessageConverter(ABC):
@@ -109,54 +116,117 @@ def _process_text_with_image(text: str) -> List[Dict[str, Any]]:
     return parts
 
 
+# 单条消息的转换结果 (role, parts)
+_ConvertedMessage = Tuple[str, List[Dict[str, Any]]]
+
+
+def _convert_message(msg: Dict[str, Any], is_penultimate: bool, is_last: bool) -> _ConvertedMessage:
+    """
+    转换单条消息，不修改原消息
+
+    只有倒数两条消息的转换与位置有关：倒数第二条 assistant 消息按段落分割，最后一条未知角色的消息视为用户消息。
+    """
+    role = msg.get("role", "")
+
+    parts = []
+    # 特别处理最后一个assistant的消息，按\n\n分割
+    if "content" in msg and isinstance(msg["content"], str) and msg["content"] and role == "assistant" and is_penultimate:
+        # 按\n\n分割消息
+        content_parts = msg["content"].split("\n\n")
+        for part in content_parts:
+            if not part.strip():  # 跳过空内容
+                continue
+            # 处理可能包含图片的文本
+            parts.extend(_process_text_with_image(part))
+    elif "content" in msg and isinstance(msg["content"], str) and msg["content"]:
+        # 请求 gemini 接口时如果包含 content 字段但内容为空时会返回 400 错误，所以需要判断是否为空并移除
+        parts.extend(_process_text_with_image(msg["content"]))
+    elif "content" in msg and isinstance(msg["content"], list):
+        for content in msg["content"]:
+            if isinstance(content, str) and content:
+                parts.append({"text": content})
+            elif isinstance(content, dict):
+                if content["type"] == "text" and content["text"]:
+                    parts.append({"text": content["text"]})
+                elif content["type"] == "image_url":
+                    parts.append(_convert_image(content["image_url"]["url"]))
+    elif "tool_calls" in msg and isinstance(msg["tool_calls"], list):
+        for tool_call in msg["tool_calls"]:
+            function = tool_call.get("function", {})
+            # 复制而不是原地修改，请求中的消息可能被缓存用于比较
+            function_call = {key: value for key, value in function.items() if key != "arguments"}
+            function_call["args"] = json_codec.loads(function.get("arguments", "{}"))
+            parts.append({"functionCall": function_call})
+
+    if role not in SUPPORTED_ROLES:
+        if role == "tool":
+            role = "user"
+        else:
+            # 如果是最后一条消息，则认为是用户消息
+            if is_last:
+                role = "user"
+            else:
+                role = "model"
+    return role, parts
+
+
+class _ConvertedPrefix:
+    """一个会话已转换的消息前缀，messages 为原消息，results 为逐条的转换结果"""
+
+    __slots__ = ("messages", "results")
+
+    def __init__(self, messages: List[Dict[str, Any]], results: List[_ConvertedMessage]):
+        self.messages = messages
+        self.results = results
+
+
+# 会话开头的消息 -> 最近一次转换的消息前缀
+_prefix_cache = LRUCache(CONVERSION_CACHE_SIZE, name="conversation_prefixes")
+
+
+def _reuse_prefix(messages: List[Dict[str, Any]], stable: int) -> Tuple[Optional[bytes], List[_ConvertedMessage]]:
+    """
+    查找与本次请求开头相同的已转换前缀
+
+    Returns:
+        (缓存键, 可复用的转换结果)，消息数不足以缓存时缓存键为 None
+    """
+    if stable < CONVERSION_CACHE_ANCHOR_MESSAGES:
+        return None, []
+    key = json_codec.dumps_bytes(messages[:CONVERSION_CACHE_ANCHOR_MESSAGES])
+    entry = _prefix_cache.get(key)
+    if entry is None:
+        return key, []
+    # 键只覆盖会话开头，逐条比较原消息确认前缀相同，不同会话的开头相同时也不会误用
+    limit = min(len(entry.messages), stable)
+    if entry.messages[:limit] == messages[:limit]:
+        return key, entry.results[:limit]
+    reused = 0
+    while reused < limit and entry.messages[reused] == messages[reused]:
+        reused += 1
+    return key, entry.results[:reused]
+
+
 class OpenAIMessageConverter(MessageConverter):
-    """OpenAI消息格式转换器"""
+    """
+    OpenAI消息格式转换器
+
+    多轮对话每次都会带上完整的历史消息，已转换的前缀按会话缓存，新的一轮只转换新增的消息。
+    倒数两条消息的转换与位置有关，不计入缓存的前缀。
+    """
 
     def convert(self, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        count = len(messages)
+        stable = count - 2
+        key, results = _reuse_prefix(messages, stable)
+        for idx in range(len(results), count):
+            results.append(_convert_message(messages[idx], idx == count - 2, idx == count - 1))
+        if key is not None:
+            _prefix_cache.put(key, _ConvertedPrefix(messages[:stable], results[:stable]))
+
         converted_messages = []
         system_instruction_parts = []
-
-        for idx, msg in enumerate(messages):
-            role = msg.get("role", "")
-            
-            parts = []
-            # 特别处理最后一个assistant的消息，按\n\n分割
-            if "content" in msg and isinstance(msg["content"], str) and msg["content"] and role == "assistant" and idx == len(messages) - 2:
-                # 按\n\n分割消息
-                content_parts = msg["content"].split("\n\n")
-                for part in content_parts:
-                    if not part.strip():  # 跳过空内容
-                        continue
-                    # 处理可能包含图片的文本
-                    parts.extend(_process_text_with_image(part))
-            elif "content" in msg and isinstance(msg["content"], str) and msg["content"]:
-                # 请求 gemini 接口时如果包含 content 字段但内容为空时会返回 400 错误，所以需要判断是否为空并移除
-                parts.extend(_process_text_with_image(msg["content"]))
-            elif "content" in msg and isinstance(msg["content"], list):
-                for content in msg["content"]:
-                    if isinstance(content, str) and content:
-                        parts.append({"text": content})
-                    elif isinstance(content, dict):
-                        if content["type"] == "text" and content["text"]:
-                            parts.append({"text": content["text"]})
-                        elif content["type"] == "image_url":
-                            parts.append(_convert_image(content["image_url"]["url"]))
-            elif "tool_calls" in msg and isinstance(msg["tool_calls"], list):
-                for tool_call in msg["tool_calls"]:
-                    function_call = tool_call.get("function",{})
-                    function_call["args"] = json.loads(function_call.get("arguments","{}"))
-                    del function_call["arguments"]
-                    parts.append({"functionCall": function_call})
-            
-            if role not in SUPPORTED_ROLES:
-                if role == "tool":
-                    role = "user"
-                else:
-                    # 如果是最后一条消息，则认为是用户消息
-                    if idx == len(messages) - 1:
-                        role = "user"
-                    else:
-                        role = "model"
+        for role, parts in results:
             if parts:
                 if role == "system":
                     system_instruction_parts.extend(parts)
@@ -171,4 +241,4 @@ class OpenAIMessageConverter(MessageConverter):
                 "parts": system_instruction_parts,
             }
         )
-        return converted_messages, system_instruction
\ No newline at end of file
+        return converted_messages, system_instruction
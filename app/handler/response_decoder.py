@@ -0,0 +1,85 @@
+"""
+Gemini 响应解码模块
+
+只解码格式转换用到的字段 (各个 part 和 groundingMetadata 中的网页来源)，原始字典不会被修改。
+每个候选结果解码为一个带 __slots__ 的对象，part 解码为 (kind, value, raw) 元组，避免为每个 part 创建对象。
+流式块与非流式响应的结构相同，使用同一套解码。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# part 的类型
+PART_TEXT = "text"
+PART_FUNCTION_CALL = "function_call"
+PART_INLINE_DATA = "inline_data"
+PART_CODE = "code"
+PART_CODE_RESULT = "code_result"
+
+# (kind, value, raw)：kind 为 PART_* 之一，value 为对应字段的值 (文本或字典)，raw 为原始 part
+GeminiPart = Tuple[str, Any, Dict[str, Any]]
+
+_NO_SOURCES: List[Dict[str, Any]] = []
+
+
+def _decode_part(raw: Dict[str, Any]) -> Optional[GeminiPart]:
+    """解码文本以外的 part，未识别的 part 返回 None"""
+    if "functionCall" in raw:
+        return PART_FUNCTION_CALL, raw["functionCall"], raw
+    if "inlineData" in raw:
+        return PART_INLINE_DATA, raw["inlineData"], raw
+    # 代码执行的两种字段名都可能出现
+    code = raw.get("executableCode") or raw.get("codeExecution")
+    if code is not None:
+        return PART_CODE, code, raw
+    result = raw.get("codeExecutionResult") or raw.get("executableCodeResult")
+    if result is not None:
+        return PART_CODE_RESULT, result, raw
+    return None
+
+
+class GeminiCandidate:
+    """
+    解码后的候选结果
+
+    parts 按原顺序保存思考过程以外的 part；thoughts 为 thought 为 true 的 part 的文本，没有时为 None；
+    has_function_call 表示 parts 中是否有函数调用。
+    """
+
+    __slots__ = ("parts", "thoughts", "has_function_call", "web_sources")
+
+    def __init__(self, raw: Dict[str, Any]):
+        content = raw.get("content")
+        raw_parts = content.get("parts") if content else None
+        parts: List[GeminiPart] = []
+        thoughts: Optional[List[str]] = None
+        has_function_call = False
+        if raw_parts:
+            for part in raw_parts:
+                text = part.get("text")
+                if text is not None:
+                    if part.get("thought"):
+                        if thoughts is None:
+                            thoughts = []
+                        thoughts.append(text)
+                    else:
+                        parts.append((PART_TEXT, text, part))
+                else:
+                    decoded = _decode_part(part)
+                    if decoded is not None:
+                        has_function_call = has_function_call or decoded[0] is PART_FUNCTION_CALL
+                        parts.append(decoded)
+        self.parts = parts
+        self.thoughts = thoughts
+        self.has_function_call = has_function_call
+        grounding = raw.get("groundingMetadata")
+        self.web_sources: List[Dict[str, Any]] = (
+            [chunk["web"] for chunk in grounding.get("groundingChunks") or () if "web" in chunk]
+            if grounding else _NO_SOURCES
+        )
+
+
+def decode_candidate(response: Dict[str, Any]) -> Optional[GeminiCandidate]:
+    """解码响应的第一个候选结果，没有候选结果时返回 None"""
+    candidates = response.get("candidates") if response else None
+    if not candidates:
+        return None
+    return GeminiCandidate(candidates[0])
@@ -1,14 +1,22 @@
 # app/services/chat/response_handler.py
 
 import base64
-import json
-import random
-import string
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Optional, Tuple
 import time
 import uuid
 from app.config.config import settings
+from app.handler.response_decoder import (
+    PART_CODE,
+    PART_CODE_RESULT,
+    PART_FUNCTION_CALL,
+    PART_INLINE_DATA,
+    PART_TEXT,
+    GeminiCandidate,
+    GeminiPart,
+    decode_candidate,
+)
+from app.utils import json_codec
 from app.utils.uploader import ImageUploaderFactory
 
 
@@ -33,6 +41,35 @@ class GeminiResponseHandler(ResponseHandler):
         return _handle_gemini_normal_response(response, model, stream)
 
 
+def extract_usage(response: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    将 Gemini 响应中的 usageMetadata 转换为 OpenAI 格式的 usage
+
+    思考过程的 token (thoughtsTokenCount) 计入 completion_tokens，命中上下文缓存的 token 数
+    (cachedContentTokenCount) 放在 prompt_tokens_details.cached_tokens 中。流式响应中每个块的
+    usageMetadata 都是累计值，取最后一个即可。没有 usageMetadata 时返回 None。
+    """
+    metadata = response.get("usageMetadata") if response else None
+    if not metadata:
+        return None
+    prompt_tokens = metadata.get("promptTokenCount", 0)
+    completion_tokens = metadata.get("candidatesTokenCount", 0) + metadata.get("thoughtsTokenCount", 0)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": metadata.get("totalTokenCount", prompt_tokens + completion_tokens),
+    }
+    cached_tokens = metadata.get("cachedContentTokenCount")
+    if cached_tokens:
+        # 命中上下文缓存的输入 token，已计入 prompt_tokens
+        usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+    return usage
+
+
+def _empty_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
 def _handle_openai_stream_response(response: Dict[str, Any], model: str, finish_reason: str) -> Dict[str, Any]:
     text, tool_calls = _extract_result(response, model, stream=True, gemini_format=False)
     if not text and not tool_calls:
@@ -65,7 +102,19 @@ def _handle_openai_normal_response(response: Dict[str, Any], model: str, finish_
                 "finish_reason": finish_reason,
             }
         ],
-        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        "usage": extract_usage(response) or _empty_usage(),
+    }
+
+
+def _handle_openai_usage_chunk(usage: Optional[Dict[str, int]], model: str) -> Dict[str, Any]:
+    """stream_options.include_usage 时在结束前输出的用量块"""
+    return {
+        "id": f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [],
+        "usage": usage or _empty_usage(),
     }
 
 
@@ -88,6 +137,9 @@ class OpenAIResponseHandler(ResponseHandler):
             return _handle_openai_stream_response(response, model, finish_reason)
         return _handle_openai_normal_response(response, model, finish_reason)
     
+    def handle_usage_chunk(self, usage: Optional[Dict[str, int]], model: str) -> Dict[str, Any]:
+        return _handle_openai_usage_chunk(usage, model)
+
     def handle_image_chat_response(self, image_str: str, model: str, stream=False, finish_reason="stop"):
         if stream:
             return _handle_openai_stream_image_response(image_str,model,finish_reason)
@@ -130,71 +182,55 @@ def _handle_openai_normal_image_response(image_str: str,model: str,finish_reason
     }
 
 
+def _render_part(kind: str, value: Any) -> str:
+    """将单个 part 转换为文本，函数调用等无文本的 part 返回空字符串"""
+    if kind is PART_TEXT:
+        return value
+    if kind is PART_CODE:
+        return _format_code_block(value)
+    if kind is PART_CODE_RESULT:
+        return _format_execution_result(value)
+    if kind is PART_INLINE_DATA:
+        return _extract_image_data(value)
+    return ""
+
+
+def _render_text(candidate: GeminiCandidate, model: str, stream: bool) -> str:
+    """
+    拼接候选结果中所有 part 的文本
+
+    思考过程 (thought 为 true 的 part，或旧版思考模型非流式响应中两个文本 part 的第一个) 仅在
+    SHOW_THINKING_PROCESS 开启时输出，非流式响应中以引用块与正文分隔。
+    """
+    parts = candidate.parts
+    thoughts = candidate.thoughts
+    if thoughts is None and len(parts) == 1:
+        return _render_part(parts[0][0], parts[0][1])
+    if (
+        thoughts is None and not stream and "thinking" in model
+        and len(parts) == 2 and parts[0][0] is PART_TEXT
+    ):
+        thoughts, parts = [parts[0][1]], parts[1:]
+    text = "".join([_render_part(kind, value) for kind, value, _ in parts])
+    if thoughts and settings.SHOW_THINKING_PROCESS:
+        thinking_text = "".join(thoughts)
+        if stream:
+            return thinking_text + text
+        return "> thinking\n\n" + thinking_text + "\n\n---\n> output\n\n" + text
+    return text
+
+
 def _extract_result(response: Dict[str, Any], model: str, stream: bool = False, gemini_format: bool = False) -> Tuple[str, List[Dict[str, Any]]]:
-    text, tool_calls = "", []
-    if stream:
-        if response.get("candidates"):
-            candidate = response["candidates"][0]
-            content = candidate.get("content", {})
-            parts = content.get("parts", [])
-            if not parts:
-                return "", []
-            if "text" in parts[0]:
-                text = parts[0].get("text")
-            elif "executableCode" in parts[0]:
-                text = _format_code_block(parts[0]["executableCode"])
-            elif "codeExecution" in parts[0]:
-                text = _format_code_block(parts[0]["codeExecution"])
-            elif "executableCodeResult" in parts[0]:
-                text = _format_execution_result(
-                    parts[0]["executableCodeResult"]
-                )
-            elif "codeExecutionResult" in parts[0]:
-                text = _format_execution_result(
-                    parts[0]["codeExecutionResult"]
-                )
-            elif "inlineData" in parts[0]:
-                text = _extract_image_data(parts[0])
-            else:
-                text = ""
-            text = _add_search_link_text(model, candidate, text)
-            tool_calls = _extract_tool_calls(parts, gemini_format)
-    else:
-        if response.get("candidates"):
-            candidate = response["candidates"][0]
-            if "thinking" in model:
-                if settings.SHOW_THINKING_PROCESS:
-                    if len(candidate["content"]["parts"]) == 2:
-                        text = (
-                                "> thinking\n\n"
-                                + candidate["content"]["parts"][0]["text"]
-                                + "\n\n---\n> output\n\n"
-                                + candidate["content"]["parts"][1]["text"]
-                        )
-                    else:
-                        text = candidate["content"]["parts"][0]["text"]
-                else:
-                    if len(candidate["content"]["parts"]) == 2:
-                        text = candidate["content"]["parts"][1]["text"]
-                    else:
-                        text = candidate["content"]["parts"][0]["text"]
-            else:
-                text = ""
-                if "parts" in candidate["content"]:
-                    for part in candidate["content"]["parts"]:
-                        if "text" in part:
-                            text += part["text"]
-                        elif "inlineData" in part:
-                            text += _extract_image_data(part)
-
-
-            text = _add_search_link_text(model, candidate, text)
-            tool_calls = _extract_tool_calls(candidate["content"]["parts"], gemini_format)
-        else:
-            text = "暂无返回"
-    return text, tool_calls
+    candidate = decode_candidate(response)
+    if candidate is None:
+        return ("", []) if stream else ("暂无返回", [])
+    text = _add_search_link_text(model, candidate, _render_text(candidate, model, stream))
+    if not candidate.has_function_call:
+        return text, []
+    return text, _extract_tool_calls(candidate.parts, gemini_format)
+
 
-def _extract_image_data(part: dict) -> str:
+def _extract_image_data(inline_data: Dict[str, Any]) -> str:
     image_uploader = None
     if settings.UPLOAD_PROVIDER == "smms":
         image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER,api_key=settings.SMMS_SECRET_TOKEN)
@@ -204,7 +240,7 @@ def _extract_image_data(part: dict) -> str:
         image_uploader = ImageUploaderFactory.create(provider=settings.UPLOAD_PROVIDER,base_url=settings.CLOUDFLARE_IMGBED_URL,auth_code=settings.CLOUDFLARE_IMGBED_AUTH_CODE)
     current_date = time.strftime("%Y/%m/%d")
     filename = f"{current_date}/{uuid.uuid4().hex[:8]}.png"
-    base64_data = part["inlineData"]["data"]
+    base64_data = inline_data["data"]
     #将base64_data转成bytes数组
     bytes_data = base64.b64decode(base64_data)
     upload_response = image_uploader.upload(bytes_data,filename)
@@ -214,60 +250,51 @@ def _extract_image_data(part: dict) -> str:
         text = ""
     return text
     
-def _extract_tool_calls(parts: List[Dict[str, Any]], gemini_format: bool) -> List[Dict[str, Any]]:
-    """提取工具调用信息"""
-    if not parts or not isinstance(parts, list):
-        return []
-
-    letters = string.ascii_lowercase + string.digits
-
+def _extract_tool_calls(parts: List[GeminiPart], gemini_format: bool) -> List[Dict[str, Any]]:
+    """提取工具调用信息，Gemini 格式直接返回原始 part"""
     tool_calls = list()
-    for i in range(len(parts)):
-        part = parts[i]
-        if not part or not isinstance(part, dict):
-            continue
-
-        item = part.get("functionCall", {})
-        if not item or not isinstance(item, dict):
+    for i, (kind, item, raw) in enumerate(parts):
+        if kind is not PART_FUNCTION_CALL or not item or not isinstance(item, dict):
             continue
 
         if gemini_format:
-            tool_calls.append(part)
+            tool_calls.append(raw)
         else:
-            id = f"call_{''.join(random.sample(letters, 32))}"
-            name = item.get("name", "")
-            arguments = json.dumps(item.get("args", None) or {})
-
             tool_calls.append(
                 {
                     "index": i,
-                    "id": id,
+                    "id": f"call_{uuid.uuid4().hex}",
                     "type": "function",
-                    "function": {"name": name, "arguments": arguments},
+                    "function": {
+                        "name": item.get("name", ""),
+                        "arguments": json_codec.dumps(item.get("args", None) or {}),
+                    },
                 }
             )
 
     return tool_calls
 
 
-def _handle_gemini_stream_response(response: Dict[str, Any], model: str, stream: bool) -> Dict[str, Any]:
+def _to_gemini_response(response: Dict[str, Any], model: str, stream: bool) -> Dict[str, Any]:
+    """以转换后的内容替换第一个候选结果的 content，返回新的响应字典，原响应不会被修改"""
+    if not response.get("candidates"):
+        return dict(response)
     text, tool_calls = _extract_result(response, model, stream=stream, gemini_format=True)
     if tool_calls:
         content = {"parts": tool_calls, "role": "model"}
     else:
         content = {"parts": [{"text": text}], "role": "model"}
-    response["candidates"][0]["content"] = content
-    return response
+    candidates = list(response["candidates"])
+    candidates[0] = {**candidates[0], "content": content}
+    return {**response, "candidates": candidates}
+
+
+def _handle_gemini_stream_response(response: Dict[str, Any], model: str, stream: bool) -> Dict[str, Any]:
+    return _to_gemini_response(response, model, stream)
 
 
 def _handle_gemini_normal_response(response: Dict[str, Any], model: str, stream: bool) -> Dict[str, Any]:
-    text, tool_calls = _extract_result(response, model, stream=stream, gemini_format=True)
-    if tool_calls:
-        content = {"parts": tool_calls, "role": "model"}
-    else:
-        content = {"parts": [{"text": text}], "role": "model"}
-    response["candidates"][0]["content"] = content
-    return response
+    return _to_gemini_response(response, model, stream)
 
 
 def _format_code_block(code_data: dict) -> str:
@@ -277,22 +304,11 @@ def _format_code_block(code_data: dict) -> str:
     return f"""\n\n---\n\n【代码执行】\n```{language}\n{code}\n```\n"""
 
 
-def _add_search_link_text(model: str, candidate: dict, text: str) -> str:
-    if (
-            settings.SHOW_SEARCH_LINK
-            and model.endswith("-search")
-            and "groundingMetadata" in candidate
-            and "groundingChunks" in candidate["groundingMetadata"]
-    ):
-        grounding_chunks = candidate["groundingMetadata"]["groundingChunks"]
-        text += "\n\n---\n\n"
-        text += "**【引用来源】**\n\n"
-        for _, grounding_chunk in enumerate(grounding_chunks, 1):
-            if "web" in grounding_chunk:
-                text += _create_search_link(grounding_chunk["web"])
-        return text
-    else:
-        return text
+def _add_search_link_text(model: str, candidate: GeminiCandidate, text: str) -> str:
+    if candidate.web_sources and settings.SHOW_SEARCH_LINK and model.endswith("-search"):
+        links = "".join(_create_search_link(source) for source in candidate.web_sources)
+        return text + "\n\n---\n\n**【引用来源】**\n\n" + links
+    return text
 
 
 def _create_search_link(grounding_chunk: dict) -> str:
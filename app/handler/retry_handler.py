@@ -1,14 +1,45 @@
 # app/services/chat/retry_handler.py
 
 from functools import wraps
-from typing import Callable, TypeVar
+from typing import Callable, Optional, TypeVar
 
 from app.core.constants import MAX_RETRIES
+from app.exception.exceptions import APIError, UpstreamKeyError
 from app.log.logger import get_retry_logger
+from app.utils.helpers import extract_status_code
 
 T = TypeVar("T")
 logger = get_retry_logger()
 
+# 与密钥有关的状态码：密钥无效、无权限或被限流，换密钥重试可能成功
+_KEY_ERROR_STATUS_CODES = (401, 403, 429)
+# 密钥无效时上游返回 400，错误信息中带有此原因
+_KEY_INVALID_REASON = "API_KEY_INVALID"
+
+
+def _failed_key(error: BaseException, default: str) -> str:
+    """沿 __cause__ 链查找实际发出请求的密钥，找不到时使用参数中的密钥"""
+    while error is not None:
+        if isinstance(error, UpstreamKeyError):
+            return error.api_key
+        error = error.__cause__
+    return default
+
+
+def upstream_client_error(error: BaseException, detail: str) -> Optional[APIError]:
+    """
+    上游因请求本身有误返回的 4xx 换密钥重试也不会成功，转换为 APIError，使 RetryHandler 直接抛出且不计入密钥失败次数
+
+    Returns:
+        Optional[APIError]: 与密钥无关的上游 4xx 错误，其他错误返回 None
+    """
+    status_code = extract_status_code(error)
+    if status_code is None or not 400 <= status_code < 500 or status_code in _KEY_ERROR_STATUS_CODES:
+        return None
+    if _KEY_INVALID_REASON in str(error):
+        return None
+    return APIError(status_code, detail, "invalid_request_error")
+
 
 class RetryHandler:
     """重试处理装饰器"""
@@ -25,6 +56,9 @@ class RetryHandler:
             for attempt in range(self.max_retries):
                 try:
                     return await func(*args, **kwargs)
+                except APIError:
+                    # 本地产生的错误 (客户端超出配额、请求预检失败等) 与密钥无关，不重试也不计入密钥失败次数
+                    raise
                 except Exception as e:
                     last_exception = e
                     logger.warning(
@@ -34,8 +68,10 @@ class RetryHandler:
                     # 从函数参数中获取 key_manager
                     key_manager = kwargs.get("key_manager")
                     if key_manager:
-                        old_key = kwargs.get(self.key_arg)
-                        new_key = await key_manager.handle_api_failure(old_key, attempt + 1)
+                        old_key = _failed_key(e, kwargs.get(self.key_arg))
+                        new_key = await key_manager.handle_api_failure(
+                            old_key, attempt + 1, extract_status_code(e)
+                        )
                         if not new_key:
                             logger.error(f"No valid API key available after attempt {attempt + 1}")
                             break  # 如果没有有效的API密钥，提前退出重试循环
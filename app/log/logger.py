@@ -1,6 +1,11 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 import platform
 
 # ANSI转义序列颜色代码
@@ -33,10 +38,30 @@ class ColoredFormatter(logging.Formatter):
         return super().format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    JSON Lines 格式化器，每条日志输出为一行 JSON
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
 # 日志格式
 FORMATTER = ColoredFormatter(
     "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
 )
+JSON_FORMATTER = JsonFormatter()
 
 # 日志级别映射
 LOG_LEVELS = {
@@ -48,34 +73,83 @@ LOG_LEVELS = {
 }
 
 
+# 值在入队后不会再变化的参数类型，带这些参数的消息可以推迟到后台线程再格式化
+_IMMUTABLE_ARG_TYPES = (str, bytes, int, float, type(None))
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    只做最少处理就放入队列的 QueueHandler
+
+    默认的 prepare 会在调用线程上完成格式化，这里对 logger.info("...%s", value) 形式的调用保留参数，
+    消息的拼接、格式化和输出都交给 QueueListener 的后台线程；
+    参数中有可变对象时才在调用线程上固定消息，避免后台线程格式化时对象已被修改。
+    """
+
+    def prepare(self, record):
+        if record.args and not (
+            isinstance(record.args, tuple) and all(isinstance(arg, _IMMUTABLE_ARG_TYPES) for arg in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
 class Logger:
     def __init__(self):
         pass
 
     _loggers: Dict[str, logging.Logger] = {}
+    _default_level: int = logging.INFO
+    _level_overrides: Dict[str, int] = {}
+    _explicit_levels: Dict[str, int] = {}
+    _queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    _queue_handler: logging.Handler = _LazyQueueHandler(_queue)
+    _output_handler: logging.Handler = logging.StreamHandler(sys.stdout)
+    _output_handler.setFormatter(FORMATTER)
+    _listener: Optional[logging.handlers.QueueListener] = None
+    request_body_sample_rate: float = 1.0
+    request_body_max_chars: int = 2000
+
+    @staticmethod
+    def _ensure_listener() -> None:
+        """首次创建 logger 时启动后台输出线程，进程退出时输出剩余日志"""
+        if Logger._listener is None:
+            Logger._listener = logging.handlers.QueueListener(
+                Logger._queue, Logger._output_handler, respect_handler_level=False
+            )
+            Logger._listener.start()
+            atexit.register(Logger._listener.stop)
+
+    @staticmethod
+    def _level_for(name: str) -> int:
+        if name in Logger._level_overrides:
+            return Logger._level_overrides[name]
+        return Logger._explicit_levels.get(name, Logger._default_level)
 
     @staticmethod
     def setup_logger(
             name: str,
-            level: str = "debug",
+            level: Optional[str] = None,
     ) -> logging.Logger:
         """
         设置并获取logger
         :param name: logger名称
-        :param level: 日志级别
+        :param level: 日志级别，为空时使用 LOG_LEVEL 配置；LOG_LEVEL_OVERRIDES 优先
         :return: logger实例
         """
         if name in Logger._loggers:
             return Logger._loggers[name]
 
+        Logger._ensure_listener()
         logger = logging.getLogger(name)
-        logger.setLevel(LOG_LEVELS.get(level.lower(), logging.INFO))
+        if level:
+            Logger._explicit_levels[name] = LOG_LEVELS.get(level.lower(), logging.INFO)
+        logger.setLevel(Logger._level_for(name))
         logger.propagate = False
 
-        # 添加控制台输出
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(FORMATTER)
-        logger.addHandler(console_handler)
+        # 日志写入队列，由后台线程输出到控制台
+        logger.addHandler(Logger._queue_handler)
 
         Logger._loggers[name] = logger
         return logger
@@ -89,6 +163,53 @@ class Logger:
         """
         return Logger._loggers.get(name)
 
+    @staticmethod
+    def configure(
+            level: str = "info",
+            overrides: Optional[List[str]] = None,
+            log_format: str = "text",
+            request_body_sample_rate: float = 1.0,
+            request_body_max_chars: int = 2000,
+    ) -> None:
+        """
+        应用日志配置，对已创建的 logger 立即生效
+        :param level: 默认日志级别
+        :param overrides: 形如 "name=level" 的单个 logger 级别配置
+        :param log_format: text (彩色文本) 或 json (JSON Lines)
+        :param request_body_sample_rate: DEBUG 级别下记录请求体的采样率
+        :param request_body_max_chars: 记录请求体的最大字符数
+        """
+        Logger._default_level = LOG_LEVELS.get(str(level).lower(), logging.INFO)
+        level_overrides = {}
+        for item in overrides or []:
+            name, sep, value = item.partition("=")
+            if sep and value.strip().lower() in LOG_LEVELS:
+                level_overrides[name.strip()] = LOG_LEVELS[value.strip().lower()]
+        Logger._level_overrides = level_overrides
+        for name, logger in Logger._loggers.items():
+            logger.setLevel(Logger._level_for(name))
+
+        Logger._output_handler.setFormatter(JSON_FORMATTER if log_format == "json" else FORMATTER)
+        Logger.request_body_sample_rate = request_body_sample_rate
+        Logger.request_body_max_chars = request_body_max_chars
+
+
+def log_request_body(logger: logging.Logger, request) -> None:
+    """
+    在 DEBUG 级别按采样率记录截断后的请求体
+
+    :param logger: logger实例
+    :param request: pydantic 请求模型
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= Logger.request_body_sample_rate:
+        return
+    body = request.model_dump_json()
+    if len(body) > Logger.request_body_max_chars:
+        body = f"{body[:Logger.request_body_max_chars]}... (truncated, {len(body)} chars)"
+    logger.debug("Request: %s", body, stacklevel=2)
+
 
 # 预定义的loggers
 def get_openai_logger():
@@ -172,4 +293,24 @@ def get_log_routes_logger():
 
 
 def get_stats_logger():
-    return Logger.setup_logger("stats")
\ No newline at end of file
+    return Logger.setup_logger("stats")
+
+
+def get_metrics_logger():
+    return Logger.setup_logger("metrics")
+
+
+def get_usage_logger():
+    return Logger.setup_logger("usage")
+
+
+def get_admission_logger():
+    return Logger.setup_logger("admission")
+
+
+def get_context_cache_logger():
+    return Logger.setup_logger("context_cache")
+
+
+def get_batch_logger():
+    return Logger.setup_logger("batch")
@@ -0,0 +1,68 @@
+"""
+准入控制中间件，为调用上游的 API 请求获取密钥容量
+"""
+import re
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.constants import API_VERSION
+from app.core.security import auth_index
+from app.core.tracing import trace_span
+from app.exception.exceptions import ServiceUnavailableError
+from app.service.key.admission_controller import admission_controller
+
+# 需要占用密钥容量的路径：聊天补全、嵌入和 Gemini 内容生成
+ADMISSION_PATH_PATTERN = re.compile(
+    r"/(?:hf/)?v1/(?:chat/completions|embeddings)$"
+    rf"|/(?:gemini/)?{re.escape(API_VERSION)}/models/[^/]+:(?:generateContent|streamGenerateContent|embedContent|batchEmbedContents)$"
+)
+
+
+def _client_token(scope: Scope, headers: Headers) -> str:
+    """按路由的认证方式取出客户端令牌，仅用于确定优先级，认证仍由路由完成"""
+    authorization = headers.get("authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+    return QueryParams(scope.get("query_string", b"")).get("key") or headers.get("x-goog-api-key", "")
+
+
+class AdmissionMiddleware:
+    """
+    纯 ASGI 中间件：请求在获得容量后才进入路由 (早于密钥选择)，
+    容量在整个响应 (含流式响应) 发送完毕或请求中断时释放。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not ADMISSION_PATH_PATTERN.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        identity = auth_index.lookup(_client_token(scope, headers))
+        if identity is None:
+            # 令牌无效的请求不占用容量和队列位置，直接交给路由返回 401
+            await self.app(scope, receive, send)
+            return
+        priority = admission_controller.priority_for(identity.client_id, headers.get("x-request-priority"))
+        deadline = admission_controller.deadline_for(headers.get("x-request-timeout"))
+        try:
+            with trace_span("admission", priority=priority):
+                lease = await admission_controller.acquire(priority, deadline)
+        except ServiceUnavailableError as e:
+            response = JSONResponse(
+                status_code=e.status_code,
+                content={"error": {"code": e.error_code, "message": e.detail}},
+                headers=e.headers,
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lease.release()
@@ -2,44 +2,57 @@
 中间件配置模块，负责设置和配置应用程序的中间件
 """
 
-from fastapi import FastAPI, Request
+import re
+
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 # from app.middleware.request_logging_middleware import RequestLoggingMiddleware
 from app.core.constants import API_VERSION
 from app.core.security import verify_auth_token
 from app.log.logger import get_middleware_logger
+from app.middleware.admission_middleware import AdmissionMiddleware
+from app.middleware.tracing_middleware import TracingMiddleware
 
 logger = get_middleware_logger()
 
+# 绕过管理页面认证的路径：API 路由自行校验令牌，/metrics 由路由自行校验 Bearer AUTH_TOKEN
+PUBLIC_PATHS = ("/", "/auth", "/metrics")
+PUBLIC_PATH_PREFIXES = ("/static", "/gemini", "/v1", f"/{API_VERSION}", "/health", "/hf")
+PUBLIC_PATH_PATTERN = re.compile(
+    "(?:{})$|(?:{})".format(
+        "|".join(re.escape(path) for path in PUBLIC_PATHS),
+        "|".join(re.escape(prefix) for prefix in PUBLIC_PATH_PREFIXES),
+    )
+)
+
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
     """
     认证中间件，处理未经身份验证的请求
+
+    纯 ASGI 实现，公开路径只做一次预编译正则匹配后直接转发，不包装请求和响应。
     """
 
-    async def dispatch(self, request: Request, call_next):
-        # 允许特定路径绕过身份验证
-        if (
-            request.url.path not in ["/", "/auth"]
-            and not request.url.path.startswith("/static")
-            and not request.url.path.startswith("/gemini")
-            and not request.url.path.startswith("/v1")
-            and not request.url.path.startswith(f"/{API_VERSION}")
-            and not request.url.path.startswith("/health")
-            and not request.url.path.startswith("/hf")
-        ):
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-            auth_token = request.cookies.get("auth_token")
-            if not auth_token or not verify_auth_token(auth_token):
-                logger.warning(f"Unauthorized access attempt to {request.url.path}")
-                return RedirectResponse(url="/")
-            logger.debug("Request authenticated successfully")
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or PUBLIC_PATH_PATTERN.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
 
-        response = await call_next(request)
-        return response
+        auth_token = HTTPConnection(scope).cookies.get("auth_token")
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning(f"Unauthorized access attempt to {scope['path']}")
+            response = RedirectResponse(url="/")
+            await response(scope, receive, send)
+            return
+        logger.debug("Request authenticated successfully")
+        await self.app(scope, receive, send)
 
 
 def setup_middlewares(app: FastAPI) -> None:
@@ -49,6 +62,12 @@ def setup_middlewares(app: FastAPI) -> None:
     Args:
         app: FastAPI应用程序实例
     """
+    # 添加准入控制中间件，位于追踪中间件内层，排队时间计入追踪
+    app.add_middleware(AdmissionMiddleware)
+
+    # 添加请求追踪中间件，位于认证中间件内层
+    app.add_middleware(TracingMiddleware)
+
     # 添加认证中间件
     app.add_middleware(AuthMiddleware)
 
@@ -0,0 +1,51 @@
+"""
+请求追踪中间件，为采样到的 API 请求开启追踪
+"""
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.constants import API_VERSION
+from app.core.tracing import finish_trace, start_trace
+
+# 需要追踪的 API 路径前缀
+TRACED_PATH_PREFIXES = ("/v1", "/hf", "/gemini", f"/{API_VERSION}")
+
+
+class TracingMiddleware:
+    """
+    纯 ASGI 中间件：下游应用与本中间件运行在同一任务中，
+    因此依赖项、路由和流式响应生成器都能读取到当前追踪。
+    流式响应在最后一个数据块发送后才结束追踪。
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(TRACED_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        trace = start_trace(f"{scope['method']} {scope['path']}")
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode("ascii")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            trace.attributes["error"] = type(e).__name__
+            finish_trace(trace, "error")
+            raise
+        trace.attributes["status_code"] = status_code
+        finish_trace(trace, "ok" if status_code is not None and status_code < 400 else "error")
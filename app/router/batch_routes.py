@@ -0,0 +1,138 @@
+"""
+批处理路由模块，兼容 OpenAI 的 /v1/files 与 /v1/batches，以及 NDJSON 流式批量补全 /v1/bulk/chat/completions
+"""
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, Form, Header, Query, Request, UploadFile
+from fastapi.responses import FileResponse
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+
+from app.config.config import settings
+from app.core.security import SecurityService, get_client_id
+from app.domain.openai_models import BatchRequest
+from app.exception.exceptions import APIError
+from app.log.logger import get_batch_logger
+from app.service.batch.batch_service import batch_manager
+from app.service.batch.bulk_service import bulk_chat_completions
+from app.service.batch.file_store import file_store
+from app.service.key.admission_controller import admission_controller
+from app.service.usage.client_quota import LeasedStreamingResponse, client_quota_manager
+
+router = APIRouter(prefix="/v1")
+logger = get_batch_logger()
+
+security_service = SecurityService()
+
+
+class DuplexStreamingResponse(LeasedStreamingResponse):
+    """
+    边读取请求体边发送的流式响应
+
+    StreamingResponse 在旧版 ASGI 服务器上会另起任务监听 receive 以感知断开，会吞掉尚未读取的请求体；
+    这里只发送响应，客户端断开由读取请求体 (ClientDisconnect) 或发送失败感知，断开属于正常情况，直接结束响应。
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except (OSError, ClientDisconnect):
+            logger.info("Client disconnected during bulk completion")
+        finally:
+            try:
+                # 立即关闭结果流，取消未完成的请求
+                await self.body_iterator.aclose()
+            finally:
+                self.stream_lease.release()
+
+
+async def get_owner(token: str = Depends(security_service.verify_authorization)) -> str:
+    """文件和批处理只对创建它的客户端可见"""
+    return get_client_id(token)
+
+
+@router.post("/files")
+async def upload_file(
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    owner: str = Depends(get_owner),
+):
+    if purpose != "batch":
+        raise APIError(400, f"Unsupported purpose {purpose}, only 'batch' is supported", "invalid_request_error")
+    file_object = await asyncio.to_thread(file_store.save_upload, file.file, file.filename or "upload.jsonl", purpose, owner)
+    logger.info(f"Uploaded file {file_object['id']} ({file_object['bytes']} bytes)")
+    return file_object
+
+
+@router.get("/files")
+async def list_files(purpose: Optional[str] = Query(None), owner: str = Depends(get_owner)):
+    return {"object": "list", "data": await asyncio.to_thread(file_store.list, owner, purpose)}
+
+
+@router.get("/files/{file_id}")
+async def retrieve_file(file_id: str, owner: str = Depends(get_owner)):
+    return await asyncio.to_thread(file_store.get, file_id, owner)
+
+
+@router.get("/files/{file_id}/content")
+async def retrieve_file_content(file_id: str, owner: str = Depends(get_owner)):
+    file_object = await asyncio.to_thread(file_store.get, file_id, owner)
+    return FileResponse(
+        file_store.content_path(file_id), media_type="application/jsonl", filename=file_object["filename"]
+    )
+
+
+@router.delete("/files/{file_id}")
+async def delete_file(file_id: str, owner: str = Depends(get_owner)):
+    return await asyncio.to_thread(file_store.delete, file_id, owner)
+
+
+@router.post("/batches")
+async def create_batch(request: BatchRequest, owner: str = Depends(get_owner)):
+    return await batch_manager.create(
+        owner, request.input_file_id, request.endpoint, request.completion_window, request.metadata
+    )
+
+
+@router.get("/batches")
+async def list_batches(
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = Query(None),
+    owner: str = Depends(get_owner),
+):
+    return await batch_manager.list(owner, limit, after)
+
+
+@router.get("/batches/{batch_id}")
+async def retrieve_batch(batch_id: str, owner: str = Depends(get_owner)):
+    return await batch_manager.get(batch_id, owner)
+
+
+@router.post("/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, owner: str = Depends(get_owner)):
+    return await batch_manager.cancel(batch_id, owner)
+
+
+@router.post("/bulk/chat/completions")
+async def bulk_chat_completion(
+    request: Request,
+    window: Optional[int] = Query(None, ge=1),
+    x_request_priority: Optional[str] = Header(None),
+    owner: str = Depends(get_owner),
+):
+    """
+    请求体为 NDJSON，每行 {"custom_id", "body"}；结果按完成顺序以 NDJSON 流式返回
+
+    window 为同时进行的请求数，不超过 BULK_MAX_WINDOW。
+    """
+    quota = client_quota_manager.get(owner)
+    stream_lease = quota.open_stream()
+    window = min(window or settings.BULK_MAX_WINDOW, settings.BULK_MAX_WINDOW)
+    priority = admission_controller.priority_for(owner, x_request_priority)
+    logger.info(f"Handling bulk chat completion for client {owner} (window {window})")
+    return DuplexStreamingResponse(
+        bulk_chat_completions(request.stream(), quota, window, priority),
+        stream_lease,
+        media_type="application/x-ndjson",
+    )
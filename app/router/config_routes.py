@@ -54,6 +54,39 @@ class ConfigResponse(BaseModel):
     STREAM_CHUNK_SIZE: int
     CHECK_INTERVAL_HOURS: int
     TIMEZONE: str
+    STATS_ROLLUP_INTERVAL_SECONDS: int
+    REQUEST_LOG_RETENTION_DAYS: int
+    STATS_MINUTE_RETENTION_DAYS: int
+    STATS_HOUR_RETENTION_DAYS: int
+    TOKEN_USAGE_FLUSH_INTERVAL_SECONDS: int
+    LOG_LEVEL: str
+    LOG_LEVEL_OVERRIDES: List[str]
+    LOG_FORMAT: str
+    LOG_REQUEST_BODY_SAMPLE_RATE: float
+    LOG_REQUEST_BODY_MAX_CHARS: int
+    TRACE_SAMPLE_RATE: float
+    TRACE_BUFFER_SIZE: int
+    CLIENT_RPM_LIMIT: int
+    CLIENT_TPM_LIMIT: int
+    CLIENT_MAX_CONCURRENT_STREAMS: int
+    CLIENT_LIMIT_OVERRIDES: List[str]
+    KEY_COOLDOWN_SECONDS: int
+    KEY_MAX_CONCURRENT_REQUESTS: int
+    ADMISSION_QUEUE_SIZE: int
+    ADMISSION_MAX_WAIT_SECONDS: float
+    ADMISSION_DEFAULT_PRIORITY: int
+    ADMISSION_CLIENT_PRIORITIES: List[str]
+    CONTEXT_CACHE_ENABLED: bool
+    CONTEXT_CACHE_MIN_TOKENS: int
+    CONTEXT_CACHE_TTL_SECONDS: int
+    CONTEXT_CACHE_MAX_PER_KEY: int
+    KEY_AFFINITY_MODE: str
+    BATCH_STORAGE_DIR: str
+    BATCH_MAX_CONCURRENCY: int
+    BULK_MAX_WINDOW: int
+    EMBEDDING_MAX_CONCURRENCY: int
+    EMBEDDING_CACHE_PATH: str
+    PREFLIGHT_MAX_INPUT_TOKENS: int
 
     # Add Config class to handle potential extra fields if needed, though usually not necessary for response models
     class Config:
@@ -1,16 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
 from copy import deepcopy
 from app.config.config import settings
-from app.log.logger import get_gemini_logger
-from app.core.security import SecurityService
+from app.log.logger import get_gemini_logger, log_request_body
+from app.core.security import SecurityService, get_client_id
 import asyncio # 导入 asyncio
+from typing import Any, Dict
 from app.domain.gemini_models import GeminiContent, GeminiRequest, ResetSelectedKeysRequest, VerifySelectedKeysRequest # 添加导入
 from app.service.chat.gemini_chat_service import GeminiChatService
+from app.service.embedding.gemini_embedding_service import GeminiEmbeddingService
+from app.service.key.key_affinity import affinity_identifier
 from app.service.key.key_manager import KeyManager, get_key_manager_instance
 from app.service.model.model_service import ModelService
-from app.handler.retry_handler import RetryHandler
+from app.service.usage.client_quota import ClientQuota, LeasedStreamingResponse, client_quota_manager
+from app.handler.retry_handler import RetryHandler, upstream_client_error
+from app.exception.exceptions import APIError
 from app.core.constants import API_VERSION
+from app.core.tracing import trace_span
 
 # 路由设置
 router = APIRouter(prefix=f"/gemini/{API_VERSION}")
@@ -27,9 +33,31 @@ async def get_key_manager():
     return await get_key_manager_instance()
 
 
-async def get_next_working_key(key_manager: KeyManager = Depends(get_key_manager)):
-    """获取下一个可用的API密钥"""
-    return await key_manager.get_next_working_key()
+async def get_next_working_key(
+    request: Request,
+    token: str = Depends(security_service.verify_key_or_goog_api_key),
+    key_manager: KeyManager = Depends(get_key_manager),
+):
+    """获取下一个可用的API密钥，开启密钥亲和时按会话选择"""
+    with trace_span("key_selection"):
+        identifier = await affinity_identifier(request, token)
+        api_key = key_manager.acquire_affinity_key(identifier) if identifier else None
+        if api_key is None:
+            api_key = await key_manager.get_next_working_key()
+            identifier = None
+    if identifier is None:
+        yield api_key
+        return
+    # 按会话选择的密钥计入负载直到响应 (包括流式响应) 发送完毕
+    try:
+        yield api_key
+    finally:
+        key_manager.release_affinity_key(api_key)
+
+
+async def check_client_quota(token: str = Depends(security_service.verify_key_or_goog_api_key)) -> ClientQuota:
+    """在选择密钥前检查客户端的 RPM/TPM 配额"""
+    return client_quota_manager.admit(get_client_id(token))
 
 
 async def get_chat_service(key_manager: KeyManager = Depends(get_key_manager)):
@@ -37,6 +65,11 @@ async def get_chat_service(key_manager: KeyManager = Depends(get_key_manager)):
     return GeminiChatService(settings.BASE_URL, key_manager)
 
 
+async def get_embedding_service(key_manager: KeyManager = Depends(get_key_manager)):
+    """获取Gemini嵌入服务实例"""
+    return GeminiEmbeddingService(key_manager)
+
+
 @router.get("/models")
 @router_v1beta.get("/models")
 async def list_models(
@@ -48,7 +81,7 @@ async def list_models(
     logger.info("Handling Gemini models list request")
     
     api_key = await key_manager.get_first_valid_key()
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Using API key: %s", api_key)
     
     models_json = model_service.get_gemini_models(api_key)
     model_mapping = {x.get("name", "").split("/", maxsplit=1)[1]: x for x in models_json["models"]}
@@ -92,27 +125,36 @@ async def list_models(
 async def generate_content(
     model_name: str,
     request: GeminiRequest,
-    _=Depends(security_service.verify_key_or_goog_api_key),
+    token: str = Depends(security_service.verify_key_or_goog_api_key),
+    quota: ClientQuota = Depends(check_client_quota),
     api_key: str = Depends(get_next_working_key),
+    key_manager: KeyManager = Depends(get_key_manager),
     chat_service: GeminiChatService = Depends(get_chat_service)
 ):
     """非流式生成内容"""
     logger.info("-" * 50 + "gemini_generate_content" + "-" * 50)
-    logger.info(f"Handling Gemini content generation request for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling Gemini content generation request for model: %s", model_name)
+    log_request_body(logger, request)
+    logger.info("Using API key: %s", api_key)
     
+    # 请求错误以 APIError 抛出，RetryHandler 不重试也不计入密钥失败次数
     if not model_service.check_model_support(model_name):
-        raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
+        raise APIError(400, f"Model {model_name} is not supported", "invalid_request_error")
     
     try:
         response = await chat_service.generate_content(
             model=model_name,
             request=request,
-            api_key=api_key
+            api_key=api_key,
+            client_id=get_client_id(token)
         )
         return response
+    except APIError:
+        raise
     except Exception as e:
+        client_error = upstream_client_error(e, f"Content generation failed: {str(e)}")
+        if client_error is not None:
+            raise client_error from e
         logger.error(f"Chat completion failed after retries: {str(e)}")
         raise HTTPException(status_code=500, detail="Chat completion failed") from e
 
@@ -123,30 +165,119 @@ async def generate_content(
 async def stream_generate_content(
     model_name: str,
     request: GeminiRequest,
-    _=Depends(security_service.verify_key_or_goog_api_key),
+    token: str = Depends(security_service.verify_key_or_goog_api_key),
+    quota: ClientQuota = Depends(check_client_quota),
     api_key: str = Depends(get_next_working_key),
     chat_service: GeminiChatService = Depends(get_chat_service)
 ):
     """流式生成内容"""
     logger.info("-" * 50 + "gemini_stream_generate_content" + "-" * 50)
-    logger.info(f"Handling Gemini streaming content generation for model: {model_name}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling Gemini streaming content generation for model: %s", model_name)
+    log_request_body(logger, request)
+    logger.info("Using API key: %s", api_key)
     
     if not model_service.check_model_support(model_name):
         raise HTTPException(status_code=400, detail=f"Model {model_name} is not supported")
-    
+
+    stream_lease = quota.open_stream()
     try:
         response_stream = chat_service.stream_generate_content(
             model=model_name,
             request=request,
-            api_key=api_key
+            api_key=api_key,
+            client_id=get_client_id(token)
         )
-        return StreamingResponse(response_stream, media_type="text/event-stream")
+        return LeasedStreamingResponse(response_stream, stream_lease, media_type="text/event-stream")
+    except APIError:
+        stream_lease.release()
+        raise
     except Exception as e:
+        stream_lease.release()
         logger.error(f"Streaming request failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Streaming request failed") from e
 
+@router.post("/models/{model_name}:countTokens")
+@router_v1beta.post("/models/{model_name}:countTokens")
+@RetryHandler(max_retries=settings.MAX_RETRIES, key_arg="api_key")
+async def count_tokens(
+    model_name: str,
+    payload: Dict[str, Any],
+    quota: ClientQuota = Depends(check_client_quota),
+    api_key: str = Depends(get_next_working_key),
+    key_manager: KeyManager = Depends(get_key_manager),
+    chat_service: GeminiChatService = Depends(get_chat_service)
+):
+    """计算 token 数，相同请求的结果从缓存返回"""
+    logger.info("Handling Gemini countTokens request for model: %s", model_name)
+
+    # 以下请求错误均以 APIError 抛出，RetryHandler 不重试也不计入密钥失败次数
+    if not model_service.check_model_support(model_name):
+        raise APIError(400, f"Model {model_name} is not supported", "invalid_request_error")
+
+    try:
+        return await chat_service.count_tokens(model_name, payload, api_key)
+    except APIError:
+        raise
+    except Exception as e:
+        client_error = upstream_client_error(e, f"Token counting failed: {str(e)}")
+        if client_error is not None:
+            raise client_error from e
+        logger.error(f"Token counting failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Token counting failed") from e
+
+
+@router.post("/models/{model_name}:embedContent")
+@router_v1beta.post("/models/{model_name}:embedContent")
+async def embed_content(
+    model_name: str,
+    payload: Dict[str, Any],
+    quota: ClientQuota = Depends(check_client_quota),
+    api_key: str = Depends(get_next_working_key),
+    embedding_service: GeminiEmbeddingService = Depends(get_embedding_service)
+):
+    """单条嵌入"""
+    logger.info("-" * 50 + "gemini_embed_content" + "-" * 50)
+    logger.info("Handling Gemini embedding request for model: %s", model_name)
+    logger.info("Using API key: %s", api_key)
+
+    if not model_service.check_model_support(model_name):
+        raise APIError(400, f"Model {model_name} is not supported", "invalid_request_error")
+
+    try:
+        return await embedding_service.embed_content(model_name, payload, api_key)
+    except APIError:
+        raise
+    except Exception as e:
+        logger.error(f"Embedding failed after retries: {str(e)}")
+        raise HTTPException(status_code=500, detail="Embedding failed") from e
+
+
+@router.post("/models/{model_name}:batchEmbedContents")
+@router_v1beta.post("/models/{model_name}:batchEmbedContents")
+async def batch_embed_contents(
+    model_name: str,
+    payload: Dict[str, Any],
+    quota: ClientQuota = Depends(check_client_quota),
+    api_key: str = Depends(get_next_working_key),
+    embedding_service: GeminiEmbeddingService = Depends(get_embedding_service)
+):
+    """批量嵌入，超过上游条数上限时拆分为子批次并发请求"""
+    logger.info("-" * 50 + "gemini_batch_embed_contents" + "-" * 50)
+    logger.info("Handling Gemini batch embedding request for model: %s", model_name)
+    logger.info("Using API key: %s", api_key)
+
+    if not model_service.check_model_support(model_name):
+        raise APIError(400, f"Model {model_name} is not supported", "invalid_request_error")
+
+    try:
+        return await embedding_service.batch_embed_contents(model_name, payload, api_key)
+    except APIError:
+        raise
+    except Exception as e:
+        logger.error(f"Batch embedding failed after retries: {str(e)}")
+        raise HTTPException(status_code=500, detail="Batch embedding failed") from e
+
+
 @router.post("/reset-all-fail-counts")
 async def reset_all_key_fail_counts(key_type: str = None, key_manager: KeyManager = Depends(get_key_manager)):
     """批量重置Gemini API密钥的失败计数，可选择性地仅重置有效或无效密钥"""
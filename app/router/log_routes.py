@@ -9,7 +9,13 @@ from fastapi import APIRouter, HTTPException, Request, Query, Path
 from app.core.security import verify_auth_token
 from app.log.logger import get_log_routes_logger
 # 假设这些服务函数已更新或添加
-from app.database.services import get_error_logs, get_error_logs_count, get_error_log_details
+from app.core.constants import ERROR_LOG_SEARCH_MODES
+from app.database.services import (
+    encode_error_log_cursor,
+    get_error_logs,
+    get_error_logs_count,
+    get_error_log_details,
+)
 
 # 创建路由
 router = APIRouter(prefix="/api/logs", tags=["logs"])
@@ -29,7 +35,8 @@ class ErrorLogListItem(BaseModel):
 
 class ErrorLogListResponse(BaseModel):
     logs: List[ErrorLogListItem] # 使用定义的模型列表
-    total: int
+    total: int # 无过滤条件时为近似值，结果会被短暂缓存
+    next_cursor: Optional[str] = None # 下一页游标，为空表示没有更多数据
 
 @router.get("/errors", response_model=ErrorLogListResponse)
 async def get_error_logs_api(
@@ -39,7 +46,9 @@ async def get_error_logs_api(
     key_search: Optional[str] = Query(None, description="Search term for Gemini key (partial match)"),
     error_search: Optional[str] = Query(None, description="Search term for error type or log message"), # 数据库查询需处理
     start_date: Optional[datetime] = Query(None, description="Start datetime for filtering"),
-    end_date: Optional[datetime] = Query(None, description="End datetime for filtering")
+    end_date: Optional[datetime] = Query(None, description="End datetime for filtering"),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page; overrides offset"),
+    search_mode: str = Query("fulltext", description="Error search mode: fulltext or prefix")
 ):
     """
     获取错误日志列表 (返回错误码)
@@ -47,11 +56,13 @@ async def get_error_logs_api(
     Args:
         request: 请求对象
         limit: 限制数量
-        offset: 偏移量
-        key_search: 密钥搜索
-        error_search: 错误搜索 (可能搜索类型或日志内容，由DB层决定)
+        offset: 偏移量 (未提供 cursor 时使用)
+        key_search: 密钥搜索 (前缀匹配)
+        error_search: 错误搜索 (对错误类型和日志内容做全文检索)
         start_date: 开始日期
         end_date: 结束日期
+        cursor: 游标分页参数
+        search_mode: 错误搜索模式
 
     Returns:
         ErrorLogListResponse: An object containing the list of logs (with error_code) and the total count.
@@ -61,29 +72,38 @@ async def get_error_logs_api(
         logger.warning("Unauthorized access attempt to error logs list")
         # API 返回 401 更合适
         raise HTTPException(status_code=401, detail="Not authenticated")
+
+    if search_mode not in ERROR_LOG_SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid search_mode: {search_mode}")
     
     try:
-        # 假设 get_error_logs 现在返回包含 error_code 的字典列表
-        # 并且可以接受 include_error_code 参数 (如果需要显式指定)
         logs_data = await get_error_logs(
             limit=limit,
             offset=offset,
             key_search=key_search,
-            error_search=error_search, # 数据库查询需要处理这个
+            error_search=error_search,
             start_date=start_date,
             end_date=end_date,
-            # include_error_code=True # 如果需要显式传递
+            cursor=cursor,
+            error_search_mode=search_mode,
         )
-        # Fetch total count with the same search parameters
+        # 总数按过滤条件缓存，无过滤条件时为近似值
         total_count = await get_error_logs_count(
             key_search=key_search,
             error_search=error_search,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            error_search_mode=search_mode,
         )
+        next_cursor = None
+        if len(logs_data) == limit and logs_data[-1].get("request_time"):
+            next_cursor = encode_error_log_cursor(logs_data[-1])
         # 验证并转换数据以匹配 Pydantic 模型
         validated_logs = [ErrorLogListItem(**log) for log in logs_data]
-        return ErrorLogListResponse(logs=validated_logs, total=total_count)
+        return ErrorLogListResponse(logs=validated_logs, total=total_count, next_cursor=next_cursor)
+    except ValueError as e:
+        # 游标格式无效
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.exception(f"Failed to get error logs list: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get error logs list: {str(e)}")
@@ -0,0 +1,37 @@
+"""
+监控指标路由模块
+"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+from fastapi.responses import Response
+
+from app.core.metrics import CONTENT_TYPE_LATEST, registry
+from app.core.security import verify_auth_token
+from app.log.logger import get_routes_logger
+
+logger = get_routes_logger()
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request, authorization: Optional[str] = Header(None)):
+    """
+    以 Prometheus 文本格式导出监控指标
+
+    支持 Authorization: Bearer <AUTH_TOKEN> (供 Prometheus 抓取) 或管理页面的 auth_token cookie。
+    """
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+    else:
+        token = request.cookies.get("auth_token")
+    if not token or not verify_auth_token(token):
+        logger.warning("Unauthorized access attempt to metrics endpoint")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return Response(content=registry.expose(), media_type=CONTENT_TYPE_LATEST)
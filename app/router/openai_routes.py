@@ -1,20 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
 
 from app.config.config import settings
-from app.core.security import SecurityService
+from app.core.security import SecurityService, get_client_id
+from app.core.tracing import trace_span
 from app.domain.openai_models import (
     ChatRequest,
     EmbeddingRequest,
     ImageGenerationRequest,
 )
+from app.exception.exceptions import APIError
 from app.handler.retry_handler import RetryHandler
-from app.log.logger import get_openai_logger
+from app.log.logger import get_openai_logger, log_request_body
 from app.service.chat.openai_chat_service import OpenAIChatService
 from app.service.embedding.embedding_service import EmbeddingService
 from app.service.image.image_create_service import ImageCreateService
+from app.service.key.key_affinity import affinity_identifier
 from app.service.key.key_manager import KeyManager, get_key_manager_instance
 from app.service.model.model_service import ModelService
+from app.service.usage.client_quota import ClientQuota, LeasedStreamingResponse, client_quota_manager
 
 router = APIRouter()
 logger = get_openai_logger()
@@ -31,9 +34,29 @@ async def get_key_manager():
 
 
 async def get_next_working_key_wrapper(
+    request: Request,
+    token: str = Depends(security_service.verify_authorization),
     key_manager: KeyManager = Depends(get_key_manager),
 ):
-    return await key_manager.get_next_working_key()
+    with trace_span("key_selection"):
+        identifier = await affinity_identifier(request, token)
+        api_key = key_manager.acquire_affinity_key(identifier) if identifier else None
+        if api_key is None:
+            api_key = await key_manager.get_next_working_key()
+            identifier = None
+    if identifier is None:
+        yield api_key
+        return
+    # 按会话选择的密钥计入负载直到响应 (包括流式响应) 发送完毕
+    try:
+        yield api_key
+    finally:
+        key_manager.release_affinity_key(api_key)
+
+
+async def check_client_quota(token: str = Depends(security_service.verify_authorization)) -> ClientQuota:
+    """在选择密钥前检查客户端的 RPM/TPM 配额"""
+    return client_quota_manager.admit(get_client_id(token))
 
 
 async def get_openai_chat_service(key_manager: KeyManager = Depends(get_key_manager)):
@@ -50,7 +73,7 @@ async def list_models(
     logger.info("-" * 50 + "list_models" + "-" * 50)
     logger.info("Handling models list request")
     api_key = await key_manager.get_first_valid_key()
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Using API key: %s", api_key)
     try:
         return model_service.get_gemini_openai_models(api_key)
     except Exception as e:
@@ -65,7 +88,8 @@ async def list_models(
 @RetryHandler(max_retries=settings.MAX_RETRIES, key_arg="api_key")
 async def chat_completion(
     request: ChatRequest,
-    _=Depends(security_service.verify_authorization),
+    token: str = Depends(security_service.verify_authorization),
+    quota: ClientQuota = Depends(check_client_quota),
     api_key: str = Depends(get_next_working_key_wrapper),
     key_manager: KeyManager = Depends(get_key_manager), # 保留 key_manager 用于获取 paid_key
     chat_service: OpenAIChatService = Depends(get_openai_chat_service),
@@ -74,27 +98,36 @@ async def chat_completion(
     if request.model == f"{settings.CREATE_IMAGE_MODEL}-chat":
         api_key = await key_manager.get_paid_key()
     logger.info("-" * 50 + "chat_completion" + "-" * 50)
-    logger.info(f"Handling chat completion request for model: {request.model}")
-    logger.info(f"Request: \n{request.model_dump_json(indent=2)}")
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Handling chat completion request for model: %s", request.model)
+    log_request_body(logger, request)
+    logger.info("Using API key: %s", api_key)
 
     if not model_service.check_model_support(request.model):
         raise HTTPException(
             status_code=400, detail=f"Model {request.model} is not supported"
         )
 
+    stream_lease = quota.open_stream() if request.stream else None
     try:
         # 如果model是imagen3,使用paid_key
         if request.model == f"{settings.CREATE_IMAGE_MODEL}-chat":
             response = await chat_service.create_image_chat_completion(request=request)
         else:
-            response = await chat_service.create_chat_completion(request, api_key)
+            response = await chat_service.create_chat_completion(
+                request, api_key, client_id=get_client_id(token)
+            )
         # 处理流式响应
-        if request.stream:
-            return StreamingResponse(response, media_type="text/event-stream")
+        if stream_lease is not None:
+            return LeasedStreamingResponse(response, stream_lease, media_type="text/event-stream")
         logger.info("Chat completion request successful")
         return response
+    except APIError:
+        if stream_lease is not None:
+            stream_lease.release()
+        raise
     except Exception as e:
+        if stream_lease is not None:
+            stream_lease.release()
         logger.error(f"Chat completion failed after retries: {str(e)}")
         raise HTTPException(status_code=500, detail="Chat completion failed") from e
 
@@ -104,9 +137,10 @@ async def chat_completion(
 async def generate_image(
     request: ImageGenerationRequest,
     _=Depends(security_service.verify_authorization),
+    quota: ClientQuota = Depends(check_client_quota),
 ):
     logger.info("-" * 50 + "generate_image" + "-" * 50)
-    logger.info(f"Handling image generation request for prompt: {request.prompt}")
+    logger.info("Handling image generation request for prompt: %s", request.prompt)
 
     try:
         response = image_create_service.generate_images(request)
@@ -124,12 +158,13 @@ async def generate_image(
 async def embedding(
     request: EmbeddingRequest,
     _=Depends(security_service.verify_authorization),
+    quota: ClientQuota = Depends(check_client_quota),
     key_manager: KeyManager = Depends(get_key_manager),
 ):
     logger.info("-" * 50 + "embedding" + "-" * 50)
-    logger.info(f"Handling embedding request for model: {request.model}")
+    logger.info("Handling embedding request for model: %s", request.model)
     api_key = await key_manager.get_next_working_key()
-    logger.info(f"Using API key: {api_key}")
+    logger.info("Using API key: %s", api_key)
     try:
         response = await embedding_service.create_embedding(
             input_text=request.input, model=request.model, api_key=api_key
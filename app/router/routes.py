@@ -2,15 +2,24 @@
 路由配置模块，负责设置和配置应用程序的路由
 """
 
+import datetime
+from typing import Optional
+
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 
 from app.core.security import verify_auth_token
 from app.log.logger import get_routes_logger
-from app.router import gemini_routes, openai_routes, config_routes, log_routes, scheduler_routes, proxy_routes # 导入 proxy_routes
+from app.router import gemini_routes, openai_routes, config_routes, log_routes, scheduler_routes, proxy_routes, metrics_routes, batch_routes # 导入 proxy_routes
 from app.service.key.key_manager import get_key_manager_instance
-from app.service.stats_service import get_api_usage_stats, get_api_call_details # <-- Import stats service and details function
+from app.config.config import settings
+from app.core.constants import TOKEN_USAGE_MAX_QUERY_HOURS, TRACE_QUERY_MAX_LIMIT
+from app.core.tracing import get_recent_traces, get_trace
+from app.database.services import get_token_usage
+from app.service.stats_service import get_api_usage_stats, get_api_call_details, get_api_call_records # <-- Import stats service and details function
+from app.service.usage.client_quota import client_quota_manager
+from app.service.usage.usage_tracker import token_usage_tracker
 
 logger = get_routes_logger()
 
@@ -33,6 +42,8 @@ def setup_routers(app: FastAPI) -> None:
     app.include_router(log_routes.router)
     app.include_router(scheduler_routes.router) # 新增包含 scheduler 路由
     app.include_router(proxy_routes.router) # 包含代理测试路由
+    app.include_router(metrics_routes.router)
+    app.include_router(batch_routes.router)
 
     # 添加页面路由
     setup_page_routes(app)
@@ -108,6 +119,7 @@ def setup_page_routes(app: FastAPI) -> None:
                     "valid_key_count": valid_key_count, # Added count
                     "invalid_key_count": invalid_key_count, # Added count
                     "api_stats": api_stats, # <-- Pass stats to template
+                    "client_quotas": client_quota_manager.snapshot(),
                 },
             )
         except Exception as e:
@@ -146,6 +158,20 @@ def setup_page_routes(app: FastAPI) -> None:
             logger.error(f"Error accessing logs page: {str(e)}")
             raise
 
+    @app.get("/traces", response_class=HTMLResponse)
+    async def traces_page(request: Request):
+        """请求追踪页面"""
+        try:
+            auth_token = request.cookies.get("auth_token")
+            if not auth_token or not verify_auth_token(auth_token):
+                logger.warning("Unauthorized access attempt to traces page")
+                return RedirectResponse(url="/", status_code=302)
+
+            return templates.TemplateResponse("traces.html", {"request": request})
+        except Exception as e:
+            logger.error(f"Error accessing traces page: {str(e)}")
+            raise
+
 
 def setup_health_routes(app: FastAPI) -> None:
     """
@@ -171,14 +197,13 @@ def setup_api_stats_routes(app: FastAPI) -> None:
     """
     @app.get("/api/stats/details")
     async def api_stats_details(request: Request, period: str):
-        """获取指定时间段内的 API 调用详情"""
+        """获取指定时间段内按时间桶、密钥、模型和状态聚合的 API 调用统计"""
         try:
             # 验证认证
             auth_token = request.cookies.get("auth_token")
             if not auth_token or not verify_auth_token(auth_token):
                 logger.warning("Unauthorized access attempt to API stats details")
                 # Returning JSON error instead of redirect for API endpoint
-                from fastapi.responses import JSONResponse
                 return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
 
             logger.info(f"Fetching API call details for period: {period}")
@@ -190,3 +215,87 @@ def setup_api_stats_routes(app: FastAPI) -> None:
         except Exception as e:
             logger.error(f"Error fetching API stats details for period {period}: {str(e)}")
             return JSONResponse(content={"error": "Internal server error"}, status_code=500)
+
+    @app.get("/api/stats/details/raw")
+    async def api_stats_details_raw(
+        request: Request, period: str, limit: int = 100, cursor: Optional[int] = None
+    ):
+        """分页获取指定时间段内的原始 API 调用记录"""
+        try:
+            auth_token = request.cookies.get("auth_token")
+            if not auth_token or not verify_auth_token(auth_token):
+                logger.warning("Unauthorized access attempt to API stats raw details")
+                return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+
+            return await get_api_call_records(period, limit, cursor)
+        except ValueError as e:
+            logger.warning(f"Invalid period requested for API stats raw details: {period} - {str(e)}")
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error fetching API stats raw details for period {period}: {str(e)}")
+            return JSONResponse(content={"error": "Internal server error"}, status_code=500)
+
+    @app.get("/api/stats/token-usage")
+    async def api_stats_token_usage(request: Request, hours: int = 24, group_by: str = "key,model"):
+        """
+        获取最近 N 小时的 token 用量，group_by 为逗号分隔的 key/model/client 组合
+        """
+        try:
+            auth_token = request.cookies.get("auth_token")
+            if not auth_token or not verify_auth_token(auth_token):
+                logger.warning("Unauthorized access attempt to token usage stats")
+                return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+
+            if hours < 1 or hours > TOKEN_USAGE_MAX_QUERY_HOURS:
+                raise ValueError(f"hours must be between 1 and {TOKEN_USAGE_MAX_QUERY_HOURS}")
+            dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
+            # 先写入内存中的用量，保证结果包含最近的请求
+            await token_usage_tracker.flush()
+            start_time = datetime.datetime.now() - datetime.timedelta(hours=hours)
+            return {"hours": hours, "group_by": dimensions, "items": await get_token_usage(start_time, dimensions)}
+        except ValueError as e:
+            logger.warning(f"Invalid token usage query: {str(e)}")
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        except Exception as e:
+            logger.error(f"Error fetching token usage stats: {str(e)}")
+            return JSONResponse(content={"error": "Internal server error"}, status_code=500)
+
+    @app.get("/api/stats/client-quotas")
+    async def api_stats_client_quotas(request: Request):
+        """
+        获取各客户端的配额限额、剩余额度、并发流数和拒绝次数
+        """
+        auth_token = request.cookies.get("auth_token")
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning("Unauthorized access attempt to client quota stats")
+            return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+        return {"clients": client_quota_manager.snapshot()}
+
+    @app.get("/api/traces")
+    async def api_traces(request: Request, limit: int = 100):
+        """
+        获取内存中最近完成的请求追踪，按时间倒序
+        """
+        auth_token = request.cookies.get("auth_token")
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning("Unauthorized access attempt to traces")
+            return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+        if limit < 1 or limit > TRACE_QUERY_MAX_LIMIT:
+            return JSONResponse(
+                content={"error": f"limit must be between 1 and {TRACE_QUERY_MAX_LIMIT}"}, status_code=400
+            )
+        return {"sample_rate": settings.TRACE_SAMPLE_RATE, "traces": get_recent_traces(limit)}
+
+    @app.get("/api/traces/{trace_id}")
+    async def api_trace_detail(request: Request, trace_id: str):
+        """
+        按追踪 ID 获取单个追踪 (与响应头 X-Trace-Id 对应)
+        """
+        auth_token = request.cookies.get("auth_token")
+        if not auth_token or not verify_auth_token(auth_token):
+            logger.warning("Unauthorized access attempt to trace detail")
+            return JSONResponse(content={"error": "Unauthorized"}, status_code=401)
+        trace = get_trace(trace_id)
+        if trace is None:
+            return JSONResponse(content={"error": "Trace not found"}, status_code=404)
+        return trace
@@ -4,6 +4,7 @@ from app.service.chat.gemini_chat_service import GeminiChatService
 from app.domain.gemini_models import GeminiRequest, GeminiContent
 from app.config.config import settings
 from app.log.logger import Logger # 导入 Logger 类
+from app.scheduler.request_log_rollup import flush_token_usage, prune_expired_request_logs, rollup_request_log_stats
 
 logger = Logger.setup_logger("scheduler") # 使用 Logger.setup_logger
 
@@ -81,8 +82,13 @@ def setup_scheduler():
     scheduler = AsyncIOScheduler(timezone=str(settings.TIMEZONE)) # 从配置读取时区
     # 添加定时任务，例如每小时执行一次 (可以调整)
     scheduler.add_job(check_failed_keys, 'interval', hours=settings.CHECK_INTERVAL_HOURS)
+    # 请求日志聚合与保留清理
+    scheduler.add_job(rollup_request_log_stats, 'interval', seconds=settings.STATS_ROLLUP_INTERVAL_SECONDS)
+    scheduler.add_job(prune_expired_request_logs, 'interval', hours=1)
+    scheduler.add_job(flush_token_usage, 'interval', seconds=settings.TOKEN_USAGE_FLUSH_INTERVAL_SECONDS)
     scheduler.start()
     logger.info(f"Scheduler started. Key check job scheduled to run every {settings.CHECK_INTERVAL_HOURS} hour(s).")
+    logger.info(f"Request log rollup scheduled every {settings.STATS_ROLLUP_INTERVAL_SECONDS} second(s), retention cleanup hourly.")
     return scheduler
 
 # 可以在这里添加一个全局的 scheduler 实例，以便在应用关闭时优雅地停止
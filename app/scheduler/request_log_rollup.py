@@ -0,0 +1,54 @@
+"""
+请求日志聚合、保留清理与用量写入任务
+"""
+from app.config.config import settings
+from app.database.services import prune_request_logs, prune_request_stats, rollup_request_logs
+from app.log.logger import Logger
+from app.service.usage.usage_tracker import token_usage_tracker
+
+logger = Logger.setup_logger("scheduler")
+
+
+async def rollup_request_log_stats():
+    """
+    定时将新增的原始请求日志聚合到分钟表和小时表
+    """
+    try:
+        processed = await rollup_request_logs()
+        if processed:
+            logger.info(f"Rolled up {processed} request log rows into stats tables.")
+    except Exception as e:
+        logger.error(f"An error occurred during request log rollup: {str(e)}", exc_info=True)
+
+
+async def prune_expired_request_logs():
+    """
+    定时分批删除超过保留期的原始请求日志和聚合数据
+
+    原始日志只删除已完成聚合的部分，因此会先执行一次聚合。
+    """
+    try:
+        await rollup_request_logs()
+        deleted_logs = await prune_request_logs(settings.REQUEST_LOG_RETENTION_DAYS)
+        # 统计查询依赖最近 24 小时的分钟聚合，保留期至少 1 天
+        deleted_stats = await prune_request_stats(
+            max(settings.STATS_MINUTE_RETENTION_DAYS, 1),
+            settings.STATS_HOUR_RETENTION_DAYS,
+        )
+        logger.info(
+            f"Retention cleanup finished. Deleted {deleted_logs} request logs and {deleted_stats} stats rows."
+        )
+    except Exception as e:
+        logger.error(f"An error occurred during request log retention cleanup: {str(e)}", exc_info=True)
+
+
+async def flush_token_usage():
+    """
+    定时将内存中累计的 token 用量写入数据库
+    """
+    try:
+        flushed = await token_usage_tracker.flush()
+        if flushed:
+            logger.debug(f"Flushed {flushed} token usage rows.")
+    except Exception as e:
+        logger.error(f"An error occurred during token usage flush: {str(e)}", exc_info=True)
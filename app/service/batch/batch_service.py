@@ -0,0 +1,531 @@
+"""
+批处理模块
+
+兼容 OpenAI Batch API：输入文件每行为 {"custom_id", "method", "url", "body"}，批处理在后台经 OpenAIChatService 逐条执行，
+成功的结果写入输出文件，失败的写入错误文件，两者均为 JSONL，顺序与输入不一定相同。
+所有批处理共享 BATCH_MAX_CONCURRENCY 个并发请求，请求使用轮询得到的可用密钥并沿用 RetryHandler 的重试与换密钥逻辑；
+所有密钥都在 429 冷却中时暂停发出新请求，直到最早的冷却结束。
+每条请求都计入所属客户端的 RPM/TPM 配额，并以最低优先级经过准入控制，与交互请求共享密钥容量。
+
+批处理对象保存在 BATCH_STORAGE_DIR/batches，结果逐行追加到结果文件。
+重启后按结果文件中已有的 custom_id 跳过已完成的请求，继续执行未结束的批处理。
+"""
+import asyncio
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.config.config import settings
+from app.core.constants import (
+    ADMISSION_PRIORITY_RANGE,
+    BATCH_COMPLETION_WINDOW,
+    BATCH_COMPLETION_WINDOW_SECONDS,
+    BATCH_MAX_REQUESTS,
+    BATCH_PROGRESS_SAVE_INTERVAL,
+)
+from app.core.metrics import BATCH_REQUESTS
+from app.domain.openai_models import ChatRequest
+from app.exception.exceptions import APIError, RateLimitError, ResourceNotFoundError, ServiceUnavailableError
+from app.handler.retry_handler import RetryHandler
+from app.log.logger import get_batch_logger
+from app.service.batch.file_store import file_store, write_bytes_atomic
+from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.key.admission_controller import AdmissionLease, admission_controller
+from app.service.key.key_manager import KeyManager, get_key_manager_instance
+from app.service.model.model_service import ModelService
+from app.service.usage.client_quota import ClientQuota, client_quota_manager
+from app.utils import json_codec
+from app.utils.helpers import extract_status_code
+
+logger = get_batch_logger()
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+
+# 仍需在后台执行的状态
+_ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+model_service = ModelService()
+
+
+class BatchInputError(Exception):
+    """输入文件中的一行不合法"""
+
+    def __init__(self, line: int, code: str, message: str):
+        super().__init__(message)
+        self.line = line
+        self.code = code
+        self.message = message
+
+
+@RetryHandler(max_retries=settings.MAX_RETRIES, key_arg="api_key")
+async def _complete(
+    request: ChatRequest, api_key: str, key_manager: KeyManager, chat_service: OpenAIChatService, client_id: str
+) -> Dict[str, Any]:
+    return await chat_service.create_chat_completion(request, api_key, client_id=client_id)
+
+
+async def wait_for_available_key(key_manager: KeyManager) -> None:
+    """所有密钥都在 429 冷却中时等待最早的冷却结束，避免后台请求继续消耗被限流的密钥"""
+    while key_manager.available_key_count() == 0:
+        delay = key_manager.next_cooldown_expiry()
+        if delay is None:
+            # 没有冷却中的密钥，说明所有密钥都已失效，交给请求本身报错
+            return
+        await asyncio.sleep(delay)
+
+
+async def wait_for_admission(quota: ClientQuota, priority: int) -> AdmissionLease:
+    """计入一次请求并获取准入容量，超出 RPM/TPM 或被准入控制拒绝时等待后重试"""
+    while True:
+        try:
+            quota.admit()
+            break
+        except RateLimitError as e:
+            await asyncio.sleep(e.retry_after)
+    while True:
+        try:
+            return await admission_controller.acquire(priority, settings.ADMISSION_MAX_WAIT_SECONDS)
+        except ServiceUnavailableError as e:
+            await asyncio.sleep(int((e.headers or {}).get("Retry-After", 1)))
+
+
+async def run_chat_request(
+    body: Dict[str, Any], key_manager: KeyManager, chat_service: OpenAIChatService, client_id: str
+) -> Dict[str, Any]:
+    """
+    以非流式方式执行一条 /v1/chat/completions 请求
+
+    Returns:
+        {"status_code", "request_id", "body"}，失败时 body 为 OpenAI 格式的错误
+    """
+    try:
+        request = ChatRequest(**{**body, "stream": False})
+        if not model_service.check_model_support(request.model):
+            raise APIError(400, f"Model {request.model} is not supported", "invalid_request_error")
+        api_key = await key_manager.get_next_working_key()
+        response = await _complete(
+            request, api_key=api_key, key_manager=key_manager, chat_service=chat_service, client_id=client_id
+        )
+        return {"status_code": 200, "request_id": response.get("id"), "body": response}
+    except ValidationError as e:
+        status_code, code, message = 400, "invalid_request_error", str(e)
+    except Exception as e:
+        status_code = e.status_code if isinstance(e, APIError) else extract_status_code(e) or 500
+        code = e.error_code if isinstance(e, APIError) else "upstream_error"
+        message = str(e)
+    return {"status_code": status_code, "request_id": None, "body": {"error": {"code": code, "message": message}}}
+
+
+def result_line(custom_id: Optional[str], response: Optional[Dict[str, Any]], error: Optional[Dict[str, Any]] = None) -> bytes:
+    """结果文件中的一行，格式与 OpenAI Batch API 的输出文件一致"""
+    return json_codec.dumps_bytes(
+        {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id, "response": response, "error": error}
+    ) + b"\n"
+
+
+def _parse_input(path: Path, endpoint: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    解析并校验输入文件 (阻塞 IO，应在线程中调用)
+
+    Returns:
+        (custom_id, body) 列表
+
+    Raises:
+        BatchInputError: 某一行不合法
+    """
+    requests: List[Tuple[str, Dict[str, Any]]] = []
+    seen: Set[str] = set()
+    with open(path, "rb") as source:
+        for line_number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json_codec.loads(line)
+            except ValueError:
+                raise BatchInputError(line_number, "invalid_json_line", "This line is not parseable as valid JSON.")
+            if not isinstance(item, dict) or not isinstance(item.get("body"), dict):
+                raise BatchInputError(line_number, "invalid_request", "Each line must be an object with a body object.")
+            custom_id = item.get("custom_id")
+            if not isinstance(custom_id, str) or not custom_id:
+                raise BatchInputError(line_number, "missing_custom_id", "Each request must have a custom_id.")
+            if custom_id in seen:
+                raise BatchInputError(line_number, "duplicate_custom_id", f"The custom_id '{custom_id}' is duplicated.")
+            if item.get("method", "POST") != "POST" or item.get("url") != endpoint:
+                raise BatchInputError(line_number, "invalid_url", f"Each request must be a POST to {endpoint}.")
+            seen.add(custom_id)
+            requests.append((custom_id, item["body"]))
+            if len(requests) > BATCH_MAX_REQUESTS:
+                raise BatchInputError(line_number, "too_many_requests", f"A batch can contain at most {BATCH_MAX_REQUESTS} requests.")
+    if not requests:
+        raise BatchInputError(0, "empty_file", "The input file contains no requests.")
+    return requests
+
+
+def _load_custom_ids(path: Path) -> Set[str]:
+    """
+    读取结果文件中已写入的 custom_id (阻塞 IO，应在线程中调用)
+
+    进程在写入一行的中途退出时，截掉末尾不完整的一行，之后的结果从完整的行后继续追加。
+    """
+    if not path.exists():
+        return set()
+    data = path.read_bytes()
+    end = data.rfind(b"\n") + 1
+    if end != len(data):
+        with open(path, "r+b") as target:
+            target.truncate(end)
+    custom_ids = set()
+    for line in data[:end].splitlines():
+        try:
+            custom_ids.add(json_codec.loads(line)["custom_id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return custom_ids
+
+
+def _append_line(path: Path, data: bytes) -> None:
+    with open(path, "ab") as target:
+        target.write(data)
+
+
+def _register_output(file_id: str, path: Path, filename: str, purpose: str, owner: str) -> bool:
+    """结果文件非空时登记为文件对象，返回是否已登记 (阻塞 IO，应在线程中调用)"""
+    if not path.exists() or path.stat().st_size == 0:
+        return False
+    file_store.register(file_id, filename, purpose, owner)
+    return True
+
+
+class _BatchJob:
+    """一个批处理的持久化记录与运行状态"""
+
+    def __init__(self, record: Dict[str, Any], path: Path):
+        # record: {"batch": 批处理对象, "owner": 客户端标识, "output_file_id": ..., "error_file_id": ...}
+        self.record = record
+        self.batch: Dict[str, Any] = record["batch"]
+        self.path = path
+        self.write_lock = asyncio.Lock()
+        self.saved_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+        # 记录在事件循环中序列化、在线程中写入；按版本号丢弃过时的写入，
+        # 并发保存或保存被取消后再次保存时不会以旧记录覆盖新记录
+        self._file_lock = threading.Lock()
+        self._version = 0
+        self._written_version = 0
+
+    @property
+    def owner(self) -> str:
+        return self.record["owner"]
+
+    def _write(self, version: int, data: bytes) -> None:
+        with self._file_lock:
+            if version > self._written_version:
+                write_bytes_atomic(self.path, data)
+                self._written_version = version
+
+    async def save(self) -> None:
+        self._version += 1
+        self.saved_at = time.monotonic()
+        await asyncio.to_thread(self._write, self._version, json_codec.dumps_bytes(self.record))
+
+    async def save_progress(self) -> None:
+        if time.monotonic() - self.saved_at >= BATCH_PROGRESS_SAVE_INTERVAL:
+            await self.save()
+
+    async def set_status(self, status: str) -> None:
+        self.batch["status"] = status
+        self.batch[f"{status}_at"] = int(time.time())
+        await self.save()
+
+
+class BatchManager:
+    """创建、查询、取消批处理并在后台执行"""
+
+    def __init__(self):
+        self._jobs: Dict[str, _BatchJob] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def directory(self) -> Path:
+        directory = Path(settings.BATCH_STORAGE_DIR) / "batches"
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def _job_path(self, batch_id: str) -> Path:
+        if not batch_id.replace("_", "").isalnum():
+            raise ResourceNotFoundError(f"No such Batch object: {batch_id}")
+        return self.directory / f"{batch_id}.json"
+
+    def _read_job(self, batch_id: str) -> _BatchJob:
+        """从磁盘读取批处理 (阻塞 IO，应在线程中调用)"""
+        path = self._job_path(batch_id)
+        try:
+            return _BatchJob(json_codec.loads(path.read_bytes()), path)
+        except (OSError, ValueError):
+            raise ResourceNotFoundError(f"No such Batch object: {batch_id}")
+
+    def _read_records(self, skip: Set[str]) -> List[Tuple[Path, Dict[str, Any]]]:
+        """读取 skip 以外的所有批处理记录 (阻塞 IO，应在线程中调用)"""
+        records = []
+        for path in self.directory.glob("*.json"):
+            if path.stem in skip:
+                continue
+            try:
+                records.append((path, json_codec.loads(path.read_bytes())))
+            except (OSError, ValueError):
+                logger.warning(f"Skipping unreadable batch file {path}")
+        return records
+
+    async def _load(self, batch_id: str, owner: str) -> _BatchJob:
+        job = self._jobs.get(batch_id)
+        if job is None:
+            job = await asyncio.to_thread(self._read_job, batch_id)
+        if job.owner != owner:
+            raise ResourceNotFoundError(f"No such Batch object: {batch_id}")
+        return job
+
+    async def create(
+        self, owner: str, input_file_id: str, endpoint: str, completion_window: str, metadata: Optional[Dict[str, str]]
+    ) -> Dict[str, Any]:
+        """
+        创建批处理并在后台开始执行
+
+        Raises:
+            APIError: endpoint、completion_window 或输入文件的用途不受支持
+            ResourceNotFoundError: 输入文件不存在
+        """
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            raise APIError(400, f"Unsupported endpoint {endpoint}, supported: {', '.join(SUPPORTED_ENDPOINTS)}", "invalid_request_error")
+        if completion_window != BATCH_COMPLETION_WINDOW:
+            raise APIError(400, f"Unsupported completion_window {completion_window}, supported: {BATCH_COMPLETION_WINDOW}", "invalid_request_error")
+        input_file = await asyncio.to_thread(file_store.get, input_file_id, owner)
+        if input_file["purpose"] != "batch":
+            raise APIError(400, f"File {input_file_id} was not uploaded with purpose 'batch'", "invalid_request_error")
+
+        now = int(time.time())
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + BATCH_COMPLETION_WINDOW_SECONDS,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        record = {
+            "batch": batch,
+            "owner": owner,
+            "output_file_id": file_store.new_file_id(),
+            "error_file_id": file_store.new_file_id(),
+        }
+        job = _BatchJob(record, self._job_path(batch_id))
+        await job.save()
+        self._start(job)
+        logger.info(f"Created batch {batch_id} from file {input_file_id}")
+        return batch
+
+    async def get(self, batch_id: str, owner: str) -> Dict[str, Any]:
+        return (await self._load(batch_id, owner)).batch
+
+    async def list(self, owner: str, limit: int, after: Optional[str] = None) -> Dict[str, Any]:
+        """按创建时间倒序分页列出客户端的批处理"""
+        # 运行中的批处理使用内存中的记录，其余在线程中从磁盘读取
+        records = [job.record for job in self._jobs.values()]
+        records.extend(record for _, record in await asyncio.to_thread(self._read_records, set(self._jobs)))
+        batches = [record["batch"] for record in records if record.get("owner") == owner]
+        batches.sort(key=lambda batch: (batch["created_at"], batch["id"]), reverse=True)
+        if after is not None:
+            ids = [batch["id"] for batch in batches]
+            batches = batches[ids.index(after) + 1:] if after in ids else []
+        page = batches[:limit]
+        return {
+            "object": "list",
+            "data": page,
+            "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None,
+            "has_more": len(batches) > limit,
+        }
+
+    async def cancel(self, batch_id: str, owner: str) -> Dict[str, Any]:
+        """取消批处理：不再发出新请求，进行中的请求完成后状态变为 cancelled"""
+        job = await self._load(batch_id, owner)
+        status = job.batch["status"]
+        if status in ("validating", "in_progress"):
+            await job.set_status("cancelling")
+            if batch_id not in self._jobs:
+                # 进程重启后尚未恢复执行的批处理直接结束
+                await job.set_status("cancelled")
+        elif status not in ("cancelling", "cancelled"):
+            raise APIError(409, f"Cannot cancel a batch with status {status}", "invalid_request_error")
+        return job.batch
+
+    async def resume(self) -> None:
+        """启动时继续执行上次退出时未结束的批处理"""
+        for path, record in await asyncio.to_thread(self._read_records, set(self._jobs)):
+            if record["batch"]["status"] in _ACTIVE_STATUSES and path.stem not in self._jobs:
+                logger.info(f"Resuming batch {path.stem} ({record['batch']['status']})")
+                self._start(_BatchJob(record, path))
+
+    async def stop(self) -> None:
+        """停止所有批处理，状态保持不变，下次启动时由 resume 继续"""
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.task.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+
+    def _start(self, job: _BatchJob) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(settings.BATCH_MAX_CONCURRENCY, 1))
+        self._jobs[job.batch["id"]] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        job.task.add_done_callback(lambda _: self._jobs.pop(job.batch["id"], None))
+
+    async def _run(self, job: _BatchJob) -> None:
+        batch = job.batch
+        input_path = file_store.content_path(batch["input_file_id"])
+        output_path = file_store.content_path(job.record["output_file_id"])
+        error_path = file_store.content_path(job.record["error_file_id"])
+        try:
+            try:
+                requests = await asyncio.to_thread(_parse_input, input_path, batch["endpoint"])
+            except BatchInputError as e:
+                batch["errors"] = {"object": "list", "data": [{"code": e.code, "message": e.message, "param": None, "line": e.line}]}
+                await job.set_status("failed")
+                logger.warning(f"Batch {batch['id']} failed validation at line {e.line}: {e.message}")
+                return
+            except OSError:
+                batch["errors"] = {"object": "list", "data": [{"code": "file_not_found", "message": "The input file no longer exists.", "param": None, "line": None}]}
+                await job.set_status("failed")
+                return
+
+            completed = await asyncio.to_thread(_load_custom_ids, output_path)
+            failed = await asyncio.to_thread(_load_custom_ids, error_path)
+            batch["request_counts"] = {"total": len(requests), "completed": len(completed), "failed": len(failed)}
+            if batch["status"] == "validating":
+                await job.set_status("in_progress")
+            else:
+                await job.save()
+
+            pending = [request for request in requests if request[0] not in completed and request[0] not in failed]
+            await self._execute_all(job, pending, output_path, error_path)
+            await self._finalize(job, output_path, error_path)
+        except asyncio.CancelledError:
+            # 进程退出，保存进度后由下次启动继续
+            await job.save()
+            raise
+        except Exception as e:
+            logger.exception(f"Batch {batch['id']} failed: {str(e)}")
+            batch["errors"] = {"object": "list", "data": [{"code": "internal_error", "message": str(e), "param": None, "line": None}]}
+            await job.set_status("failed")
+
+    async def _execute_all(
+        self, job: _BatchJob, pending: List[Tuple[str, Dict[str, Any]]], output_path: Path, error_path: Path
+    ) -> None:
+        key_manager = await get_key_manager_instance()
+        chat_service = OpenAIChatService(settings.BASE_URL, key_manager)
+        quota = client_quota_manager.get(job.owner)
+        # 后台批处理使用最低优先级，准入容量不足时让位于交互请求
+        priority = ADMISSION_PRIORITY_RANGE[1]
+        tasks: Set[asyncio.Task] = set()
+        try:
+            for custom_id, body in pending:
+                await self._semaphore.acquire()
+                if await self._should_stop(job):
+                    self._semaphore.release()
+                    break
+                await wait_for_available_key(key_manager)
+                try:
+                    lease = await wait_for_admission(quota, priority)
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+                task = asyncio.create_task(
+                    self._execute(job, custom_id, body, key_manager, chat_service, output_path, error_path)
+                )
+                # 在回调中释放，任务在开始执行前被取消时容量也会归还
+                task.add_done_callback(lambda _, lease=lease: lease.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: self._semaphore.release())
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            # 等待被取消的请求真正结束，避免恢复执行后同一请求的结果写入两次
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _should_stop(self, job: _BatchJob) -> bool:
+        if job.batch["status"] == "cancelling":
+            return True
+        if time.time() >= job.batch["expires_at"]:
+            await job.set_status("expired")
+            logger.warning(f"Batch {job.batch['id']} expired before completion")
+            return True
+        return False
+
+    async def _execute(
+        self,
+        job: _BatchJob,
+        custom_id: str,
+        body: Dict[str, Any],
+        key_manager: KeyManager,
+        chat_service: OpenAIChatService,
+        output_path: Path,
+        error_path: Path,
+    ) -> None:
+        response = await run_chat_request(body, key_manager, chat_service, job.owner)
+        if response["status_code"] == 200:
+            path, outcome = output_path, "completed"
+        else:
+            path, outcome = error_path, "failed"
+        async with job.write_lock:
+            await asyncio.to_thread(_append_line, path, result_line(custom_id, response))
+        job.batch["request_counts"][outcome] += 1
+        BATCH_REQUESTS.labels(outcome).inc()
+        await job.save_progress()
+
+    async def _finalize(self, job: _BatchJob, output_path: Path, error_path: Path) -> None:
+        """登记结果文件并写入最终状态"""
+        batch = job.batch
+        if batch["status"] == "in_progress":
+            await job.set_status("finalizing")
+        for field, path, purpose in (
+            ("output_file_id", output_path, "batch_output"),
+            ("error_file_id", error_path, "batch_output"),
+        ):
+            file_id = job.record[field]
+            filename = f"{batch['id']}_{field[:-8]}.jsonl"
+            if await asyncio.to_thread(_register_output, file_id, path, filename, purpose, job.owner):
+                batch[field] = file_id
+        if batch["status"] == "cancelling":
+            await job.set_status("cancelled")
+        elif batch["status"] == "finalizing":
+            await job.set_status("completed")
+        else:
+            await job.save()
+        counts = batch["request_counts"]
+        logger.info(
+            f"Batch {batch['id']} {batch['status']}: {counts['completed']} completed, {counts['failed']} failed of {counts['total']}"
+        )
+
+
+batch_manager = BatchManager()
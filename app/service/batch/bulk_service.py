@@ -0,0 +1,130 @@
+"""
+批量补全模块
+
+/v1/bulk/chat/completions 的请求体为 NDJSON，每行为 {"custom_id", "body"} (与批处理输入文件的行相同，method 和 url 可省略)。
+边读取请求体边经 OpenAIChatService 并发执行，同时进行的请求数不超过窗口大小，窗口已满时暂停读取请求体；
+结果按完成顺序以 NDJSON 流式返回，每行带有对应的 custom_id，格式与批处理结果文件相同。
+每一行都计入客户端的 RPM/TPM 配额并单独经过准入控制，与普通请求按优先级共享密钥容量；
+超出配额或准入队列已满时等待而不是失败，由窗口对客户端形成背压。
+"""
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Set, Tuple
+
+from app.config.config import settings
+from app.core.constants import BULK_MAX_LINE_BYTES
+from app.log.logger import get_batch_logger
+from app.service.batch.batch_service import result_line, run_chat_request, wait_for_admission
+from app.service.chat.openai_chat_service import OpenAIChatService
+from app.service.key.key_manager import get_key_manager_instance
+from app.service.usage.client_quota import ClientQuota
+from app.utils import json_codec
+
+logger = get_batch_logger()
+
+_DONE = object()
+
+
+class BulkLineError(Exception):
+    """请求体中的一行不合法"""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncGenerator[Tuple[int, bytes], None]:
+    """把请求体切分为行，返回 (行号, 内容)，跳过空行"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > BULK_MAX_LINE_BYTES:
+            raise BulkLineError("line_too_long", f"A line exceeds the maximum size of {BULK_MAX_LINE_BYTES} bytes")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def _parse_line(line: bytes) -> Tuple[str, Dict[str, Any]]:
+    try:
+        item = json_codec.loads(line)
+    except ValueError:
+        raise BulkLineError("invalid_json_line", "This line is not parseable as valid JSON.")
+    if not isinstance(item, dict) or not isinstance(item.get("body"), dict):
+        raise BulkLineError("invalid_request", "Each line must be an object with a body object.")
+    custom_id = item.get("custom_id")
+    if not isinstance(custom_id, str) or not custom_id:
+        raise BulkLineError("missing_custom_id", "Each request must have a custom_id.")
+    return custom_id, item["body"]
+
+
+async def bulk_chat_completions(
+    chunks: AsyncIterator[bytes], quota: ClientQuota, window: int, priority: int
+) -> AsyncGenerator[bytes, None]:
+    """
+    并发执行 NDJSON 请求体中的请求，按完成顺序产出结果行
+
+    Args:
+        chunks: 请求体的字节流
+        quota: 客户端配额
+        window: 同时进行的请求数上限
+        priority: 准入优先级
+    """
+    key_manager = await get_key_manager_instance()
+    chat_service = OpenAIChatService(settings.BASE_URL, key_manager)
+    results: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(window)
+    tasks: Set[asyncio.Task] = set()
+
+    async def execute(custom_id: str, body: Dict[str, Any]) -> None:
+        try:
+            response = await run_chat_request(body, key_manager, chat_service, quota.client_id)
+            results.put_nowait(result_line(custom_id, response))
+        finally:
+            slots.release()
+
+    async def dispatch() -> None:
+        count = 0
+        try:
+            async for line_number, line in _iter_lines(chunks):
+                try:
+                    custom_id, body = _parse_line(line)
+                except BulkLineError as e:
+                    results.put_nowait(result_line(None, None, {"code": e.code, "message": e.message, "line": line_number}))
+                    continue
+                await slots.acquire()
+                lease = await wait_for_admission(quota, priority)
+                task = asyncio.create_task(execute(custom_id, body))
+                # 在回调中释放，任务在开始执行前被取消时容量也会归还
+                task.add_done_callback(lambda _, lease=lease: lease.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                count += 1
+        except BulkLineError as e:
+            results.put_nowait(result_line(None, None, {"code": e.code, "message": e.message, "line": None}))
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"Bulk completion dispatched {count} requests for client {quota.client_id}")
+            results.put_nowait(_DONE)
+
+    dispatcher = asyncio.create_task(dispatch())
+    try:
+        while True:
+            line = await results.get()
+            if line is _DONE:
+                break
+            yield line
+        # 读取请求体时的异常 (如客户端断开)
+        await dispatcher
+    finally:
+        # 客户端断开时取消未完成的请求
+        dispatcher.cancel()
+        for task in list(tasks):
+            task.cancel()
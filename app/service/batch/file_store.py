@@ -0,0 +1,129 @@
+"""
+批处理文件存储模块
+
+兼容 OpenAI /v1/files 的本地文件存储，文件保存在 BATCH_STORAGE_DIR/files 下：
+<file_id>.jsonl 为文件内容，<file_id>.json 为文件对象 (id、bytes、filename、purpose 等) 与所属客户端。
+文件只对上传它的客户端可见。
+"""
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.config.config import settings
+from app.core.constants import BATCH_MAX_FILE_BYTES
+from app.exception.exceptions import APIError, ResourceNotFoundError
+from app.utils import json_codec
+
+_COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    """先写入临时文件再替换，进程中途退出时不会留下不完整的文件"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path: Path, obj: Any) -> None:
+    write_bytes_atomic(path, json_codec.dumps_bytes(obj))
+
+
+class FileStore:
+    """本地磁盘上的文件对象"""
+
+    @property
+    def directory(self) -> Path:
+        # 每次读取配置，BATCH_STORAGE_DIR 可在运行时修改
+        directory = Path(settings.BATCH_STORAGE_DIR) / "files"
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    @staticmethod
+    def new_file_id() -> str:
+        return f"file-{uuid.uuid4().hex[:24]}"
+
+    def content_path(self, file_id: str) -> Path:
+        # 文件 ID 由本模块生成，拒绝包含路径分隔符的 ID
+        if not file_id.replace("-", "").replace("_", "").isalnum():
+            raise ResourceNotFoundError(f"No such File object: {file_id}")
+        return self.directory / f"{file_id}.jsonl"
+
+    def _meta_path(self, file_id: str) -> Path:
+        return self.content_path(file_id).with_suffix(".json")
+
+    def save_upload(self, source: BinaryIO, filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        """
+        保存上传的文件 (阻塞 IO，应在线程中调用)
+
+        Raises:
+            APIError: 文件超过 BATCH_MAX_FILE_BYTES
+        """
+        file_id = self.new_file_id()
+        path = self.content_path(file_id)
+        size = 0
+        with open(path, "wb") as target:
+            while True:
+                chunk = source.read(_COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > BATCH_MAX_FILE_BYTES:
+                    target.close()
+                    path.unlink(missing_ok=True)
+                    raise APIError(400, f"File exceeds the maximum size of {BATCH_MAX_FILE_BYTES} bytes", "invalid_request_error")
+                target.write(chunk)
+        return self.register(file_id, filename, purpose, owner)
+
+    def register(self, file_id: str, filename: str, purpose: str, owner: str) -> Dict[str, Any]:
+        """为已写入 content_path 的内容创建文件对象"""
+        file_object = {
+            "id": file_id,
+            "object": "file",
+            "bytes": self.content_path(file_id).stat().st_size,
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        write_json_atomic(self._meta_path(file_id), {"file": file_object, "owner": owner})
+        return file_object
+
+    def get(self, file_id: str, owner: str) -> Dict[str, Any]:
+        """
+        获取文件对象
+
+        Raises:
+            ResourceNotFoundError: 文件不存在或不属于该客户端
+        """
+        path = self._meta_path(file_id)
+        try:
+            meta = json_codec.loads(path.read_bytes())
+        except (OSError, ValueError):
+            raise ResourceNotFoundError(f"No such File object: {file_id}")
+        if meta.get("owner") != owner:
+            raise ResourceNotFoundError(f"No such File object: {file_id}")
+        return meta["file"]
+
+    def list(self, owner: str, purpose: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出客户端的文件，按创建时间倒序"""
+        files = []
+        for path in self.directory.glob("*.json"):
+            try:
+                meta = json_codec.loads(path.read_bytes())
+            except (OSError, ValueError):
+                continue
+            if meta.get("owner") == owner and (purpose is None or meta["file"]["purpose"] == purpose):
+                files.append(meta["file"])
+        files.sort(key=lambda file_object: file_object["created_at"], reverse=True)
+        return files
+
+    def delete(self, file_id: str, owner: str) -> Dict[str, Any]:
+        """删除文件内容与文件对象"""
+        self.get(file_id, owner)
+        self._meta_path(file_id).unlink(missing_ok=True)
+        self.content_path(file_id).unlink(missing_ok=True)
+        return {"id": file_id, "object": "file", "deleted": True}
+
+
+file_store = FileStore()
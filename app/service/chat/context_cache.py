@@ -0,0 +1,282 @@
+"""
+上游上下文缓存模块
+
+同一个长前缀 (systemInstruction、tools、toolConfig 和开头的若干条 contents) 重复出现时，
+用当前请求的密钥创建上游 cachedContents；之后前缀相同的请求改用该密钥，
+只发送前缀之后的 contents 并以 cachedContent 引用缓存，减少重复计费的输入 token 和首字延迟。
+
+缓存只能由创建它的密钥访问，因此每个条目绑定一个密钥，密钥持有的缓存数记录在 KeyManager 中。
+条目按 CONTEXT_CACHE_TTL_SECONDS 在本地判断过期，超出 CONTEXT_CACHE_MAX_ENTRIES 时淘汰最久未使用的条目并删除上游缓存；
+使用缓存的请求失败时条目立即作废，重试的请求发送完整载荷。
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config.config import settings
+from app.core.constants import (
+    CONTEXT_CACHE_BYTES_PER_TOKEN,
+    CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS,
+    CONTEXT_CACHE_MAX_ENTRIES,
+    CONTEXT_CACHE_MIN_REUSE,
+    CONTEXT_CACHE_REJECT_SECONDS,
+    CONTEXT_CACHE_SIGHTINGS_SIZE,
+)
+from app.core.metrics import CONTEXT_CACHE_EVENTS
+from app.log.logger import get_context_cache_logger
+from app.service.client.api_client import GeminiApiClient
+from app.service.key.key_manager import KeyManager
+from app.utils import json_codec
+from app.utils.cache import LRUCache
+
+logger = get_context_cache_logger()
+
+# 可以放入缓存的请求字段，使用缓存的请求不能再携带这些字段
+_PREFIX_FIELDS = ("systemInstruction", "tools", "toolConfig")
+
+
+class ContextCacheEntry:
+    """一个上游缓存，覆盖请求开头的 content_count 条 contents"""
+
+    __slots__ = ("digest", "name", "api_key", "key_manager", "content_count", "tokens", "expires_at")
+
+    def __init__(
+        self,
+        digest: bytes,
+        name: str,
+        api_key: str,
+        key_manager: KeyManager,
+        content_count: int,
+        tokens: int,
+        expires_at: float,
+    ):
+        self.digest = digest
+        self.name = name
+        self.api_key = api_key
+        # 记录缓存数的密钥管理器，条目被淘汰时据此更新
+        self.key_manager = key_manager
+        self.content_count = content_count
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+    def usable(self) -> bool:
+        return self.expires_at - CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS > time.monotonic()
+
+
+def _real_model(model: str) -> str:
+    # 与 GeminiApiClient._get_real_model 一致，缓存需创建在实际请求的模型上
+    if model.endswith("-search"):
+        model = model[:-7]
+    if model.endswith("-image"):
+        model = model[:-6]
+    return model
+
+
+def _prefix_digests(model: str, payload: Dict[str, Any]) -> List[Tuple[bytes, int]]:
+    """
+    计算每个可缓存前缀的摘要与估算 token 数
+
+    第 k 项对应 _PREFIX_FIELDS 加上开头的 k 条 contents，k 取 0 到 len(contents) - 1，
+    最后一条 contents 为本次的新消息，不计入前缀。
+    """
+    hasher = hashlib.sha256(model.encode("utf-8"))
+    size = 0
+    for field in _PREFIX_FIELDS:
+        encoded = json_codec.dumps_bytes(payload.get(field) or None)
+        hasher.update(encoded)
+        size += len(encoded)
+    digests = [(hasher.digest(), size // CONTEXT_CACHE_BYTES_PER_TOKEN)]
+    for content in payload["contents"][:-1]:
+        encoded = json_codec.dumps_bytes(content)
+        hasher.update(encoded)
+        size += len(encoded)
+        digests.append((hasher.digest(), size // CONTEXT_CACHE_BYTES_PER_TOKEN))
+    return digests
+
+
+class ContextCacheManager:
+    """按请求前缀管理上游上下文缓存"""
+
+    def __init__(self):
+        self._entries = LRUCache(CONTEXT_CACHE_MAX_ENTRIES, name="context_cache_entries", on_evict=self._on_evict)
+        # 前缀摘要 -> 出现次数
+        self._sightings = LRUCache(CONTEXT_CACHE_SIGHTINGS_SIZE, name="context_cache_sightings")
+        # 创建失败 (如前缀低于上游的最小 token 数) 的前缀摘要
+        self._rejected = LRUCache(CONTEXT_CACHE_SIGHTINGS_SIZE, ttl_seconds=CONTEXT_CACHE_REJECT_SECONDS, name="context_cache_rejected")
+        self._pending: Set[bytes] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def prepare(
+        self, model: str, payload: Dict[str, Any], api_key: str, key_manager: Optional[KeyManager]
+    ) -> Tuple[Dict[str, Any], str, Optional[ContextCacheEntry]]:
+        """
+        为一次上游请求选择缓存
+
+        命中时返回只包含新增 contents 并引用缓存的载荷和缓存所属的密钥，否则原样返回。
+        前缀出现次数达到 CONTEXT_CACHE_MIN_REUSE 时在后台创建缓存，供之后的请求使用。
+
+        Returns:
+            (载荷, 密钥, 使用的缓存条目)，请求失败时应将条目传给 invalidate
+        """
+        if (
+            key_manager is None
+            or not settings.CONTEXT_CACHE_ENABLED
+            or "cachedContent" in payload
+            or not payload.get("contents")
+        ):
+            return payload, api_key, None
+
+        model = _real_model(model)
+        digests = _prefix_digests(model, payload)
+        matched = self._match(digests, key_manager)
+        self._observe(model, payload, api_key if matched is None else matched.api_key, key_manager, digests, matched)
+        if matched is None:
+            return payload, api_key, None
+
+        CONTEXT_CACHE_EVENTS.labels("hit").inc()
+        cached_payload = {key: value for key, value in payload.items() if key not in _PREFIX_FIELDS}
+        cached_payload["contents"] = payload["contents"][matched.content_count:]
+        cached_payload["cachedContent"] = matched.name
+        return cached_payload, matched.api_key, matched
+
+    def _match(self, digests: List[Tuple[bytes, int]], key_manager: KeyManager) -> Optional[ContextCacheEntry]:
+        """查找覆盖最长前缀且仍可使用的缓存"""
+        for digest, _ in reversed(digests):
+            if digest not in self._entries:
+                continue
+            entry = self._entries.get(digest)
+            if not entry.usable():
+                self._drop(entry, "expired")
+            elif key_manager.key_failure_counts.get(entry.api_key) is None:
+                # 密钥已从配置中移除
+                self._drop(entry, "invalidated")
+            elif key_manager.is_key_usable(entry.api_key):
+                return entry
+        return None
+
+    def _observe(
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        api_key: str,
+        key_manager: KeyManager,
+        digests: List[Tuple[bytes, int]],
+        matched: Optional[ContextCacheEntry],
+    ) -> None:
+        """记录前缀出现次数，为出现次数足够且比已命中缓存更长的前缀创建缓存"""
+        min_tokens = settings.CONTEXT_CACHE_MIN_TOKENS
+        floor = matched.tokens + min_tokens if matched is not None else min_tokens
+        candidate = None
+        for content_count, (digest, tokens) in enumerate(digests):
+            if tokens < min_tokens:
+                continue
+            seen = self._sightings.get(digest, 0) + 1
+            self._sightings.put(digest, seen)
+            if (
+                seen >= CONTEXT_CACHE_MIN_REUSE
+                and tokens >= floor
+                and digest not in self._pending
+                and digest not in self._entries
+                and digest not in self._rejected
+            ):
+                candidate = content_count, digest, tokens
+        if candidate is None:
+            return
+        if key_manager.cached_content_count(api_key) >= settings.CONTEXT_CACHE_MAX_PER_KEY:
+            return
+        content_count, digest, tokens = candidate
+        ttl = settings.CONTEXT_CACHE_TTL_SECONDS
+        body: Dict[str, Any] = {"model": f"models/{model}", "contents": payload["contents"][:content_count]}
+        for field in _PREFIX_FIELDS:
+            if payload.get(field):
+                body[field] = payload[field]
+        body["ttl"] = f"{ttl}s"
+        self._pending.add(digest)
+        self._spawn(self._create(body, api_key, key_manager, content_count, digest, tokens, ttl))
+
+    def _spawn(self, coro) -> None:
+        # 保留任务引用，避免后台任务在完成前被回收
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _create(
+        self,
+        body: Dict[str, Any],
+        api_key: str,
+        key_manager: KeyManager,
+        content_count: int,
+        digest: bytes,
+        tokens: int,
+        ttl: int,
+    ) -> None:
+        model = body["model"]
+        try:
+            created_at = time.monotonic()
+            response = await _api_client().create_cached_content(body, api_key)
+            name = response["name"]
+        except Exception as e:
+            CONTEXT_CACHE_EVENTS.labels("create_failed").inc()
+            self._rejected.put(digest, True)
+            logger.warning(f"Failed to create context cache for {model} ({content_count} contents, ~{tokens} tokens): {str(e)}")
+            return
+        finally:
+            self._pending.discard(digest)
+
+        tokens = (response.get("usageMetadata") or {}).get("totalTokenCount", tokens)
+        entry = ContextCacheEntry(digest, name, api_key, key_manager, content_count, tokens, created_at + ttl)
+        key_manager.track_cached_content(api_key, name)
+        self._entries.put(digest, entry)
+        CONTEXT_CACHE_EVENTS.labels("created").inc()
+        logger.info(f"Created context cache {name} for {model} ({content_count} contents, {tokens} tokens)")
+
+    def invalidate(self, entry: Optional[ContextCacheEntry]) -> None:
+        """使用缓存的请求失败时作废条目 (缓存可能已被上游删除或密钥不可用)"""
+        if entry is not None and self._drop(entry, "invalidated"):
+            self._schedule_delete(entry)
+
+    def _drop(self, entry: ContextCacheEntry, reason: str) -> bool:
+        """移除条目，条目已被移除时返回 False"""
+        current = self._entries.pop(entry.digest)
+        if current is not entry:
+            if current is not None:
+                self._entries.put(entry.digest, current)
+            return False
+        self._untrack(entry)
+        CONTEXT_CACHE_EVENTS.labels(reason).inc()
+        return True
+
+    def _on_evict(self, entry: ContextCacheEntry) -> None:
+        self._untrack(entry)
+        CONTEXT_CACHE_EVENTS.labels("evicted").inc()
+        self._schedule_delete(entry)
+
+    @staticmethod
+    def _untrack(entry: ContextCacheEntry) -> None:
+        entry.key_manager.untrack_cached_content(entry.api_key, entry.name)
+
+    def _schedule_delete(self, entry: ContextCacheEntry) -> None:
+        """在后台删除上游缓存，避免继续按存储时长计费"""
+        if entry.usable():
+            self._spawn(self._delete(entry))
+
+    @staticmethod
+    async def _delete(entry: ContextCacheEntry) -> None:
+        try:
+            await _api_client().delete_cached_content(entry.name, entry.api_key)
+        except Exception as e:
+            logger.warning(f"Failed to delete context cache {entry.name}: {str(e)}")
+
+
+def _api_client() -> GeminiApiClient:
+    return GeminiApiClient(
+        settings.BASE_URL,
+        settings.TIME_OUT,
+        proxy_enabled=settings.PROXY_ENABLED,
+        http_proxy=settings.HTTP_PROXY,
+        https_proxy=settings.HTTPS_PROXY,
+    )
+
+
+context_cache_manager = ContextCacheManager()
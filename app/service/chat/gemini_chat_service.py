@@ -1,21 +1,33 @@
 # app/services/chat_service.py
 
-import json
+import hashlib
 import re
 import datetime # Add datetime import
 import time # Add time import
-from typing import Any, AsyncGenerator, Dict, List
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
 from app.config.config import settings
+from app.core.constants import COUNT_TOKENS_CACHE_SIZE, COUNT_TOKENS_CACHE_TTL_SECONDS
+from app.core.tracing import trace_span
 from app.domain.gemini_models import GeminiRequest
-from app.handler.response_handler import GeminiResponseHandler
+from app.handler.response_handler import GeminiResponseHandler, extract_usage
 from app.handler.stream_optimizer import gemini_optimizer
 from app.log.logger import get_gemini_logger
-from app.service.client.api_client import GeminiApiClient
+from app.exception.exceptions import UpstreamKeyError
+from app.service.chat.context_cache import context_cache_manager
+from app.service.chat.payload_templates import builtin_tools, cached_tool_block, get_safety_settings
+from app.service.chat.token_budget import check_token_budget
+from app.service.client.api_client import GeminiApiClient, StreamTimings
 from app.service.key.key_manager import KeyManager
+from app.service.usage.usage_tracker import token_usage_tracker
+from app.utils import json_codec
+from app.utils.cache import LRUCache
 from app.database.services import add_error_log, add_request_log # Import add_request_log
 
 logger = get_gemini_logger()
 
+# countTokens 的结果只取决于模型和请求体，按二者的摘要缓存
+_count_tokens_cache = LRUCache(COUNT_TOKENS_CACHE_SIZE, ttl_seconds=COUNT_TOKENS_CACHE_TTL_SECONDS, name="count_tokens")
+
 
 def _has_image_parts(contents: List[Dict[str, Any]]) -> bool:
     """判断消息是否包含图片部分"""
@@ -27,66 +39,62 @@ def _has_image_parts(contents: List[Dict[str, Any]]) -> bool:
     return False
 
 
-def _build_tools(model: str, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """构建工具"""
-    
-    def _merge_tools(tools: List[Dict[str, Any]]) -> Dict[str, Any]:
-        record = dict()
-        for item in tools:
-            if not item or not isinstance(item, dict):
-                continue
-
-            for k, v in item.items():
-                if k == "functionDeclarations" and v and isinstance(v, list):
-                    functions = record.get("functionDeclarations", [])
-                    functions.extend(v)
-                    record["functionDeclarations"] = functions
-                else:
-                    record[k] = v
-        return record
+def _merge_tools(tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并请求中的多个工具定义"""
+    record = dict()
+    for item in tools:
+        if not item or not isinstance(item, dict):
+            continue
+
+        for k, v in item.items():
+            if k == "functionDeclarations" and v and isinstance(v, list):
+                functions = record.get("functionDeclarations", [])
+                functions.extend(v)
+                record["functionDeclarations"] = functions
+            else:
+                record[k] = v
+    return record
+
+
+def _function_declaration_tool(tools: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """合并带函数声明的工具定义，没有函数声明时结果与模型相关，返回 None 表示不缓存"""
+    tool = _merge_tools(tools)
+    if not tool.get("functionDeclarations"):
+        return None
+    # 解决 "Tool use with function calling is unsupported" 问题
+    tool.pop("googleSearch", None)
+    tool.pop("codeExecution", None)
+    return tool
+
 
+def _build_tools(model: str, payload: Dict[str, Any]) -> Sequence[Dict[str, Any]]:
+    """构建工具"""
     tool = dict()
     if payload and isinstance(payload, dict) and "tools" in payload:
         if payload.get("tools") and isinstance(payload.get("tools"), dict):
             payload["tools"] = [payload.get("tools")]
         items = payload.get("tools", [])
         if items and isinstance(items, list):
+            block = cached_tool_block(items, _function_declaration_tool)
+            if block is not None:
+                return block
             tool.update(_merge_tools(items))
 
-    if (
+    code_execution = (
         settings.TOOLS_CODE_EXECUTION_ENABLED
         and not (model.endswith("-search") or "-thinking" in model)
         and not _has_image_parts(payload.get("contents", []))
-    ):
+    )
+    search = model.endswith("-search")
+    if not tool:
+        # 请求未自带工具时使用共享的内置工具模板
+        return builtin_tools(code_execution, search)
+
+    if code_execution:
         tool["codeExecution"] = {}
-    if model.endswith("-search"):
+    if search:
         tool["googleSearch"] = {}
-
-    # 解决 "Tool use with function calling is unsupported" 问题
-    if tool.get("functionDeclarations"):
-        tool.pop("googleSearch", None)
-        tool.pop("codeExecution", None)
-
-    return [tool] if tool else []
-
-
-def _get_safety_settings(model: str) -> List[Dict[str, str]]:
-    """获取安全设置"""
-    if model == "gemini-2.0-flash-exp":
-        return [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_CIVIC_INTEGRITY", "threshold": "OFF"},
-        ]
-    return [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_CIVIC_INTEGRITY", "threshold": "BLOCK_NONE"},
-    ]
+    return [tool]
 
 
 def _build_payload(model: str, request: GeminiRequest) -> Dict[str, Any]:
@@ -100,7 +108,7 @@ def _build_payload(model: str, request: GeminiRequest) -> Dict[str, Any]:
     payload = {
         "contents": request_dict.get("contents", []),
         "tools": _build_tools(model, request_dict),
-        "safetySettings": _get_safety_settings(model),
+        "safetySettings": get_safety_settings(model),
         "generationConfig": request_dict.get("generationConfig", {}),
         "systemInstruction": request_dict.get("systemInstruction", ""),
     }
@@ -108,6 +116,7 @@ def _build_payload(model: str, request: GeminiRequest) -> Dict[str, Any]:
     if model.endswith("-image") or model.endswith("-image-generation"):
         payload.pop("systemInstruction")
         payload["generationConfig"]["responseModalities"] = ["Text", "Image"]
+    check_token_budget(model, payload)
     return payload
 
 
@@ -142,7 +151,7 @@ class GeminiChatService:
         self, original_response: Dict[str, Any], text: str
     ) -> Dict[str, Any]:
         """创建包含指定文本的响应"""
-        response_copy = json.loads(json.dumps(original_response))  # 深拷贝
+        response_copy = json_codec.loads(json_codec.dumps_bytes(original_response))  # 深拷贝
         if response_copy.get("candidates") and response_copy["candidates"][0].get(
             "content", {}
         ).get("parts"):
@@ -150,27 +159,31 @@ class GeminiChatService:
         return response_copy
 
     async def generate_content(
-        self, model: str, request: GeminiRequest, api_key: str
+        self, model: str, request: GeminiRequest, api_key: str, client_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """生成内容"""
-        payload = _build_payload(model, request)
+        with trace_span("payload_build"):
+            payload = _build_payload(model, request)
         start_time = time.perf_counter()
         request_datetime = datetime.datetime.now() # Record request time
         is_success = False
         status_code = None
         response = None
+        upstream_payload, api_key, cache_entry = context_cache_manager.prepare(model, payload, api_key, self.key_manager)
 
         try:
-            response = await self.api_client.generate_content(payload, model, api_key)
+            response = await self.api_client.generate_content(upstream_payload, model, api_key)
             # Assuming success if no exception is raised and response is received
             # The actual status code might be within the response structure or headers,
             # but api_client doesn't seem to expose it directly here.
             # We'll assume 200 for success if no exception.
             is_success = True
             status_code = 200 # Assume 200 on success
+            token_usage_tracker.record(api_key, model, client_id, extract_usage(response))
             return self.response_handler.handle_response(response, model, stream=False)
         except Exception as e:
             is_success = False
+            context_cache_manager.invalidate(cache_entry)
             error_log_msg = str(e)
             logger.error(f"Normal API call failed with error: {error_log_msg}")
             # Try to parse status code from exception
@@ -189,6 +202,9 @@ class GeminiChatService:
                 error_code=status_code,
                 request_msg=payload
             )
+            if cache_entry is not None:
+                # 请求使用了缓存所属的密钥，失败应计入该密钥而不是路由选择的密钥
+                raise UpstreamKeyError(api_key, error_log_msg) from e
             raise e # Re-throw exception for upstream handling
         finally:
             end_time = time.perf_counter()
@@ -203,32 +219,53 @@ class GeminiChatService:
                 request_time=request_datetime
             )
 
-    async def stream_generate_content(
-        self, model: str, request: GeminiRequest, api_key: str
+    async def count_tokens(self, model: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """计算 token 数，相同模型和请求体的结果从缓存返回"""
+        digest = hashlib.sha256(model.encode("utf-8") + b"\0" + json_codec.dumps_bytes(payload)).digest()
+        response = _count_tokens_cache.get(digest)
+        if response is None:
+            response = await self.api_client.count_tokens(payload, model, api_key)
+            _count_tokens_cache.put(digest, response)
+        return response
+
+    def stream_generate_content(
+        self, model: str, request: GeminiRequest, api_key: str, client_id: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """流式生成内容，载荷在调用时构建，预检失败时在开始流式响应前抛出"""
+        with trace_span("payload_build"):
+            payload = _build_payload(model, request)
+        return self._stream_generate_content(model, payload, api_key, client_id)
+
+    async def _stream_generate_content(
+        self, model: str, payload: Dict[str, Any], api_key: str, client_id: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
-        """流式生成内容"""
         retries = 0
         max_retries = settings.MAX_RETRIES
-        payload = _build_payload(model, request)
         start_time = time.perf_counter() # Record start time before loop
         request_datetime = datetime.datetime.now()
         is_success = False
         status_code = None
         final_api_key = api_key # Store the initial key
+        timings = None
 
         try:
             while retries < max_retries:
-                current_attempt_key = api_key # Key used for this attempt
+                # 命中上下文缓存时改用缓存所属的密钥
+                upstream_payload, current_attempt_key, cache_entry = context_cache_manager.prepare(model, payload, api_key, self.key_manager)
                 final_api_key = current_attempt_key # Update final key used
+                timings = StreamTimings() # 只记录最后一次尝试的时延
+                usage = None
                 try:
                     async for line in self.api_client.stream_generate_content(
-                        payload, model, current_attempt_key
+                        upstream_payload, model, current_attempt_key, timings
                     ):
                         # print(line)
                         if line.startswith("data:"):
                             line = line[6:]
+                            chunk = json_codec.loads(line)
+                            usage = extract_usage(chunk) or usage
                             response_data = self.response_handler.handle_response(
-                                json.loads(line), model, stream=True
+                                chunk, model, stream=True
                             )
                             text = self._extract_text_from_response(response_data)
                             # 如果有文本内容，且开启了流式输出优化器，则使用流式输出优化器处理
@@ -239,19 +276,24 @@ class GeminiChatService:
                                 ) in gemini_optimizer.optimize_stream_output(
                                     text,
                                     lambda t: self._create_char_response(response_data, t),
-                                    lambda c: "data: " + json.dumps(c) + "\n\n",
+                                    json_codec.sse_data,
                                 ):
+                                    timings.record_chunk(optimized_chunk)
                                     yield optimized_chunk
                             else:
                                 # 如果没有文本内容（如工具调用等），整块输出
-                                yield "data: " + json.dumps(response_data) + "\n\n"
+                                output = json_codec.sse_data(response_data)
+                                timings.record_chunk(output)
+                                yield output
                     logger.info("Streaming completed successfully")
+                    token_usage_tracker.record(current_attempt_key, model, client_id, usage)
                     is_success = True
                     status_code = 200 # Assume 200 on success
                     break # Exit loop on success
                 except Exception as e:
                     retries += 1
                     is_success = False # Mark as failed for this attempt
+                    context_cache_manager.invalidate(cache_entry)
                     error_log_msg = str(e)
                     logger.warning(
                         f"Streaming API call failed with error: {error_log_msg}. Attempt {retries} of {max_retries}"
@@ -273,7 +315,7 @@ class GeminiChatService:
                     )
 
                     # Attempt to switch API Key
-                    api_key = await self.key_manager.handle_api_failure(current_attempt_key, retries)
+                    api_key = await self.key_manager.handle_api_failure(current_attempt_key, retries, status_code)
                     if api_key:
                         logger.info(f"Switched to new API key: {api_key}")
                     else: # No more keys or retries exceeded by handle_api_failure logic
@@ -295,7 +337,8 @@ class GeminiChatService:
                 is_success=is_success, # Log the final success status
                 status_code=status_code, # Log the last known status code
                 latency_ms=latency_ms, # Log total time including retries
-                request_time=request_datetime
+                request_time=request_datetime,
+                stream_timings=timings.as_log_fields() if timings else None
             )
             # If the loop finished due to failure, ensure an exception is raised if not already handled
             if not is_success and retries >= max_retries:
@@ -1,21 +1,26 @@
 # app/services/chat_service.py
 
-import json
 import re
 import datetime # Add datetime import
 import time # Add time import
-from copy import deepcopy
-from typing import Any, AsyncGenerator, Dict, List, Optional, Union
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence, Union
 
 from app.config.config import settings
+from app.core.tracing import trace_span
 from app.domain.openai_models import ChatRequest, ImageGenerationRequest
 from app.handler.message_converter import OpenAIMessageConverter
-from app.handler.response_handler import OpenAIResponseHandler
+from app.handler.response_handler import OpenAIResponseHandler, extract_usage
 from app.handler.stream_optimizer import openai_optimizer
 from app.log.logger import get_openai_logger
-from app.service.client.api_client import GeminiApiClient
+from app.exception.exceptions import UpstreamKeyError
+from app.service.chat.context_cache import context_cache_manager
+from app.service.chat.payload_templates import builtin_tools, cached_tool_block, get_safety_settings
+from app.service.chat.token_budget import check_token_budget
+from app.service.client.api_client import GeminiApiClient, StreamTimings
 from app.service.image.image_create_service import ImageCreateService
 from app.service.key.key_manager import KeyManager
+from app.service.usage.usage_tracker import token_usage_tracker
+from app.utils import json_codec
 from app.database.services import add_error_log, add_request_log # Import add_request_log
 
 logger = get_openai_logger()
@@ -31,14 +36,51 @@ def _has_image_parts(contents: List[Dict[str, Any]]) -> bool:
     return False
 
 
+def _has_tool_calls(chunk: Dict[str, Any]) -> bool:
+    """判断 OpenAI 流式响应块的 delta 中是否包含工具调用"""
+    for choice in chunk.get("choices") or ():
+        if (choice.get("delta") or {}).get("tool_calls"):
+            return True
+    return False
+
+
+def _build_function_declarations(tools: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """将 OpenAI 格式的函数定义转换为 Gemini 的 functionDeclarations，按 name 去重"""
+    names, functions = set(), []
+    for item in tools or ():
+        if not item or not isinstance(item, dict):
+            continue
+
+        if item.get("type", "") == "function" and item.get("function"):
+            function = item["function"]
+            parameters = function.get("parameters", {})
+            if parameters.get("type") == "object" and not parameters.get("properties", {}):
+                # 只去掉顶层的 parameters，浅拷贝即可，不修改请求中的定义
+                function = {key: value for key, value in function.items() if key != "parameters"}
+            if function.get("name") not in names:
+                names.add(function.get("name"))
+                functions.append(function)
+    return functions
+
+
+def _function_declaration_tool(tools: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """将请求的 tools 转换为 functionDeclarations 工具，没有函数定义时返回 None"""
+    function_declarations = _build_function_declarations(tools)
+    return {"functionDeclarations": function_declarations} if function_declarations else None
+
+
 def _build_tools(
     request: ChatRequest, messages: List[Dict[str, Any]]
-) -> List[Dict[str, Any]]:
+) -> Sequence[Dict[str, Any]]:
     """构建工具"""
-    tool = dict()
-    model = request.model
+    if request.tools:
+        # 解决 "Tool use with function calling is unsupported" 问题，有函数声明时不启用搜索和代码执行
+        block = cached_tool_block(request.tools, _function_declaration_tool)
+        if block is not None:
+            return block
 
-    if (
+    model = request.model
+    code_execution = (
         settings.TOOLS_CODE_EXECUTION_ENABLED
         and not (
             model.endswith("-search")
@@ -47,66 +89,8 @@ def _build_tools(
             or model.endswith("-image-generation")
         )
         and not _has_image_parts(messages)
-    ):
-        tool["codeExecution"] = {}
-    if model.endswith("-search"):
-        tool["googleSearch"] = {}
-
-    # 将 request 中的 tools 合并到 tools 中
-    if request.tools:
-        function_declarations = []
-        for item in request.tools:
-            if not item or not isinstance(item, dict):
-                continue
-
-            if item.get("type", "") == "function" and item.get("function"):
-                function = deepcopy(item.get("function"))
-                parameters = function.get("parameters", {})
-                if parameters.get("type") == "object" and not parameters.get("properties", {}):
-                    function.pop("parameters", None)
-
-                function_declarations.append(function)
-
-        if function_declarations:
-            # 按照 function 的 name 去重
-            names, functions = set(), []
-            for fc in function_declarations:
-                if fc.get("name") not in names:
-                    names.add(fc.get("name"))
-                    functions.append(fc)
-
-            tool["functionDeclarations"] = functions
-
-    # 解决 "Tool use with function calling is unsupported" 问题
-    if tool.get("functionDeclarations"):
-        tool.pop("googleSearch", None)
-        tool.pop("codeExecution", None)
-
-    return [tool] if tool else []
-
-
-def _get_safety_settings(model: str) -> List[Dict[str, str]]:
-    """获取安全设置"""
-    # if (
-    #     "2.0" in model
-    #     and "gemini-2.0-flash-thinking-exp" not in model
-    #     and "gemini-2.0-pro-exp" not in model
-    # ):
-    if model == "gemini-2.0-flash-exp":
-        return [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "OFF"},
-            {"category": "HARM_CATEGORY_CIVIC_INTEGRITY", "threshold": "OFF"},
-        ]
-    return [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_CIVIC_INTEGRITY", "threshold": "BLOCK_NONE"},
-    ]
+    )
+    return builtin_tools(code_execution, model.endswith("-search"))
 
 
 def _build_payload(
@@ -124,7 +108,7 @@ def _build_payload(
             "topK": request.top_k,
         },
         "tools": _build_tools(request, messages),
-        "safetySettings": _get_safety_settings(request.model),
+        "safetySettings": get_safety_settings(request.model),
     }
     if request.max_tokens is not None:
         payload["generationConfig"]["maxOutputTokens"] = request.max_tokens
@@ -141,6 +125,7 @@ def _build_payload(
     ):
         payload["systemInstruction"] = instruction
 
+    check_token_budget(request.model, payload)
     return payload
 
 
@@ -174,7 +159,7 @@ class OpenAIChatService:
         self, original_chunk: Dict[str, Any], text: str
     ) -> Dict[str, Any]:
         """创建包含指定文本的OpenAI响应块"""
-        chunk_copy = json.loads(json.dumps(original_chunk))  # 深拷贝
+        chunk_copy = json_codec.loads(json_codec.dumps_bytes(original_chunk))  # 深拷贝
         if chunk_copy.get("choices") and "delta" in chunk_copy["choices"][0]:
             chunk_copy["choices"][0]["delta"]["content"] = text
         return chunk_copy
@@ -183,20 +168,25 @@ class OpenAIChatService:
         self,
         request: ChatRequest,
         api_key: str,
+        client_id: Optional[str] = None,
     ) -> Dict[str, Any]:
         """创建聊天完成"""
-        # 转换消息格式
-        messages, instruction = self.message_converter.convert(request.messages)
+        with trace_span("payload_build"):
+            # 转换消息格式
+            messages, instruction = self.message_converter.convert(request.messages)
 
-        # 构建请求payload
-        payload = _build_payload(request, messages, instruction)
+            # 构建请求payload
+            payload = _build_payload(request, messages, instruction)
 
         if request.stream:
-            return self._handle_stream_completion(request.model, payload, api_key)
-        return await self._handle_normal_completion(request.model, payload, api_key)
+            include_usage = bool((request.stream_options or {}).get("include_usage"))
+            return self._handle_stream_completion(
+                request.model, payload, api_key, client_id, include_usage
+            )
+        return await self._handle_normal_completion(request.model, payload, api_key, client_id)
 
     async def _handle_normal_completion(
-        self, model: str, payload: Dict[str, Any], api_key: str
+        self, model: str, payload: Dict[str, Any], api_key: str, client_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """处理普通聊天完成"""
         start_time = time.perf_counter()
@@ -204,15 +194,18 @@ class OpenAIChatService:
         is_success = False
         status_code = None
         response = None
+        upstream_payload, api_key, cache_entry = context_cache_manager.prepare(model, payload, api_key, self.key_manager)
         try:
-            response = await self.api_client.generate_content(payload, model, api_key)
+            response = await self.api_client.generate_content(upstream_payload, model, api_key)
             is_success = True
             status_code = 200 # Assume 200 on success
+            token_usage_tracker.record(api_key, model, client_id, extract_usage(response))
             return self.response_handler.handle_response(
                 response, model, stream=False, finish_reason="stop"
             )
         except Exception as e:
             is_success = False
+            context_cache_manager.invalidate(cache_entry)
             error_log_msg = str(e)
             logger.error(f"Normal API call failed with error: {error_log_msg}")
             # Try to parse status code from exception
@@ -230,6 +223,9 @@ class OpenAIChatService:
                 error_code=status_code,
                 request_msg=payload
             )
+            if cache_entry is not None:
+                # 请求使用了缓存所属的密钥，失败应计入该密钥而不是路由选择的密钥
+                raise UpstreamKeyError(api_key, error_log_msg) from e
             raise e # Re-throw exception
         finally:
             end_time = time.perf_counter()
@@ -244,7 +240,12 @@ class OpenAIChatService:
             )
 
     async def _handle_stream_completion(
-        self, model: str, payload: Dict[str, Any], api_key: str
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        api_key: str,
+        client_id: Optional[str] = None,
+        include_usage: bool = False,
     ) -> AsyncGenerator[str, None]:
         """处理流式聊天完成，添加重试逻辑"""
         retries = 0
@@ -254,22 +255,30 @@ class OpenAIChatService:
         is_success = False
         status_code = None
         final_api_key = api_key # Store the initial key
+        timings = None
 
         try:
             while retries < max_retries:
-                current_attempt_key = api_key # Key used for this attempt
+                # 命中上下文缓存时改用缓存所属的密钥
+                upstream_payload, current_attempt_key, cache_entry = context_cache_manager.prepare(model, payload, api_key, self.key_manager)
                 final_api_key = current_attempt_key # Update final key used
+                timings = StreamTimings() # 只记录最后一次尝试的时延
+                usage = None
                 try:
                     tool_call_flag = False
                     async for line in self.api_client.stream_generate_content(
-                        payload, model, current_attempt_key
+                        upstream_payload, model, current_attempt_key, timings
                     ):
                         # print(line)
                         if line.startswith("data:"):
-                            chunk = json.loads(line[6:])
+                            chunk = json_codec.loads(line[6:])
+                            usage = extract_usage(chunk) or usage
                             openai_chunk = self.response_handler.handle_response(
                                 chunk, model, stream=True, finish_reason=None
                             )
+                            if openai_chunk and include_usage:
+                                # 与 OpenAI 一致，用量块之前的每个块都带有 "usage": null
+                                openai_chunk["usage"] = None
                             if openai_chunk:
                                 # 提取文本内容
                                 text = self._extract_text_from_openai_chunk(openai_chunk)
@@ -282,18 +291,29 @@ class OpenAIChatService:
                                         lambda t: self._create_char_openai_chunk(
                                             openai_chunk, t
                                         ),
-                                        lambda c: f"data: {json.dumps(c)}\n\n",
+                                        json_codec.sse_data,
                                     ):
+                                        timings.record_chunk(optimized_chunk)
                                         yield optimized_chunk
                                 else:
                                     # 如果没有文本内容（如工具调用等），整块输出
-                                    if "tool_calls" in json.dumps(openai_chunk):
+                                    if _has_tool_calls(openai_chunk):
                                         tool_call_flag = True
-                                    yield f"data: {json.dumps(openai_chunk)}\n\n"
-                    if tool_call_flag:
-                        yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='tool_calls'))}\n\n"
-                    else:
-                        yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))}\n\n"
+                                    output = json_codec.sse_data(openai_chunk)
+                                    timings.record_chunk(output)
+                                    yield output
+                    token_usage_tracker.record(current_attempt_key, model, client_id, usage)
+                    finish_reason = "tool_calls" if tool_call_flag else "stop"
+                    finish_chunk = self.response_handler.handle_response({}, model, stream=True, finish_reason=finish_reason)
+                    if include_usage:
+                        finish_chunk["usage"] = None
+                    output = json_codec.sse_data(finish_chunk)
+                    timings.record_bytes(output)
+                    yield output
+                    if include_usage:
+                        output = json_codec.sse_data(self.response_handler.handle_usage_chunk(usage, model))
+                        timings.record_bytes(output)
+                        yield output
                     yield "data: [DONE]\n\n"
                     logger.info("Streaming completed successfully")
                     is_success = True
@@ -302,6 +322,7 @@ class OpenAIChatService:
                 except Exception as e:
                     retries += 1
                     is_success = False # Mark as failed for this attempt
+                    context_cache_manager.invalidate(cache_entry)
                     error_log_msg = str(e)
                     logger.warning(
                         f"Streaming API call failed with error: {error_log_msg}. Attempt {retries} of {max_retries}"
@@ -326,7 +347,7 @@ class OpenAIChatService:
                     # Attempt to switch API Key
                     # Ensure key_manager is available (might need adjustment if not always passed)
                     if self.key_manager:
-                        api_key = await self.key_manager.handle_api_failure(current_attempt_key, retries)
+                        api_key = await self.key_manager.handle_api_failure(current_attempt_key, retries, status_code)
                         if api_key:
                             logger.info(f"Switched to new API key: {api_key}")
                         else:
@@ -351,11 +372,12 @@ class OpenAIChatService:
                 is_success=is_success, # Log the final success status
                 status_code=status_code, # Log the last known status code
                 latency_ms=latency_ms, # Log total time including retries
-                request_time=request_datetime
+                request_time=request_datetime,
+                stream_timings=timings.as_log_fields() if timings else None
             )
             # If the loop finished due to failure, yield error and DONE
             if not is_success and retries >= max_retries:
-                 yield f"data: {json.dumps({'error': 'Streaming failed after retries'})}\n\n"
+                 yield json_codec.sse_data({'error': 'Streaming failed after retries'})
                  yield "data: [DONE]\n\n"
 
     async def create_image_chat_completion(
@@ -391,13 +413,13 @@ class OpenAIChatService:
                     ) in openai_optimizer.optimize_stream_output(
                         text,
                         lambda t: self._create_char_openai_chunk(openai_chunk, t),
-                        lambda c: f"data: {json.dumps(c)}\n\n",
+                        json_codec.sse_data,
                     ):
                         yield optimized_chunk
                 else:
                     # 如果没有文本内容（如图片URL等），整块输出
-                    yield f"data: {json.dumps(openai_chunk)}\n\n"
-        yield f"data: {json.dumps(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))}\n\n"
+                    yield json_codec.sse_data(openai_chunk)
+        yield json_codec.sse_data(self.response_handler.handle_response({}, model, stream=True, finish_reason='stop'))
         yield "data: [DONE]\n\n"
         logger.info("Image chat streaming completed successfully")
 
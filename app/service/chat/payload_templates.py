@@ -0,0 +1,79 @@
+"""
+请求载荷模板
+
+安全设置和内置工具块在所有请求间共享，模块加载时通过 json_codec.freeze 预先编码，
+构造载荷时直接引用，序列化时拼接预编码的字节。模板为元组，使用方不得修改。
+请求自带的函数声明以 tools 的序列化结果为键缓存转换结果，同样预先编码。
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.constants import FUNCTION_DECLARATION_CACHE_SIZE
+from app.utils import json_codec
+from app.utils.cache import LRUCache
+
+_SAFETY_CATEGORIES = (
+    "HARM_CATEGORY_HARASSMENT",
+    "HARM_CATEGORY_HATE_SPEECH",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    "HARM_CATEGORY_DANGEROUS_CONTENT",
+    "HARM_CATEGORY_CIVIC_INTEGRITY",
+)
+# 支持 OFF 阈值的模型
+_SAFETY_OFF_MODELS = frozenset({"gemini-2.0-flash-exp"})
+
+
+def _safety_settings(threshold: str) -> Tuple[Dict[str, str], ...]:
+    return json_codec.freeze(tuple({"category": category, "threshold": threshold} for category in _SAFETY_CATEGORIES))
+
+
+SAFETY_SETTINGS_OFF = _safety_settings("OFF")
+SAFETY_SETTINGS_BLOCK_NONE = _safety_settings("BLOCK_NONE")
+
+NO_TOOLS: Tuple[Dict[str, Any], ...] = json_codec.freeze(())
+CODE_EXECUTION_TOOLS: Tuple[Dict[str, Any], ...] = json_codec.freeze(({"codeExecution": {}},))
+SEARCH_TOOLS: Tuple[Dict[str, Any], ...] = json_codec.freeze(({"googleSearch": {}},))
+
+
+def get_safety_settings(model: str) -> Tuple[Dict[str, str], ...]:
+    """获取模型的安全设置"""
+    if model in _SAFETY_OFF_MODELS:
+        return SAFETY_SETTINGS_OFF
+    return SAFETY_SETTINGS_BLOCK_NONE
+
+
+def builtin_tools(code_execution: bool, search: bool) -> Tuple[Dict[str, Any], ...]:
+    """获取请求未自带工具时的内置工具块，搜索模型不启用代码执行"""
+    if search:
+        return SEARCH_TOOLS
+    if code_execution:
+        return CODE_EXECUTION_TOOLS
+    return NO_TOOLS
+
+
+# tools 的序列化字节 -> 已登记预编码的工具块，淘汰时取消登记。
+# 直接以字节为键，省去额外计算摘要，代价是键本身占用与 tools 相当的内存
+_tool_blocks = LRUCache(FUNCTION_DECLARATION_CACHE_SIZE, name="function_declarations", on_evict=json_codec.unfreeze)
+
+
+def cached_tool_block(
+    tools: List[Dict[str, Any]], build: Callable[[List[Dict[str, Any]]], Optional[Dict[str, Any]]]
+) -> Optional[Tuple[Dict[str, Any], ...]]:
+    """
+    获取请求 tools 转换后的工具块，相同内容的 tools 复用缓存
+
+    Args:
+        tools: 请求中的 tools
+        build: 转换函数，返回与模型无关的工具定义；返回 None 表示结果不可缓存
+
+    Returns:
+        预编码的工具块，build 返回 None 时为 None
+    """
+    key = json_codec.dumps_bytes(tools)
+    block = _tool_blocks.get(key)
+    if block is None:
+        tool = build(tools)
+        if tool is None:
+            return None
+        block = json_codec.freeze((tool,))
+        _tool_blocks.put(key, block)
+    return block
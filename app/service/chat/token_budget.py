@@ -0,0 +1,65 @@
+"""
+请求 token 预检模块
+
+PREFLIGHT_MAX_INPUT_TOKENS 大于 0 时，在构建上游载荷后估算输入 token 数，超过上限的请求在本地以 400 拒绝，
+不再发往上游，避免上游的 400 触发重试并计入密钥失败次数。
+估算偏保守 (宁可放行也不误拒)：文本按 UTF-8 字节数除以 PREFLIGHT_BYTES_PER_TOKEN，
+图片等媒体部分按固定 token 数计，其余结构化部分 (函数调用、工具声明等) 按序列化后的字节数计。
+"""
+from typing import Any, Dict
+
+from app.config.config import settings
+from app.core.constants import PREFLIGHT_BYTES_PER_TOKEN, PREFLIGHT_MEDIA_PART_TOKENS
+from app.exception.exceptions import APIError
+from app.utils import json_codec
+
+_MEDIA_FIELDS = ("inlineData", "inline_data", "fileData", "file_data")
+
+
+def _parts_bytes(parts: Any) -> int:
+    size = 0
+    for part in parts or ():
+        if not isinstance(part, dict):
+            continue
+        text = part.get("text")
+        if isinstance(text, str):
+            size += len(text.encode("utf-8"))
+        elif any(field in part for field in _MEDIA_FIELDS):
+            size += PREFLIGHT_MEDIA_PART_TOKENS * PREFLIGHT_BYTES_PER_TOKEN
+        else:
+            size += len(json_codec.dumps_bytes(part))
+    return size
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """估算载荷的输入 token 数 (contents、systemInstruction 与 tools)"""
+    size = 0
+    for content in payload.get("contents") or ():
+        if isinstance(content, dict):
+            size += _parts_bytes(content.get("parts"))
+    instruction = payload.get("systemInstruction")
+    if isinstance(instruction, dict):
+        size += _parts_bytes(instruction.get("parts"))
+    tools = payload.get("tools")
+    if tools:
+        size += len(json_codec.dumps_bytes(tools))
+    return size // PREFLIGHT_BYTES_PER_TOKEN
+
+
+def check_token_budget(model: str, payload: Dict[str, Any]) -> None:
+    """
+    预检载荷的输入 token 数
+
+    Raises:
+        APIError: 估算值超过 PREFLIGHT_MAX_INPUT_TOKENS
+    """
+    limit = settings.PREFLIGHT_MAX_INPUT_TOKENS
+    if limit <= 0:
+        return
+    tokens = estimate_tokens(payload)
+    if tokens > limit:
+        raise APIError(
+            400,
+            f"Request for model {model} is estimated at {tokens} input tokens, exceeding the limit of {limit}",
+            "invalid_request_error",
+        )
@@ -1,16 +1,113 @@
 # app/services/chat/api_client.py
 
-from typing import Dict, Any, AsyncGenerator
+import time
+from typing import Dict, Any, AsyncGenerator, List, Optional
 import httpx
 from abc import ABC, abstractmethod
 
 # 导入日志记录器
 from app.log.logger import get_gemini_logger
-from app.core.constants import DEFAULT_TIMEOUT
+from app.core.constants import DEFAULT_TIMEOUT, UPSTREAM_POOL_MAX_CONNECTIONS, UPSTREAM_POOL_MAX_KEEPALIVE
+from app.core.metrics import ACTIVE_STREAMS, STREAM_TIME_TO_FIRST_TOKEN, observe_upstream_request
+from app.core.tracing import current_trace, trace_event, trace_span
+from app.utils import json_codec
 
 # 初始化日志记录器
 logger = get_gemini_logger()
 
+# httpx trace 事件中表示连接 (含 TLS 握手) 完成的事件
+_CONNECTED_TRACE_EVENTS = ("connection.connect_tcp.complete", "connection.start_tls.complete")
+# httpx trace 事件中表示收到响应头 (首字节) 的事件
+_RESPONSE_HEADERS_TRACE_EVENTS = ("http11.receive_response_headers.complete", "http2.receive_response_headers.complete")
+# 请求体由 json_codec 预先序列化，需要显式设置 Content-Type
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 长期复用的上游客户端，按代理地址 (None 表示直连) 区分，保持连接池以避免每个请求重新建立 TLS 连接
+_shared_clients: Dict[Optional[str], httpx.AsyncClient] = {}
+
+
+class StreamTimings:
+    """
+    单次流式请求的时延统计
+
+    客户端记录建连和首字节时间，调用方在向下游输出每个数据块时调用 record_chunk。
+    所有时间均相对于对象创建时刻。
+    """
+
+    __slots__ = ("start", "connect_ms", "ttfb_ms", "ttft_ms", "chunk_count", "bytes_out", "_last_chunk_at", "_gaps_ms")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connect_ms: Optional[int] = None
+        self.ttfb_ms: Optional[int] = None
+        self.ttft_ms: Optional[int] = None
+        self.chunk_count = 0
+        self.bytes_out = 0
+        self._last_chunk_at: Optional[float] = None
+        self._gaps_ms: List[float] = []
+
+    def _elapsed_ms(self, now: float) -> int:
+        return int((now - self.start) * 1000)
+
+    def mark_connected(self) -> None:
+        self.connect_ms = self._elapsed_ms(time.perf_counter())
+
+    def mark_response_headers(self) -> None:
+        self.ttfb_ms = self._elapsed_ms(time.perf_counter())
+
+    def record_chunk(self, chunk: str) -> None:
+        """记录一个输出给下游的数据块，第一个数据块的时间即首字时间"""
+        now = time.perf_counter()
+        if self._last_chunk_at is None:
+            self.ttft_ms = self._elapsed_ms(now)
+        else:
+            self._gaps_ms.append((now - self._last_chunk_at) * 1000)
+        self._last_chunk_at = now
+        self.chunk_count += 1
+        self.bytes_out += len(chunk.encode("utf-8"))
+
+    def record_bytes(self, chunk: str) -> None:
+        """记录不计入数据块间隔的输出 (如结束标记)"""
+        self.bytes_out += len(chunk.encode("utf-8"))
+
+    def gap_percentile(self, percentile: float) -> Optional[int]:
+        if not self._gaps_ms:
+            return None
+        gaps = sorted(self._gaps_ms)
+        index = min(len(gaps) - 1, int(round(percentile / 100 * (len(gaps) - 1))))
+        return int(gaps[index])
+
+    def as_log_fields(self) -> Dict[str, Optional[int]]:
+        """转换为 t_request_log 的列"""
+        return {
+            "connect_ms": self.connect_ms,
+            "ttfb_ms": self.ttfb_ms,
+            "ttft_ms": self.ttft_ms,
+            "chunk_count": self.chunk_count,
+            "bytes_out": self.bytes_out,
+            "gap_p50_ms": self.gap_percentile(50),
+            "gap_p95_ms": self.gap_percentile(95),
+            "gap_p99_ms": self.gap_percentile(99),
+        }
+
+
+def _trace_extensions(timings: Optional[StreamTimings]) -> Optional[Dict[str, Any]]:
+    """构造记录建连和首字节时间的 httpx trace 扩展，未记录时延且请求未被追踪时返回 None"""
+    request_trace = current_trace()
+    if timings is None and request_trace is None:
+        return None
+
+    async def trace(event_name: str, info: Dict[str, Any]) -> None:
+        if event_name in _CONNECTED_TRACE_EVENTS:
+            if timings is not None:
+                timings.mark_connected()
+            if request_trace is not None:
+                request_trace.add_event("upstream_connect")
+        elif event_name in _RESPONSE_HEADERS_TRACE_EVENTS and request_trace is not None:
+            request_trace.add_event("upstream_first_byte")
+
+    return {"trace": trace}
+
 class ApiClient(ABC):
     """API客户端基类"""
 
@@ -19,7 +116,7 @@ class ApiClient(ABC):
         pass
 
     @abstractmethod
-    async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> AsyncGenerator[str, None]:
+    async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str, timings: Optional[StreamTimings] = None) -> AsyncGenerator[str, None]:
         pass
 
 
@@ -54,21 +151,17 @@ class GeminiApiClient(ApiClient):
                     proxy=proxy_url,  # 直接使用URL字符串
                     verify=False      # 禁用SSL验证
                 )
-                print(f"\n[代理配置] 已启用代理 (Transport 模式):")
-                print(f"  - 代理URL: {proxy_url}")
+                logger.debug(f"Proxy enabled (transport mode): {proxy_url}")
             
             # 同时保留原有的 proxies 字典方式，作为备选
             self.proxies = {
                 "http://": http_proxy,
                 "https://": https_proxy
             }
-            print(f"  - HTTP代理: {http_proxy}")
-            print(f"  - HTTPS代理: {https_proxy}")
-            
             # 不再设置环境变量，只在应用级别使用代理
-            print(f"  - 使用应用级别代理，不设置环境变量")
+            logger.debug(f"Application-level proxies: http={http_proxy}, https={https_proxy}")
         else:
-            print("\n[代理配置] 未启用代理")
+            logger.debug("Proxy not enabled")
 
     def _get_real_model(self, model: str) -> str:
         if model.endswith("-search"):
@@ -111,11 +204,42 @@ class GeminiApiClient(ApiClient):
         return False
 
     async def generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        success = False
+        try:
+            with trace_span("upstream_request", model=model, stream=False):
+                response = await self._generate_content(payload, model, api_key)
+            success = True
+            return response
+        finally:
+            observe_upstream_request(model, api_key, success, time.perf_counter() - start_time)
+
+    async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str, timings: Optional[StreamTimings] = None) -> AsyncGenerator[str, None]:
+        start_time = time.perf_counter()
+        success = False
+        first_chunk = True
+        ACTIVE_STREAMS.inc()
+        try:
+            with trace_span("upstream_request", model=model, stream=True):
+                async for line in self._stream_generate_content(payload, model, api_key, timings):
+                    if first_chunk and line:
+                        STREAM_TIME_TO_FIRST_TOKEN.labels(model).observe(time.perf_counter() - start_time)
+                        trace_event("upstream_first_chunk")
+                        first_chunk = False
+                    yield line
+            success = True
+            trace_event("stream_end")
+        finally:
+            ACTIVE_STREAMS.dec()
+            observe_upstream_request(model, api_key, success, time.perf_counter() - start_time)
+
+    async def _generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
         timeout = httpx.Timeout(self.timeout, read=self.timeout)
         model = self._get_real_model(model)
         url = f"{self.base_url}/models/{model}:generateContent?key={api_key}"
+        body = json_codec.dumps_payload(payload)
 
-        print(f"\n[发送请求] URL: {self.base_url}/models/{model}:generateContent")
+        logger.debug(f"Sending request to {self.base_url}/models/{model}:generateContent")
         
         # 检查URL是否是本地地址
         is_local = self._is_local_url(url)
@@ -128,11 +252,11 @@ class GeminiApiClient(ApiClient):
                 verify=False
             ) as client:
                 logger.debug(f"Making non-stream request to local URL {url} without proxy.")
-                response = await client.post(url, json=payload)
+                response = await client.post(url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(None))
                 if response.status_code != 200:
                     error_content = response.text
                     raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
-                return response.json()
+                return json_codec.loads(response.content)
         elif self.transport:
             # 对非本地地址使用代理
             logger.debug(f"Using transport with proxy for non-stream request to {url}")
@@ -143,11 +267,11 @@ class GeminiApiClient(ApiClient):
                 verify=False  # 禁用SSL验证，解决某些代理的证书问题
             ) as client:
                 logger.debug(f"Making non-stream request to {url} with transport proxy.")
-                response = await client.post(url, json=payload)
+                response = await client.post(url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(None))
                 if response.status_code != 200:
                     error_content = response.text
                     raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
-                return response.json()
+                return json_codec.loads(response.content)
         else:
             # 回退到原有的 proxies 字典方式
             logger.debug(f"Using proxies dictionary for non-stream request")
@@ -158,19 +282,20 @@ class GeminiApiClient(ApiClient):
                 verify=False  # 禁用SSL验证，解决某些代理的证书问题
             ) as client:
                 logger.debug(f"Making non-stream request to {url} with proxies dictionary.")
-                response = await client.post(url, json=payload)
+                response = await client.post(url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(None))
                 if response.status_code != 200:
                     error_content = response.text
                     raise Exception(f"API call failed with status code {response.status_code}, {error_content}")
-                return response.json()
+                return json_codec.loads(response.content)
 
-    async def stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str) -> AsyncGenerator[str, None]:
+    async def _stream_generate_content(self, payload: Dict[str, Any], model: str, api_key: str, timings: Optional[StreamTimings] = None) -> AsyncGenerator[str, None]:
         # 增加超时时间，特别是读取超时，以处理流式响应
         timeout = httpx.Timeout(self.timeout, read=self.timeout * 2)
         model = self._get_real_model(model)
         url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+        body = json_codec.dumps_payload(payload)
 
-        print(f"\n[发送请求] URL: {self.base_url}/models/{model}:streamGenerateContent")
+        logger.debug(f"Sending request to {self.base_url}/models/{model}:streamGenerateContent")
         
         # 检查URL是否是本地地址
         is_local = self._is_local_url(url)
@@ -183,7 +308,9 @@ class GeminiApiClient(ApiClient):
                 verify=False
             ) as client:
                 logger.debug(f"Making stream request to local URL {url} without proxy.")
-                async with client.stream(method="POST", url=url, json=payload) as response:
+                async with client.stream(method="POST", url=url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(timings)) as response:
+                    if timings is not None:
+                        timings.mark_response_headers()
                     if response.status_code != 200:
                         error_content = await response.aread()
                         error_msg = error_content.decode("utf-8")
@@ -201,7 +328,9 @@ class GeminiApiClient(ApiClient):
                     follow_redirects=True,
                     verify=False
                 ) as client:
-                    async with client.stream(method="POST", url=url, json=payload) as response:
+                    async with client.stream(method="POST", url=url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(timings)) as response:
+                        if timings is not None:
+                            timings.mark_response_headers()
                         if response.status_code != 200:
                             error_content = await response.aread()
                             error_msg = error_content.decode("utf-8")
@@ -221,7 +350,9 @@ class GeminiApiClient(ApiClient):
                 verify=False  # 禁用SSL验证，解决某些代理的证书问题
             ) as client:
                 logger.debug(f"Making stream request to {url} with transport proxy.")
-                async with client.stream(method="POST", url=url, json=payload) as response:
+                async with client.stream(method="POST", url=url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(timings)) as response:
+                    if timings is not None:
+                        timings.mark_response_headers()
                     if response.status_code != 200:
                         error_content = await response.aread()
                         error_msg = error_content.decode("utf-8")
@@ -238,10 +369,100 @@ class GeminiApiClient(ApiClient):
                 verify=False  # 禁用SSL验证，解决某些代理的证书问题
             ) as client:
                 logger.debug(f"Making stream request to {url} with proxies dictionary.")
-                async with client.stream(method="POST", url=url, json=payload) as response:
+                async with client.stream(method="POST", url=url, content=body, headers=_JSON_HEADERS, extensions=_trace_extensions(timings)) as response:
+                    if timings is not None:
+                        timings.mark_response_headers()
                     if response.status_code != 200:
                         error_content = await response.aread()
                         error_msg = error_content.decode("utf-8")
                         raise Exception(f"API call failed with status code {response.status_code}, {error_msg}")
                     async for line in response.aiter_lines():
                         yield line
+
+    def _new_client(self, url: str, timeout: httpx.Timeout) -> httpx.AsyncClient:
+        """按地址创建客户端：本地地址不使用代理，否则优先使用 transport 代理"""
+        if self._is_local_url(url):
+            return httpx.AsyncClient(timeout=timeout, follow_redirects=True, verify=False)
+        if self.transport:
+            return httpx.AsyncClient(transport=self.transport, timeout=timeout, follow_redirects=True, verify=False)
+        return httpx.AsyncClient(timeout=timeout, follow_redirects=True, proxies=self.proxies, verify=False)
+
+    async def create_cached_content(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """创建上游上下文缓存 (cachedContents)，返回包含 name 的缓存信息"""
+        url = f"{self.base_url}/cachedContents?key={api_key}"
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+        async with self._new_client(url, timeout) as client:
+            response = await client.post(url, content=json_codec.dumps_payload(payload), headers=_JSON_HEADERS)
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            return json_codec.loads(response.content)
+
+    async def delete_cached_content(self, name: str, api_key: str) -> None:
+        """删除上游上下文缓存，name 形如 cachedContents/xxx"""
+        url = f"{self.base_url}/{name}?key={api_key}"
+        timeout = httpx.Timeout(self.timeout, read=self.timeout)
+        async with self._new_client(url, timeout) as client:
+            response = await client.delete(url)
+            if response.status_code not in (200, 404):
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+
+    def _shared_client(self, url: str) -> httpx.AsyncClient:
+        """获取共享客户端：本地地址直连，否则在启用代理时经代理连接"""
+        proxy = None
+        if self.proxy_enabled and not self._is_local_url(url):
+            proxy = self.https_proxy or self.http_proxy or None
+        client = _shared_clients.get(proxy)
+        if client is None or client.is_closed:
+            transport = httpx.AsyncHTTPTransport(
+                proxy=proxy,
+                verify=False,
+                limits=httpx.Limits(
+                    max_connections=UPSTREAM_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=UPSTREAM_POOL_MAX_KEEPALIVE,
+                ),
+            )
+            client = httpx.AsyncClient(transport=transport, follow_redirects=True)
+            _shared_clients[proxy] = client
+        return client
+
+    async def _post_shared(self, url: str, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        success = False
+        try:
+            timeout = httpx.Timeout(self.timeout, read=self.timeout)
+            response = await self._shared_client(url).post(
+                url, content=json_codec.dumps_payload(payload), headers=_JSON_HEADERS, timeout=timeout
+            )
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status code {response.status_code}, {response.text}")
+            success = True
+            return json_codec.loads(response.content)
+        finally:
+            observe_upstream_request(model, api_key, success, time.perf_counter() - start_time)
+
+    async def count_tokens(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        """计算 token 数 (models/{model}:countTokens)"""
+        model = self._get_real_model(model)
+        url = f"{self.base_url}/models/{model}:countTokens?key={api_key}"
+        with trace_span("upstream_request", model=model, stream=False):
+            return await self._post_shared(url, payload, model, api_key)
+
+    async def embed_content(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        """单条嵌入 (models/{model}:embedContent)"""
+        url = f"{self.base_url}/models/{model}:embedContent?key={api_key}"
+        with trace_span("upstream_request", model=model, stream=False):
+            return await self._post_shared(url, payload, model, api_key)
+
+    async def batch_embed_contents(self, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+        """批量嵌入 (models/{model}:batchEmbedContents)，payload 中的 requests 不能超过上游的条数上限"""
+        url = f"{self.base_url}/models/{model}:batchEmbedContents?key={api_key}"
+        with trace_span("upstream_request", model=model, stream=False):
+            return await self._post_shared(url, payload, model, api_key)
+
+
+async def close_shared_clients() -> None:
+    """关闭共享客户端，在应用关闭时调用"""
+    clients = list(_shared_clients.values())
+    _shared_clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -8,7 +8,8 @@ from typing import Any, Dict, List
 from dotenv import find_dotenv, load_dotenv
 from sqlalchemy import insert, update
 
-from app.config.config import settings
+from app.config.config import apply_logging_settings, settings
+from app.core.security import auth_index
 from app.database.connection import database
 from app.database.models import Settings
 from app.config.config import Settings as ConfigSettings
@@ -122,6 +123,9 @@ class ConfigService:
                 logger.error(f"Failed to bulk update/insert settings: {str(e)}")
                 raise  # Re-raise the exception after logging
 
+        apply_logging_settings(settings)
+        auth_index.rebuild(settings)
+
         # 重置并重新初始化 KeyManager
         try:
             await reset_key_manager_instance()
@@ -146,6 +150,8 @@ class ConfigService:
         # 1. 重新加载配置对象，它应该处理环境变量和 .env 的优先级
         _reload_settings()
         logger.info("Settings object reloaded, prioritizing system environment variables then .env file.")
+        apply_logging_settings(settings)
+        auth_index.rebuild(settings)
 
         # 2. 重置并重新初始化 KeyManager
         try:
@@ -0,0 +1,147 @@
+"""
+嵌入缓存模块
+
+EMBEDDING_CACHE_PATH 不为空时，把上游返回的嵌入向量按 (模型, taskType, title, outputDimensionality, content) 的摘要
+保存在 SQLite 文件中，相同文本再次请求时直接返回缓存的向量，不再消耗密钥配额。
+向量以 float64 数组的字节保存，与上游返回的 JSON 数值一一对应。
+条目数超过 EMBEDDING_CACHE_MAX_ENTRIES 时删除最早写入的条目。
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config.config import settings
+from app.core.constants import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PRUNE_INTERVAL
+from app.core.metrics import CACHE_HITS, CACHE_MISSES
+from app.log.logger import get_embeddings_logger
+from app.utils import json_codec
+
+logger = get_embeddings_logger()
+
+# 单条 SQL 中的参数个数上限 (旧版本 SQLite 为 999)
+_QUERY_CHUNK = 500
+
+
+def cache_key(model: str, request: Dict[str, Any]) -> bytes:
+    """嵌入结果只取决于模型、文本和这几个参数"""
+    return hashlib.sha256(json_codec.dumps_bytes([
+        model,
+        request.get("taskType"),
+        request.get("title"),
+        request.get("outputDimensionality"),
+        request.get("content"),
+    ])).digest()
+
+
+class EmbeddingCache:
+    """SQLite 中的嵌入向量，读写均为阻塞 IO，通过 asyncio.to_thread 调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._path: Optional[str] = None
+        self._writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.EMBEDDING_CACHE_PATH)
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        # 每次读取配置，EMBEDDING_CACHE_PATH 可在运行时修改
+        path = settings.EMBEDDING_CACHE_PATH
+        if not path:
+            return None
+        if path != self._path:
+            self._close()
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings (created_at)")
+            conn.commit()
+            self._conn, self._path = conn, path
+        return self._conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = self._path = None
+
+    def _get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return found
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[start:start + _QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+                for key, vector in rows:
+                    values = array("d")
+                    values.frombytes(vector)
+                    found[key] = values.tolist()
+        return found
+
+    def _put_many(self, items: Iterable[Tuple[bytes, List[float]]]) -> None:
+        now = time.time()
+        rows = [(key, array("d", values).tobytes(), now) for key, values in items]
+        with self._lock:
+            conn = self._connection()
+            if conn is None or not rows:
+                return
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows)
+            self._writes += len(rows)
+            if self._writes >= EMBEDDING_CACHE_PRUNE_INTERVAL:
+                self._writes = 0
+                self._prune(conn)
+            conn.commit()
+
+    @staticmethod
+    def _prune(conn: sqlite3.Connection) -> None:
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - EMBEDDING_CACHE_MAX_ENTRIES
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                (excess,),
+            )
+            logger.info(f"Pruned {excess} entries from embedding cache")
+
+    async def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """查找缓存的向量，返回命中的 {key: values}；读取失败时视为未命中"""
+        if not self.enabled or not keys:
+            return {}
+        try:
+            found = await asyncio.to_thread(self._get_many, keys)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read embedding cache: {str(e)}")
+            found = {}
+        CACHE_HITS.labels("embeddings").inc(len(found))
+        CACHE_MISSES.labels("embeddings").inc(len(keys) - len(found))
+        return found
+
+    async def put_many(self, items: List[Tuple[bytes, List[float]]]) -> None:
+        """写入向量，写入失败只记录日志，不影响请求"""
+        if not self.enabled or not items:
+            return
+        try:
+            await asyncio.to_thread(self._put_many, items)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write embedding cache: {str(e)}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,165 @@
+"""
+Gemini 原生嵌入模块
+
+代理 models/{model}:embedContent 与 models/{model}:batchEmbedContents。
+batchEmbedContents 的请求先查嵌入缓存，未命中的条目按上游的条数上限 (EMBEDDING_BATCH_MAX_REQUESTS) 拆分为子批次，
+各子批次使用不同的密钥经共享客户端并发发出 (每个请求最多 EMBEDDING_MAX_CONCURRENCY 个)，失败时按 RetryHandler 换密钥重试，
+结果按原顺序合并后写入缓存。任一子批次最终失败时整个请求失败；
+上游因条目有误返回的 4xx 直接返回给客户端，不重试也不计入密钥失败次数。
+"""
+import asyncio
+import datetime
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config.config import settings
+from app.core.constants import EMBEDDING_BATCH_MAX_REQUESTS
+from app.database.services import add_error_log, add_request_log
+from app.exception.exceptions import APIError
+from app.handler.retry_handler import RetryHandler, upstream_client_error
+from app.log.logger import get_embeddings_logger
+from app.service.client.api_client import GeminiApiClient
+from app.service.embedding.embedding_cache import cache_key, embedding_cache
+from app.service.key.key_manager import KeyManager
+from app.utils.helpers import extract_status_code
+
+logger = get_embeddings_logger()
+
+
+def _api_client() -> GeminiApiClient:
+    return GeminiApiClient(
+        settings.BASE_URL,
+        settings.TIME_OUT,
+        proxy_enabled=settings.PROXY_ENABLED,
+        http_proxy=settings.HTTP_PROXY,
+        https_proxy=settings.HTTPS_PROXY,
+    )
+
+
+async def _call_upstream(method: str, payload: Dict[str, Any], model: str, api_key: str) -> Dict[str, Any]:
+    """发出一次上游请求并记录请求日志与错误日志"""
+    start_time = time.perf_counter()
+    request_datetime = datetime.datetime.now()
+    is_success = False
+    status_code = None
+    try:
+        response = await getattr(_api_client(), method)(payload, model, api_key)
+        is_success = True
+        status_code = 200
+        return response
+    except Exception as e:
+        status_code = extract_status_code(e) or 500
+        logger.error(f"{method} failed with error: {str(e)}")
+        await add_error_log(
+            gemini_key=api_key,
+            model_name=model,
+            error_type="gemini_embedding_service",
+            error_log=str(e),
+            error_code=status_code,
+            request_msg=payload,
+        )
+        # 条目本身有误 (taskType、content 等) 时换密钥重试也不会成功，直接返回给客户端
+        client_error = upstream_client_error(e, f"Embedding request rejected by upstream: {str(e)}")
+        if client_error is not None:
+            raise client_error from e
+        raise
+    finally:
+        await add_request_log(
+            model_name=model,
+            api_key=api_key,
+            is_success=is_success,
+            status_code=status_code,
+            latency_ms=int((time.perf_counter() - start_time) * 1000),
+            request_time=request_datetime,
+        )
+
+
+@RetryHandler(max_retries=settings.MAX_RETRIES, key_arg="api_key")
+async def _embed_chunk(
+    requests: List[Dict[str, Any]], model: str, api_key: str, key_manager: KeyManager
+) -> List[Dict[str, Any]]:
+    response = await _call_upstream("batch_embed_contents", {"requests": requests}, model, api_key)
+    embeddings = response.get("embeddings") or []
+    if len(embeddings) != len(requests):
+        raise Exception(f"Upstream returned {len(embeddings)} embeddings for {len(requests)} requests")
+    return embeddings
+
+
+@RetryHandler(max_retries=settings.MAX_RETRIES, key_arg="api_key")
+async def _embed_one(payload: Dict[str, Any], model: str, api_key: str, key_manager: KeyManager) -> Dict[str, Any]:
+    return await _call_upstream("embed_content", payload, model, api_key)
+
+
+class GeminiEmbeddingService:
+    """Gemini 原生嵌入服务"""
+
+    def __init__(self, key_manager: KeyManager):
+        self.key_manager = key_manager
+
+    async def embed_content(self, model: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """单条嵌入，命中缓存时不请求上游"""
+        if not isinstance(payload.get("content"), dict):
+            raise APIError(400, "content is required", "invalid_request_error")
+        key = cache_key(model, payload)
+        cached = await embedding_cache.get_many([key])
+        if key in cached:
+            return {"embedding": {"values": cached[key]}}
+        response = await _embed_one(payload, model, api_key=api_key, key_manager=self.key_manager)
+        values = (response.get("embedding") or {}).get("values")
+        if values:
+            await embedding_cache.put_many([(key, values)])
+        return response
+
+    async def batch_embed_contents(self, model: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """
+        批量嵌入
+
+        Args:
+            model: 模型名称
+            payload: {"requests": [...]}，每项与 embedContent 的请求体相同，可带 model 字段
+            api_key: 第一个子批次使用的密钥，其余子批次使用轮询得到的密钥
+        """
+        requests = payload.get("requests")
+        if not isinstance(requests, list) or not requests or not all(isinstance(r, dict) for r in requests):
+            raise APIError(400, "requests must be a non-empty list of objects", "invalid_request_error")
+
+        # 上游要求每项的 model 与路径中的模型一致
+        requests = [{**request, "model": f"models/{model}"} for request in requests]
+        keys = [cache_key(model, request) for request in requests]
+        embeddings: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        cached = await embedding_cache.get_many(keys)
+        missing = []
+        for index, key in enumerate(keys):
+            if key in cached:
+                embeddings[index] = {"values": cached[key]}
+            else:
+                missing.append(index)
+
+        if missing:
+            chunks = [missing[start:start + EMBEDDING_BATCH_MAX_REQUESTS] for start in range(0, len(missing), EMBEDDING_BATCH_MAX_REQUESTS)]
+            slots = asyncio.Semaphore(max(settings.EMBEDDING_MAX_CONCURRENCY, 1))
+
+            async def run(position: int, indexes: List[int]) -> None:
+                async with slots:
+                    chunk_key = api_key if position == 0 else await self.key_manager.get_next_working_key()
+                    results = await _embed_chunk(
+                        [requests[index] for index in indexes], model, api_key=chunk_key, key_manager=self.key_manager
+                    )
+                for index, embedding in zip(indexes, results):
+                    embeddings[index] = embedding
+
+            tasks = [asyncio.create_task(run(position, indexes)) for position, indexes in enumerate(chunks)]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # 一个子批次失败时取消其余子批次，不再消耗密钥配额
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(
+                f"Embedded {len(missing)} of {len(requests)} texts for {model} in {len(chunks)} upstream batches"
+            )
+            await embedding_cache.put_many([
+                (keys[index], embeddings[index]["values"]) for index in missing if embeddings[index].get("values")
+            ])
+        return {"embeddings": embeddings}
@@ -0,0 +1,243 @@
+"""
+准入控制模块
+
+容量为可用密钥数 (未失效且不在 429 冷却中) 乘以 KEY_MAX_CONCURRENT_REQUESTS。
+容量不足时请求按优先级进入有界队列，有请求结束或密钥冷却结束时依次放行；
+按请求占用时长的指数加权平均估计排队时间，超过请求期限时直接返回 503，
+避免请求在所有密钥都被限流时反复重试。
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config.config import settings
+from app.core.constants import (
+    ADMISSION_EWMA_ALPHA,
+    ADMISSION_INITIAL_SERVICE_SECONDS,
+    ADMISSION_PRIORITY_RANGE,
+    ADMISSION_RECHECK_INTERVAL,
+)
+from app.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_SHED
+from app.exception.exceptions import ServiceUnavailableError
+from app.log.logger import get_admission_logger
+from app.service.key import key_manager as key_manager_module
+
+logger = get_admission_logger()
+
+
+class AdmissionLease:
+    """已获准的请求占用的容量，release 可重复调用，持有者需在 finally 或任务完成回调中释放"""
+
+    __slots__ = ("_controller", "_granted_at", "_released")
+
+    def __init__(self, controller: "AdmissionController", granted_at: float):
+        self._controller = controller
+        self._granted_at = granted_at
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._granted_at)
+
+
+class AdmissionController:
+    """按密钥容量放行请求，容量不足时按优先级排队"""
+
+    def __init__(self):
+        self._in_flight = 0
+        self._queued = 0
+        # (priority, seq, future)，已超时或取消的条目在到达堆顶时移除
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._service_seconds = ADMISSION_INITIAL_SERVICE_SECONDS
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._priorities_source: Optional[Tuple[str, ...]] = None
+        self._priorities: Dict[str, int] = {}
+
+    def _capacity(self) -> Optional[int]:
+        """当前可同时处理的请求数，None 表示不限制"""
+        manager = key_manager_module._singleton_instance
+        if manager is None or manager.valid_key_count() == 0:
+            # 尚未初始化或所有密钥都已失效时不做准入控制，保持原有的失败行为
+            return None
+        available = manager.available_key_count()
+        per_key = settings.KEY_MAX_CONCURRENT_REQUESTS
+        if per_key <= 0:
+            return None if available > 0 else 0
+        return available * per_key
+
+    def _has_capacity(self) -> bool:
+        capacity = self._capacity()
+        return capacity is None or self._in_flight < capacity
+
+    def estimate_wait(self, ahead: int) -> float:
+        """估计排在 ahead 个请求之后获得容量需要的秒数"""
+        capacity = self._capacity()
+        if capacity is None:
+            return 0.0
+        if capacity == 0:
+            # 所有有效密钥都在冷却，至少等到最早的冷却结束
+            manager = key_manager_module._singleton_instance
+            wait = manager.next_cooldown_expiry() or ADMISSION_RECHECK_INTERVAL
+            per_key = settings.KEY_MAX_CONCURRENT_REQUESTS
+            if per_key > 0:
+                wait += self._service_seconds * ahead / per_key
+            return wait
+        return self._service_seconds * (ahead + 1) / capacity
+
+    def _client_priorities(self) -> Dict[str, int]:
+        """解析 ADMISSION_CLIENT_PRIORITIES，配置未变化时复用上次的结果"""
+        source = tuple(settings.ADMISSION_CLIENT_PRIORITIES)
+        if source != self._priorities_source:
+            priorities = {}
+            for item in source:
+                client_id, _, value = item.partition("=")
+                try:
+                    priorities[client_id.strip()] = self._clamp_priority(int(value))
+                except ValueError:
+                    logger.warning(f"Ignoring invalid client priority '{item}', expected <client_id>=<0-9>")
+            self._priorities_source, self._priorities = source, priorities
+        return self._priorities
+
+    @staticmethod
+    def _clamp_priority(priority: int) -> int:
+        low, high = ADMISSION_PRIORITY_RANGE
+        return min(max(priority, low), high)
+
+    def priority_for(self, client_id: Optional[str], requested: Optional[str] = None) -> int:
+        """
+        计算请求的优先级，数值越小越优先
+
+        Args:
+            client_id: 客户端标识，按 ADMISSION_CLIENT_PRIORITIES 取得客户端的优先级
+            requested: X-Request-Priority 请求头，只能降低 (增大) 客户端自身的优先级
+        """
+        priority = self._client_priorities().get(client_id or "", self._clamp_priority(settings.ADMISSION_DEFAULT_PRIORITY))
+        if requested:
+            try:
+                priority = max(priority, self._clamp_priority(int(requested)))
+            except ValueError:
+                pass
+        return priority
+
+    @staticmethod
+    def deadline_for(requested: Optional[str] = None) -> float:
+        """请求最长排队秒数，X-Request-Timeout 请求头只能缩短 ADMISSION_MAX_WAIT_SECONDS"""
+        deadline = settings.ADMISSION_MAX_WAIT_SECONDS
+        if requested:
+            try:
+                value = float(requested)
+                if value > 0:
+                    deadline = min(deadline, value)
+            except ValueError:
+                pass
+        return deadline
+
+    def _shed(self, reason: str, retry_after: float, detail: str) -> ServiceUnavailableError:
+        ADMISSION_SHED.labels(reason).inc()
+        logger.warning(f"Request shed ({reason}): {detail}")
+        return ServiceUnavailableError(detail, retry_after=max(1, math.ceil(retry_after)))
+
+    def _update_gauges(self) -> None:
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+        ADMISSION_IN_FLIGHT.set(self._in_flight)
+
+    async def acquire(self, priority: int, deadline: float) -> AdmissionLease:
+        """
+        获取容量，必要时排队等待
+
+        Args:
+            priority: 优先级，数值越小越优先
+            deadline: 最长排队秒数
+
+        Raises:
+            ServiceUnavailableError: 队列已满、预计等待超过期限或排队超时
+        """
+        if not self._queued and self._has_capacity():
+            self._in_flight += 1
+            self._update_gauges()
+            return AdmissionLease(self, time.monotonic())
+
+        if self._queued >= settings.ADMISSION_QUEUE_SIZE:
+            raise self._shed("queue_full", self.estimate_wait(self._queued), "Admission queue is full, please retry later")
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority and not entry[2].done())
+        estimate = self.estimate_wait(ahead)
+        if estimate > deadline:
+            raise self._shed(
+                "deadline", estimate,
+                f"Estimated queue wait {estimate:.1f}s exceeds the request deadline of {deadline:.1f}s",
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._queued += 1
+        self._update_gauges()
+        self._schedule_wakeup()
+        enqueued_at = time.monotonic()
+        try:
+            granted_at = await asyncio.wait_for(future, deadline)
+        except asyncio.TimeoutError:
+            self._abandon()
+            raise self._shed("timeout", self.estimate_wait(self._queued), "Request deadline exceeded while waiting for an API key")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配容量但请求在恢复执行前被取消
+                self._release(future.result())
+            else:
+                self._abandon()
+            raise
+        ADMISSION_QUEUE_WAIT.observe(granted_at - enqueued_at)
+        return AdmissionLease(self, granted_at)
+
+    def _abandon(self) -> None:
+        """等待者超时或取消时更新计数，必要时清理队列中的失效条目"""
+        self._queued -= 1
+        if len(self._queue) > 2 * self._queued + 16:
+            self._queue = [entry for entry in self._queue if not entry[2].done()]
+            heapq.heapify(self._queue)
+        self._update_gauges()
+
+    def _release(self, granted_at: float) -> None:
+        self._in_flight -= 1
+        held = time.monotonic() - granted_at
+        self._service_seconds += ADMISSION_EWMA_ALPHA * (held - self._service_seconds)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按优先级放行排队中的请求，直到容量用尽"""
+        while self._queue:
+            future = self._queue[0][2]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._has_capacity():
+                break
+            heapq.heappop(self._queue)
+            self._queued -= 1
+            self._in_flight += 1
+            future.set_result(time.monotonic())
+        self._update_gauges()
+        self._schedule_wakeup()
+
+    def _schedule_wakeup(self) -> None:
+        """有请求排队时定时重新检查容量，覆盖密钥冷却结束、配置变更等没有请求结束的情况"""
+        if not self._queued or self._wakeup is not None:
+            return
+        delay = ADMISSION_RECHECK_INTERVAL
+        manager = key_manager_module._singleton_instance
+        if manager is not None:
+            expiry = manager.next_cooldown_expiry()
+            if expiry is not None:
+                delay = min(delay, expiry)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,124 @@
+"""
+密钥亲和模块
+
+KEY_AFFINITY_MODE 开启时，同一会话的请求按会话标识在一致性哈希环上固定到同一个密钥，
+使上游的隐式缓存和密钥持有的上下文缓存 (cachedContents) 能被后续轮次命中。
+会话标识可以取自 X-Conversation-Id 请求头、客户端令牌或会话开头的消息。
+
+选择密钥时沿哈希环顺时针查找：跳过失效或冷却中的密钥，也跳过进行中的请求数已达到平均值 KEY_AFFINITY_LOAD_FACTOR 倍的密钥
+(有界负载的一致性哈希)，避免大客户端或热门会话压垮单个密钥。增删密钥只会影响环上相邻的一部分会话。
+"""
+import hashlib
+import math
+from bisect import bisect_right
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from fastapi import Request
+
+from app.config.config import settings
+from app.core.constants import KEY_AFFINITY_HEADER, KEY_AFFINITY_LOAD_FACTOR, KEY_AFFINITY_VIRTUAL_NODES
+from app.core.security import get_client_id
+from app.utils import json_codec
+
+
+def _ring_hash(value: str) -> int:
+    # 不使用内置 hash：进程间不稳定，多实例部署时同一会话会落到不同密钥
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class KeyAffinity:
+    """密钥的一致性哈希环与各密钥进行中的请求数"""
+
+    def __init__(self, api_keys: List[str]):
+        keys = list(dict.fromkeys(api_keys))
+        points = sorted(
+            (_ring_hash(f"{key}#{index}"), key) for key in keys for index in range(KEY_AFFINITY_VIRTUAL_NODES)
+        )
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+        self._key_count = len(keys)
+        self._in_flight: Dict[str, int] = {key: 0 for key in keys}
+        self._total = 0
+
+    def walk(self, identifier: str) -> Iterator[str]:
+        """从标识在环上的位置开始，按顺时针顺序依次给出不重复的密钥"""
+        if not self._hashes:
+            return
+        start = bisect_right(self._hashes, _ring_hash(identifier))
+        seen = set()
+        for offset in range(len(self._owners)):
+            key = self._owners[(start + offset) % len(self._owners)]
+            if key not in seen:
+                seen.add(key)
+                yield key
+                if len(seen) == self._key_count:
+                    return
+
+    def acquire(self, identifier: str, usable: Callable[[str], bool]) -> Optional[str]:
+        """
+        为会话选择密钥并计入进行中的请求，请求结束后需调用 release
+
+        Args:
+            identifier: 会话标识
+            usable: 判断密钥当前是否可用
+
+        Returns:
+            环上第一个可用且未达到负载上限的密钥，没有可用密钥时返回 None
+        """
+        # 上限向上取整，只有一个会话时也能固定在首选密钥上
+        limit = math.ceil(KEY_AFFINITY_LOAD_FACTOR * (self._total + 1) / max(self._key_count, 1))
+        selected = fallback = None
+        for key in self.walk(identifier):
+            if not usable(key):
+                continue
+            if self._in_flight[key] < limit:
+                selected = key
+                break
+            fallback = fallback or key
+        # 可用密钥都达到上限时 (失效或冷却的密钥较多) 仍使用环上第一个可用密钥
+        selected = selected or fallback
+        if selected is not None:
+            self._in_flight[selected] += 1
+            self._total += 1
+        return selected
+
+    def release(self, key: str) -> None:
+        """请求结束，减少密钥进行中的请求数"""
+        if self._in_flight.get(key, 0) > 0:
+            self._in_flight[key] -= 1
+            self._total -= 1
+
+
+def _conversation_anchor(body: Any) -> Optional[str]:
+    """会话开头的消息：OpenAI 格式取开头的 system 消息和第一条其他消息，Gemini 格式取 systemInstruction 和第一条 contents"""
+    if not isinstance(body, dict):
+        return None
+    messages = body.get("messages")
+    if isinstance(messages, list) and messages:
+        anchor = []
+        for message in messages:
+            anchor.append(message)
+            if not isinstance(message, dict) or message.get("role") != "system":
+                break
+    else:
+        contents = body.get("contents")
+        if not isinstance(contents, list) or not contents:
+            return None
+        anchor = [body.get("systemInstruction"), contents[0]]
+    return hashlib.sha256(json_codec.dumps_bytes(anchor)).hexdigest()
+
+
+async def affinity_identifier(request: Request, token: Optional[str]) -> Optional[str]:
+    """按 KEY_AFFINITY_MODE 提取请求的会话标识，未开启或无法提取时返回 None (使用轮询)"""
+    mode = settings.KEY_AFFINITY_MODE
+    if mode == "header":
+        return request.headers.get(KEY_AFFINITY_HEADER) or None
+    if mode == "client":
+        return get_client_id(token) or None
+    if mode == "conversation":
+        try:
+            body = json_codec.loads(await request.body())
+        except ValueError:
+            return None
+        return _conversation_anchor(body)
+    return None
@@ -1,10 +1,14 @@
 import asyncio
+import time
 from itertools import cycle
-from typing import Dict
+from typing import Dict, Optional, Set
 
 
 from app.config.config import settings
+from app.core.metrics import KEY_FAILOVERS, UPSTREAM_RETRIES, key_label
+from app.core.tracing import trace_event
 from app.log.logger import get_key_manager_logger
+from app.service.key.key_affinity import KeyAffinity
 
 logger = get_key_manager_logger()
 
@@ -16,6 +20,12 @@ class KeyManager:
         self.key_cycle_lock = asyncio.Lock()
         self.failure_count_lock = asyncio.Lock()
         self.key_failure_counts: Dict[str, int] = {key: 0 for key in api_keys}
+        # 被上游限流 (429) 的密钥在冷却结束前不参与轮询，值为冷却结束的 monotonic 时间
+        self.key_cooldown_until: Dict[str, float] = {}
+        # 各密钥持有的上游上下文缓存 (cachedContents 名称)，缓存只能由创建它的密钥使用
+        self.key_cached_contents: Dict[str, Set[str]] = {}
+        # 密钥亲和开启时按会话标识选择密钥
+        self.key_affinity = KeyAffinity(api_keys)
         self.MAX_FAILURES = settings.MAX_FAILURES
         self.paid_key = settings.PAID_KEY
 
@@ -48,22 +58,94 @@ class KeyManager:
             logger.warning(f"Attempt to reset failure count for non-existent key: {key}")
             return False
 
+    def is_key_cooling_down(self, key: str) -> bool:
+        """检查key是否处于限流冷却中"""
+        until = self.key_cooldown_until.get(key)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            del self.key_cooldown_until[key]
+            return False
+        return True
+
+    def cool_down_key(self, key: str, seconds: float) -> None:
+        """让key在指定秒数内不参与轮询"""
+        if seconds > 0:
+            self.key_cooldown_until[key] = time.monotonic() + seconds
+            logger.warning(f"API key {key} is rate limited, cooling down for {seconds}s")
+
+    def is_key_usable(self, key: str) -> bool:
+        """key仍在当前配置中、未达到失败上限且不在冷却中"""
+        failures = self.key_failure_counts.get(key)
+        return failures is not None and failures < self.MAX_FAILURES and not self.is_key_cooling_down(key)
+
+    def track_cached_content(self, key: str, name: str) -> None:
+        """记录key创建的上游缓存"""
+        self.key_cached_contents.setdefault(key, set()).add(name)
+
+    def untrack_cached_content(self, key: str, name: str) -> None:
+        """移除key的上游缓存记录"""
+        names = self.key_cached_contents.get(key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.key_cached_contents[key]
+
+    def cached_content_count(self, key: str) -> int:
+        """key当前持有的上游缓存数"""
+        return len(self.key_cached_contents.get(key, ()))
+
+    def available_key_count(self) -> int:
+        """未达到失败上限且不在冷却中的key数量"""
+        return sum(
+            1 for key in self.api_keys
+            if self.key_failure_counts[key] < self.MAX_FAILURES and not self.is_key_cooling_down(key)
+        )
+
+    def valid_key_count(self) -> int:
+        """未达到失败上限的key数量 (含冷却中的key)"""
+        return sum(1 for key in self.api_keys if self.key_failure_counts[key] < self.MAX_FAILURES)
+
+    def next_cooldown_expiry(self) -> Optional[float]:
+        """最早结束冷却的剩余秒数，没有冷却中的key时返回 None"""
+        now = time.monotonic()
+        remaining = [until - now for until in self.key_cooldown_until.values() if until > now]
+        return min(remaining) if remaining else None
+
     async def get_next_working_key(self) -> str:
-        """获取下一可用的API key"""
+        """获取下一可用的API key，优先跳过冷却中的key"""
         initial_key = await self.get_next_key()
         current_key = initial_key
+        fallback_key = None
 
         while True:
             if await self.is_key_valid(current_key):
-                return current_key
+                if not self.is_key_cooling_down(current_key):
+                    return current_key
+                fallback_key = fallback_key or current_key
 
             current_key = await self.get_next_key()
             if current_key == initial_key:
                 # await self.reset_failure_counts() 取消重置
-                return current_key
+                # 所有有效key都在冷却时仍返回其中一个，由上游决定是否继续限流
+                return fallback_key or current_key
+
+    def acquire_affinity_key(self, identifier: str) -> Optional[str]:
+        """
+        按会话标识选择密钥，首选密钥不可用或负载过高时沿哈希环使用下一个
+
+        返回的密钥在请求结束后需调用 release_affinity_key；没有可用密钥时返回 None，应改用轮询
+        """
+        return self.key_affinity.acquire(identifier, self.is_key_usable)
+
+    def release_affinity_key(self, key: str) -> None:
+        """请求结束，释放 acquire_affinity_key 计入的负载"""
+        self.key_affinity.release(key)
 
-    async def handle_api_failure(self, api_key: str,retries: int) -> str:
-        """处理API调用失败"""
+    async def handle_api_failure(self, api_key: str, retries: int, status_code: Optional[int] = None) -> str:
+        """处理API调用失败，上游返回 429 时让该key进入冷却"""
+        if status_code == 429:
+            self.cool_down_key(api_key, settings.KEY_COOLDOWN_SECONDS)
         async with self.failure_count_lock:
             self.key_failure_counts[api_key] += 1
             if self.key_failure_counts[api_key] >= self.MAX_FAILURES:
@@ -71,7 +153,12 @@ class KeyManager:
                     f"API key {api_key} has failed {self.MAX_FAILURES} times"
                 )
         if retries < settings.MAX_RETRIES:
-            return await self.get_next_working_key()
+            next_key = await self.get_next_working_key()
+            UPSTREAM_RETRIES.inc()
+            if next_key != api_key:
+                KEY_FAILOVERS.inc()
+            trace_event("key_failover", retries=retries, key=key_label(next_key))
+            return next_key
         else: 
             return ""
 
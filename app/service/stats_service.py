@@ -1,23 +1,61 @@
 # app/service/stats_service.py
 
 import datetime
-from sqlalchemy import select, func
+from typing import Optional
 
+from sqlalchemy import case, select, func
+
+from app.core.constants import API_CALL_RECORDS_DEFAULT_LIMIT, API_CALL_RECORDS_MAX_LIMIT
 from app.database.connection import database
-from app.database.models import RequestLog
+from app.database.models import RequestLog, RequestStatsHour, RequestStatsMinute
+from app.database.services import get_rollup_watermark
 from app.log.logger import get_stats_logger
 
 logger = get_stats_logger()
 
+# 短时间窗口直接统计原始日志 (走 request_time 索引)，更长的窗口读取聚合表
+RAW_COUNT_WINDOW_SECONDS = 300
+
+
+async def _count_raw_calls(since: datetime.datetime, after_id: int = 0) -> int:
+    """统计原始日志中 ID 大于 after_id 且请求时间不早于 since 的调用次数"""
+    query = select(func.count(RequestLog.id)).where(
+        RequestLog.id > after_id,
+        RequestLog.request_time >= since,
+    )
+    count_result = await database.fetch_one(query)
+    return count_result[0] if count_result else 0
+
+
+async def _count_rolled_up_calls(table, bucket_start: datetime.datetime) -> int:
+    """统计聚合表中自 bucket_start 起的调用次数"""
+    query = select(
+        func.coalesce(func.sum(table.success_count + table.failure_count), 0)
+    ).where(table.bucket_time >= bucket_start)
+    count_result = await database.fetch_one(query)
+    return int(count_result[0]) if count_result else 0
+
+
+async def _count_calls_since(table, since: datetime.datetime, bucket_start: datetime.datetime) -> int:
+    """聚合表 (水位线以内) + 尚未聚合的原始日志尾部"""
+    watermark = await get_rollup_watermark()
+    rolled_up = await _count_rolled_up_calls(table, bucket_start) if watermark else 0
+    return rolled_up + await _count_raw_calls(since, watermark)
+
+
 async def get_calls_in_last_seconds(seconds: int) -> int:
-    """获取过去 N 秒内的调用次数 (包括成功和失败)"""
+    """
+    获取过去 N 秒内的调用次数 (包括成功和失败)
+
+    超过 RAW_COUNT_WINDOW_SECONDS 的窗口使用分钟聚合，精度为 1 分钟。
+    """
     try:
         cutoff_time = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
-        query = select(func.count(RequestLog.id)).where(
-            RequestLog.request_time >= cutoff_time
+        if seconds <= RAW_COUNT_WINDOW_SECONDS:
+            return await _count_raw_calls(cutoff_time)
+        return await _count_calls_since(
+            RequestStatsMinute, cutoff_time, cutoff_time.replace(second=0, microsecond=0)
         )
-        count_result = await database.fetch_one(query)
-        return count_result[0] if count_result else 0
     except Exception as e:
         logger.error(f"Failed to get calls in last {seconds} seconds: {e}")
         return 0 # Return 0 on error
@@ -31,19 +69,45 @@ async def get_calls_in_last_hours(hours: int) -> int:
     return await get_calls_in_last_seconds(hours * 3600)
 
 async def get_calls_in_current_month() -> int:
-    """获取当前自然月内的调用次数 (包括成功和失败)"""
+    """获取当前自然月内的调用次数 (包括成功和失败)，读取小时聚合"""
     try:
         now = datetime.datetime.now()
         start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        query = select(func.count(RequestLog.id)).where(
-            RequestLog.request_time >= start_of_month
-        )
-        count_result = await database.fetch_one(query)
-        return count_result[0] if count_result else 0
+        return await _count_calls_since(RequestStatsHour, start_of_month, start_of_month)
     except Exception as e:
         logger.error(f"Failed to get calls in current month: {e}")
         return 0 # Return 0 on error
 
+async def get_stream_latency_stats(hours: int = 1) -> dict:
+    """
+    获取过去 N 小时内成功流式请求的平均时延
+
+    Returns:
+        dict: streams (请求数) 以及 connect_ms, ttfb_ms, ttft_ms, gap_p95_ms 的平均值 (毫秒)，
+        和平均 chunk_count、bytes_out；没有数据时均值为 None
+    """
+    cutoff_time = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    query = select(
+        func.count(RequestLog.id).label("streams"),
+        func.avg(RequestLog.connect_ms).label("connect_ms"),
+        func.avg(RequestLog.ttfb_ms).label("ttfb_ms"),
+        func.avg(RequestLog.ttft_ms).label("ttft_ms"),
+        func.avg(RequestLog.gap_p95_ms).label("gap_p95_ms"),
+        func.avg(RequestLog.chunk_count).label("chunk_count"),
+        func.avg(RequestLog.bytes_out).label("bytes_out"),
+    ).where(
+        RequestLog.request_time >= cutoff_time,
+        RequestLog.is_success.is_(True),
+        RequestLog.ttft_ms.isnot(None),
+    )
+    row = await database.fetch_one(query)
+    stats = {"streams": row["streams"] if row else 0}
+    for column in ("connect_ms", "ttfb_ms", "ttft_ms", "gap_p95_ms", "chunk_count", "bytes_out"):
+        value = row[column] if row else None
+        stats[column] = int(value) if value is not None else None
+    return stats
+
+
 async def get_api_usage_stats() -> dict:
     """获取所有需要的 API 使用统计数据"""
     try:
@@ -51,12 +115,14 @@ async def get_api_usage_stats() -> dict:
         calls_1h = await get_calls_in_last_hours(1)
         calls_24h = await get_calls_in_last_hours(24)
         calls_month = await get_calls_in_current_month()
+        stream_1h = await get_stream_latency_stats(1)
 
         return {
             "calls_1m": calls_1m,
             "calls_1h": calls_1h,
             "calls_24h": calls_24h,
             "calls_month": calls_month,
+            "stream_1h": stream_1h,
         }
     except Exception as e:
         logger.error(f"Failed to get API usage stats: {e}")
@@ -66,58 +132,188 @@ async def get_api_usage_stats() -> dict:
             "calls_1h": 0,
             "calls_24h": 0,
             "calls_month": 0,
+            "stream_1h": {
+                "streams": 0, "connect_ms": None, "ttfb_ms": None, "ttft_ms": None,
+                "gap_p95_ms": None, "chunk_count": None, "bytes_out": None,
+            },
         }
 
 
-async def get_api_call_details(period: str) -> list[dict]:
+# 调用详情各时间段: (时间窗口, 聚合粒度秒数, 聚合表)，聚合表为 None 时直接聚合原始日志
+_CALL_DETAIL_PERIODS = {
+    "1m": (datetime.timedelta(minutes=1), 10, None),
+    "1h": (datetime.timedelta(hours=1), 60, RequestStatsMinute),
+    "24h": (datetime.timedelta(hours=24), 3600, RequestStatsHour),
+}
+
+
+def _resolve_call_detail_period(period: str):
+    if period not in _CALL_DETAIL_PERIODS:
+        raise ValueError(f"无效的时间段标识: {period}")
+    window, bucket_seconds, table = _CALL_DETAIL_PERIODS[period]
+    return datetime.datetime.now() - window, bucket_seconds, table
+
+
+def _truncate_time(value: datetime.datetime, bucket_seconds: int) -> datetime.datetime:
+    if bucket_seconds >= 3600:
+        return value.replace(minute=0, second=0, microsecond=0)
+    if bucket_seconds >= 60:
+        return value.replace(second=0, microsecond=0)
+    return value.replace(second=value.second - value.second % bucket_seconds, microsecond=0)
+
+
+def _raw_bucket_expression(bucket_seconds: int):
+    """原始日志的时间桶表达式，分钟及以上按本地时间截断，与聚合表保持一致"""
+    if bucket_seconds >= 3600:
+        return func.timestamp(func.date_format(RequestLog.request_time, "%Y-%m-%d %H:00:00"))
+    if bucket_seconds >= 60:
+        return func.timestamp(func.date_format(RequestLog.request_time, "%Y-%m-%d %H:%i:00"))
+    return func.from_unixtime(
+        func.floor(func.unix_timestamp(RequestLog.request_time) / bucket_seconds) * bucket_seconds
+    )
+
+
+async def get_api_call_details(period: str) -> dict:
     """
-    获取指定时间段内的 API 调用详情
+    获取指定时间段内按 (时间桶, 密钥, 模型, 状态) 聚合的 API 调用统计
+
+    '1m' 直接在数据库中按 10 秒聚合原始日志；'1h' 和 '24h' 读取分钟/小时聚合表，
+    再合并尚未聚合的原始日志尾部，时间窗口起点按聚合粒度向下取整。
 
     Args:
         period: 时间段标识 ('1m', '1h', '24h')
 
     Returns:
-        包含调用详情的字典列表，每个字典包含 timestamp, key, model, status
+        dict: 包含 period, bucket_seconds, total, success, failure 和 series，
+        series 中每项包含 bucket, key, model, status, count，按时间倒序
 
     Raises:
         ValueError: 如果 period 无效
     """
-    now = datetime.datetime.now()
-    if period == '1m':
-        start_time = now - datetime.timedelta(minutes=1)
-    elif period == '1h':
-        start_time = now - datetime.timedelta(hours=1)
-    elif period == '24h':
-        start_time = now - datetime.timedelta(hours=24)
-    else:
-        raise ValueError(f"无效的时间段标识: {period}")
+    start_time, bucket_seconds, table = _resolve_call_detail_period(period)
 
     try:
-        query = select(
-            RequestLog.request_time.label("timestamp"),
-            RequestLog.api_key.label("key"),
-            RequestLog.model_name.label("model"),
-            RequestLog.status_code # We might need to map this to 'success'/'failure' later
-        ).where(
-            RequestLog.request_time >= start_time
-        ).order_by(RequestLog.request_time.desc()) # Order by most recent first
-
-        results = await database.fetch_all(query)
-
-        # Convert results to list of dicts and map status_code
-        details = []
-        for row in results:
-            status = 'success' if 200 <= row['status_code'] < 300 else 'failure'
-            details.append({
-                "timestamp": row['timestamp'].isoformat(), # Use ISO format for JS compatibility
-                "key": row['key'],
-                "model": row['model'],
-                "status": status
-            })
-        logger.info(f"Retrieved {len(details)} API call details for period '{period}'")
-        return details
+        counts = {}
+
+        def add(bucket, key, model, success, failure):
+            entry = counts.setdefault((bucket, key or "", model or ""), [0, 0])
+            entry[0] += int(success or 0)
+            entry[1] += int(failure or 0)
+
+        watermark = 0
+        if table is not None:
+            watermark = await get_rollup_watermark()
+            if watermark:
+                rolled_up = await database.fetch_all(
+                    select(
+                        table.bucket_time,
+                        table.api_key,
+                        table.model_name,
+                        table.success_count,
+                        table.failure_count,
+                    ).where(table.bucket_time >= _truncate_time(start_time, bucket_seconds))
+                )
+                for row in rolled_up:
+                    add(row["bucket_time"], row["api_key"], row["model_name"],
+                        row["success_count"], row["failure_count"])
+
+        bucket = _raw_bucket_expression(bucket_seconds).label("bucket")
+        raw_rows = await database.fetch_all(
+            select(
+                bucket,
+                RequestLog.api_key,
+                RequestLog.model_name,
+                func.sum(case((RequestLog.is_success.is_(True), 1), else_=0)).label("success"),
+                func.sum(case((RequestLog.is_success.is_(True), 0), else_=1)).label("failure"),
+            )
+            .where(RequestLog.id > watermark, RequestLog.request_time >= start_time)
+            .group_by(bucket, RequestLog.api_key, RequestLog.model_name)
+        )
+        for row in raw_rows:
+            add(row["bucket"], row["api_key"], row["model_name"], row["success"], row["failure"])
+
+        series = []
+        total_success = total_failure = 0
+        for (bucket_time, key, model), (success, failure) in sorted(
+            counts.items(), key=lambda item: item[0][0], reverse=True
+        ):
+            total_success += success
+            total_failure += failure
+            for status, count in (("success", success), ("failure", failure)):
+                if count:
+                    series.append({
+                        "bucket": bucket_time.isoformat(),
+                        "key": key,
+                        "model": model,
+                        "status": status,
+                        "count": count,
+                    })
+
+        logger.info(f"Retrieved {len(series)} aggregated API call series for period '{period}'")
+        return {
+            "period": period,
+            "bucket_seconds": bucket_seconds,
+            "total": total_success + total_failure,
+            "success": total_success,
+            "failure": total_failure,
+            "series": series,
+        }
 
     except Exception as e:
         logger.error(f"Failed to get API call details for period '{period}': {e}")
         # Re-raise the exception to be handled by the route
-        raise
\ No newline at end of file
+        raise
+
+
+async def get_api_call_records(
+    period: str,
+    limit: int = API_CALL_RECORDS_DEFAULT_LIMIT,
+    cursor: Optional[int] = None,
+) -> dict:
+    """
+    分页获取指定时间段内的原始 API 调用记录
+
+    按日志 ID 倒序，使用上一页最后一条记录的 ID 作为游标，每页最多 API_CALL_RECORDS_MAX_LIMIT 条。
+
+    Args:
+        period: 时间段标识 ('1m', '1h', '24h')
+        limit: 每页条数
+        cursor: 上一页返回的 next_cursor
+
+    Returns:
+        dict: 包含 items (timestamp, key, model, status) 和 next_cursor
+
+    Raises:
+        ValueError: 如果 period 无效
+    """
+    start_time, _, _ = _resolve_call_detail_period(period)
+    limit = max(1, min(limit, API_CALL_RECORDS_MAX_LIMIT))
+
+    query = select(
+        RequestLog.id,
+        RequestLog.request_time,
+        RequestLog.api_key,
+        RequestLog.model_name,
+        RequestLog.is_success,
+    ).where(RequestLog.request_time >= start_time)
+    if cursor is not None:
+        query = query.where(RequestLog.id < cursor)
+    query = query.order_by(RequestLog.id.desc()).limit(limit)
+
+    try:
+        rows = await database.fetch_all(query)
+    except Exception as e:
+        logger.error(f"Failed to get API call records for period '{period}': {e}")
+        raise
+
+    items = [
+        {
+            "timestamp": row["request_time"].isoformat(),
+            "key": row["api_key"],
+            "model": row["model_name"],
+            "status": "success" if row["is_success"] else "failure",
+        }
+        for row in rows
+    ]
+    next_cursor = rows[-1]["id"] if len(rows) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,252 @@
+"""
+客户端配额模块
+
+按客户端令牌限制每分钟请求数 (RPM)、每分钟 token 数 (TPM) 和并发流式请求数，
+避免单个客户端占满所有 Gemini 密钥。
+RPM 在请求进入时扣减；TPM 为后付费，请求完成后按实际用量扣减，余额不大于 0 时拒绝新请求。
+"""
+import math
+import time
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.config.config import settings
+from app.exception.exceptions import RateLimitError
+from app.log.logger import get_usage_logger
+
+logger = get_usage_logger()
+
+# 单个客户端的限额 (rpm, tpm, streams)，0 表示不限制
+_Limits = Tuple[int, int, int]
+_OVERRIDE_FIELDS = ("rpm", "tpm", "streams")
+
+
+class TokenBucket:
+    """令牌桶，容量为每分钟限额，按限额 / 60 每秒匀速补充"""
+
+    __slots__ = ("per_minute", "tokens", "updated_at")
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def configure(self, per_minute: int) -> None:
+        """调整限额，保留当前余额但不超过新容量"""
+        if per_minute != self.per_minute:
+            self._refill()
+            self.per_minute = per_minute
+            self.tokens = min(self.tokens, float(per_minute))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(float(self.per_minute), self.tokens + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def wait_seconds(self, amount: float) -> float:
+        """余额达到 amount 还需等待的秒数"""
+        missing = amount - self.available()
+        if missing <= 0:
+            return 0.0
+        return missing * 60 / self.per_minute
+
+    def consume(self, amount: float) -> None:
+        """扣减余额，允许透支 (后付费)"""
+        self._refill()
+        self.tokens -= amount
+
+
+class ClientQuota:
+    """单个客户端的配额状态与计数"""
+
+    __slots__ = ("client_id", "limits", "rpm_bucket", "tpm_bucket", "active_streams", "requests", "tokens", "rejected")
+
+    def __init__(self, client_id: str, limits: _Limits):
+        self.client_id = client_id
+        self.limits = limits
+        self.rpm_bucket = TokenBucket(limits[0])
+        self.tpm_bucket = TokenBucket(limits[1])
+        self.active_streams = 0
+        self.requests = 0
+        self.tokens = 0
+        self.rejected = {"rpm": 0, "tpm": 0, "streams": 0}
+
+    def configure(self, limits: _Limits) -> None:
+        if limits != self.limits:
+            self.limits = limits
+            self.rpm_bucket.configure(limits[0])
+            self.tpm_bucket.configure(limits[1])
+
+    def _reject(self, reason: str, retry_after: float, detail: str) -> RateLimitError:
+        self.rejected[reason] += 1
+        logger.warning(f"Client {self.client_id} rejected by {reason} limit: {detail}")
+        return RateLimitError(detail, retry_after=max(1, math.ceil(retry_after)))
+
+    def admit(self) -> None:
+        """
+        检查 RPM 和 TPM 并计入一次请求
+
+        Raises:
+            RateLimitError: 超出 RPM 或 TPM 限额
+        """
+        rpm, tpm, _ = self.limits
+        if rpm > 0:
+            wait = self.rpm_bucket.wait_seconds(1)
+            if wait > 0:
+                raise self._reject("rpm", wait, f"Rate limit reached: {rpm} requests per minute")
+        if tpm > 0 and self.tpm_bucket.available() <= 0:
+            # 后付费令牌桶：余额恢复为正即可放行
+            wait = -self.tpm_bucket.tokens * 60 / tpm
+            raise self._reject("tpm", wait, f"Rate limit reached: {tpm} tokens per minute")
+        if rpm > 0:
+            self.rpm_bucket.consume(1)
+        self.requests += 1
+
+    def open_stream(self) -> "StreamLease":
+        """
+        占用一个并发流式请求名额
+
+        Raises:
+            RateLimitError: 并发流式请求数已达上限
+        """
+        max_streams = self.limits[2]
+        if max_streams > 0 and self.active_streams >= max_streams:
+            # 无法预知流何时结束，建议客户端稍后重试
+            raise self._reject("streams", 1, f"Too many concurrent streams: limit is {max_streams}")
+        self.active_streams += 1
+        return StreamLease(self)
+
+    def charge_tokens(self, total_tokens: int) -> None:
+        """请求完成后按实际 token 用量扣减 TPM 余额"""
+        self.tokens += total_tokens
+        if self.limits[1] > 0:
+            self.tpm_bucket.consume(total_tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        rpm, tpm, streams = self.limits
+        return {
+            "client_id": self.client_id,
+            "rpm_limit": rpm,
+            "tpm_limit": tpm,
+            "max_streams": streams,
+            "rpm_available": int(self.rpm_bucket.available()) if rpm > 0 else None,
+            "tpm_available": int(self.tpm_bucket.available()) if tpm > 0 else None,
+            "active_streams": self.active_streams,
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "rejected": dict(self.rejected),
+        }
+
+
+class StreamLease:
+    """并发流式请求名额，release 可重复调用，由 LeasedStreamingResponse 在响应结束时或由路由在返回响应前出错时释放"""
+
+    __slots__ = ("_quota", "_released")
+
+    def __init__(self, quota: ClientQuota):
+        self._quota = quota
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._quota.active_streams -= 1
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """
+    占用流式名额的流式响应，响应结束时释放名额
+
+    在响应层面而不是在流 (异步生成器) 的 finally 中释放：发送响应头失败或客户端在第一块数据前断开时，
+    生成器从未启动，其 finally 不会执行，名额会一直被占用。
+    """
+
+    def __init__(self, content: AsyncIterable[Any], stream_lease: StreamLease, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.stream_lease = stream_lease
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.stream_lease.release()
+
+
+class ClientQuotaManager:
+    """按客户端标识管理配额"""
+
+    def __init__(self):
+        self._quotas: Dict[str, ClientQuota] = {}
+        self._overrides_source: Optional[Tuple[str, ...]] = None
+        self._overrides: Dict[str, _Limits] = {}
+
+    def _parse_overrides(self) -> Dict[str, _Limits]:
+        """解析 CLIENT_LIMIT_OVERRIDES，配置未变化时复用上次的结果"""
+        source = tuple(settings.CLIENT_LIMIT_OVERRIDES)
+        if source == self._overrides_source:
+            return self._overrides
+        defaults = (settings.CLIENT_RPM_LIMIT, settings.CLIENT_TPM_LIMIT, settings.CLIENT_MAX_CONCURRENT_STREAMS)
+        overrides: Dict[str, _Limits] = {}
+        for item in source:
+            client_id, sep, spec = item.partition("=")
+            if not sep:
+                logger.warning(f"Ignoring invalid client limit override '{item}', expected <client_id>=rpm:N,tpm:N,streams:N")
+                continue
+            values = dict(zip(_OVERRIDE_FIELDS, defaults))
+            try:
+                for part in spec.split(","):
+                    name, _, value = part.partition(":")
+                    name = name.strip().lower()
+                    if name not in values:
+                        raise ValueError(f"unknown limit '{name}'")
+                    values[name] = int(value)
+            except ValueError as e:
+                logger.warning(f"Ignoring invalid client limit override '{item}': {str(e)}")
+                continue
+            overrides[client_id.strip()] = tuple(values[name] for name in _OVERRIDE_FIELDS)
+        self._overrides_source, self._overrides = source, overrides
+        return overrides
+
+    def limits_for(self, client_id: str) -> _Limits:
+        """获取客户端当前生效的限额"""
+        override = self._parse_overrides().get(client_id)
+        if override is not None:
+            return override
+        return (settings.CLIENT_RPM_LIMIT, settings.CLIENT_TPM_LIMIT, settings.CLIENT_MAX_CONCURRENT_STREAMS)
+
+    def get(self, client_id: str) -> ClientQuota:
+        """获取客户端配额状态，并同步最新的限额配置"""
+        limits = self.limits_for(client_id)
+        quota = self._quotas.get(client_id)
+        if quota is None:
+            quota = self._quotas[client_id] = ClientQuota(client_id, limits)
+        else:
+            quota.configure(limits)
+        return quota
+
+    def admit(self, client_id: str) -> ClientQuota:
+        """检查并计入一次请求，超限时抛出 RateLimitError"""
+        quota = self.get(client_id)
+        quota.admit()
+        return quota
+
+    def charge_tokens(self, client_id: Optional[str], total_tokens: int) -> None:
+        """按实际用量扣减客户端的 TPM 余额"""
+        if client_id is None or total_tokens <= 0:
+            return
+        quota = self._quotas.get(client_id)
+        if quota is not None:
+            quota.charge_tokens(total_tokens)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """返回所有客户端的配额状态，供管理页面展示"""
+        return [self.get(client_id).to_dict() for client_id in sorted(self._quotas)]
+
+
+client_quota_manager = ClientQuotaManager()
@@ -0,0 +1,89 @@
+"""
+Token 用量统计模块
+
+请求完成时在内存中按 (小时, 密钥, 模型, 客户端) 累加，由定时任务批量写入 t_token_usage。
+"""
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.database.services import add_token_usage
+from app.log.logger import get_usage_logger
+from app.service.usage.client_quota import client_quota_manager
+
+logger = get_usage_logger()
+
+# (bucket_time, api_key, model_name, client_id) -> [request_count, prompt_tokens, completion_tokens, total_tokens]
+_UsageKey = Tuple[datetime.datetime, str, str, str]
+
+
+class TokenUsageTracker:
+    """按密钥、模型和客户端累计 token 用量"""
+
+    def __init__(self):
+        self._pending: Dict[_UsageKey, List[int]] = {}
+
+    def record(self, api_key: str, model: str, client_id: Optional[str], usage: Optional[Dict[str, int]]) -> None:
+        """
+        记录一次请求的用量
+
+        Args:
+            api_key: 使用的 Gemini API 密钥
+            model: 模型名称
+            client_id: 客户端标识，参见 app.core.security.get_client_id
+            usage: OpenAI 格式的 usage (prompt_tokens, completion_tokens, total_tokens)
+        """
+        if not usage:
+            return
+        client_quota_manager.charge_tokens(client_id, usage.get("total_tokens", 0))
+        bucket_time = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        key = (bucket_time, api_key or "", model or "", client_id or "")
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = [0, 0, 0, 0]
+        entry[0] += 1
+        entry[1] += usage.get("prompt_tokens", 0)
+        entry[2] += usage.get("completion_tokens", 0)
+        entry[3] += usage.get("total_tokens", 0)
+
+    def _merge(self, pending: Dict[_UsageKey, List[int]]) -> None:
+        for key, values in pending.items():
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = values
+            else:
+                for i, value in enumerate(values):
+                    entry[i] += value
+
+    async def flush(self) -> int:
+        """
+        将累计的用量写入数据库，写入失败时放回内存等待下次重试
+
+        Returns:
+            int: 写入的行数
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [
+            {
+                "bucket_time": bucket_time,
+                "api_key": api_key,
+                "model_name": model_name,
+                "client_id": client_id,
+                "request_count": values[0],
+                "prompt_tokens": values[1],
+                "completion_tokens": values[2],
+                "total_tokens": values[3],
+            }
+            for (bucket_time, api_key, model_name, client_id), values in pending.items()
+        ]
+        try:
+            await add_token_usage(rows)
+        except Exception as e:
+            logger.error(f"Failed to flush token usage, will retry later: {str(e)}")
+            self._merge(pending)
+            return 0
+        return len(rows)
+
+
+token_usage_tracker = TokenUsageTracker()
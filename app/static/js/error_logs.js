@@ -17,6 +17,7 @@ let currentPage = 1;
 let pageSize = 10;
 // let totalPages = 1; // totalPages will be calculated dynamically based on API response if available, or based on fetched data length
 let errorLogs = []; // Store fetched logs for details view
+let pageCursors = {}; // 页码 -> 游标，顺序翻页时使用游标分页，避免大偏移量查询
 let currentSearch = { // Store current search parameters
     key: '',
     error: '',
@@ -69,6 +70,7 @@ document.addEventListener('DOMContentLoaded', function() {
         pageSizeSelector.addEventListener('change', function() {
             pageSize = parseInt(this.value);
             currentPage = 1; // Reset to first page
+            pageCursors = {};
             loadErrorLogs();
         });
     }
@@ -84,6 +86,7 @@ document.addEventListener('DOMContentLoaded', function() {
             currentSearch.startDate = startDateInput ? startDateInput.value : '';
             currentSearch.endDate = endDateInput ? endDateInput.value : '';
             currentPage = 1; // Reset to first page on new search
+            pageCursors = {};
             loadErrorLogs();
         });
     }
@@ -220,7 +223,13 @@ async function loadErrorLogs() {
 
     try {
         // Construct the API URL with search parameters
-        let apiUrl = `/api/logs/errors?limit=${pageSize}&offset=${offset}`;
+        let apiUrl = `/api/logs/errors?limit=${pageSize}`;
+        const cursor = pageCursors[currentPage];
+        if (cursor) {
+            apiUrl += `&cursor=${encodeURIComponent(cursor)}`;
+        } else {
+            apiUrl += `&offset=${offset}`;
+        }
         if (currentSearch.key) {
             apiUrl += `&key_search=${encodeURIComponent(currentSearch.key)}`;
         }
@@ -249,6 +258,9 @@ async function loadErrorLogs() {
         // API 现在返回 { logs: [], total: count }
         if (data && Array.isArray(data.logs)) {
             errorLogs = data.logs; // Store the list data (contains error_code)
+            if (data.next_cursor) {
+                pageCursors[currentPage + 1] = data.next_cursor;
+            }
             renderErrorLogs(errorLogs);
             updatePagination(errorLogs.length, data.total || -1);
         } else {
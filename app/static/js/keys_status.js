@@ -842,7 +842,7 @@ async function showApiCallDetails(period) {
         const data = await response.json();
 
         // 渲染数据
-        renderApiCallDetails(data, contentArea);
+        renderApiCallDetails(data, contentArea, period);
 
     } catch (error) {
         console.error('获取 API 调用详情失败:', error);
@@ -862,9 +862,24 @@ function closeApiCallDetailsModal() {
     }
 }
 
-// 渲染 API 调用详情到模态框
-function renderApiCallDetails(data, container) {
-    if (!data || data.length === 0) {
+// 将密钥缩略显示
+function maskKey(key) {
+    return key ? `${key.substring(0, 4)}...${key.substring(key.length - 4)}` : 'N/A';
+}
+
+function renderStatusCell(status) {
+    const statusClass = status === 'success' ? 'text-success-600' : 'text-danger-600';
+    const statusIcon = status === 'success' ? 'fa-check-circle' : 'fa-times-circle';
+    return `
+        <td class="px-4 py-2 whitespace-nowrap text-sm ${statusClass}">
+            <i class="fas ${statusIcon} mr-1"></i>
+            ${status}
+        </td>`;
+}
+
+// 渲染 API 调用详情 (服务端聚合后的时间序列) 到模态框
+function renderApiCallDetails(data, container, period) {
+    if (!data || !data.series || data.series.length === 0) {
         container.innerHTML = `
             <div class="text-center py-10 text-gray-500">
                 <i class="fas fa-info-circle text-3xl"></i>
@@ -873,8 +888,14 @@ function renderApiCallDetails(data, container) {
         return;
     }
 
+    const bucketText = data.bucket_seconds >= 3600 ? '1 小时'
+        : data.bucket_seconds >= 60 ? '1 分钟' : `${data.bucket_seconds} 秒`;
+
     // 创建表格
     let tableHtml = `
+        <p class="text-sm text-gray-600 mb-3">
+            共 ${data.total} 次调用，成功 ${data.success} 次，失败 ${data.failure} 次 (按 ${bucketText} 聚合)
+        </p>
         <table class="min-w-full divide-y divide-gray-200">
             <thead class="bg-gray-50">
                 <tr>
@@ -882,27 +903,21 @@ function renderApiCallDetails(data, container) {
                     <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">密钥 (部分)</th>
                     <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">模型</th>
                     <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">状态</th>
+                    <th scope="col" class="px-4 py-2 text-right text-xs font-medium text-gray-500 uppercase tracking-wider">次数</th>
                 </tr>
             </thead>
             <tbody class="bg-white divide-y divide-gray-200">
     `;
 
     // 填充表格行
-    data.forEach(call => {
-        const timestamp = new Date(call.timestamp).toLocaleString();
-        const keyDisplay = call.key ? `${call.key.substring(0, 4)}...${call.key.substring(call.key.length - 4)}` : 'N/A';
-        const statusClass = call.status === 'success' ? 'text-success-600' : 'text-danger-600';
-        const statusIcon = call.status === 'success' ? 'fa-check-circle' : 'fa-times-circle';
-
+    data.series.forEach(item => {
         tableHtml += `
             <tr>
-                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-700">${timestamp}</td>
-                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500 font-mono">${keyDisplay}</td>
-                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500">${call.model || 'N/A'}</td>
-                <td class="px-4 py-2 whitespace-nowrap text-sm ${statusClass}">
-                    <i class="fas ${statusIcon} mr-1"></i>
-                    ${call.status}
-                </td>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-700">${new Date(item.bucket).toLocaleString()}</td>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500 font-mono">${maskKey(item.key)}</td>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500">${item.model || 'N/A'}</td>
+                ${renderStatusCell(item.status)}
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-700 text-right">${item.count}</td>
             </tr>
         `;
     });
@@ -910,7 +925,76 @@ function renderApiCallDetails(data, container) {
     tableHtml += `
             </tbody>
         </table>
+        <div id="apiCallRawRecords" class="mt-4"></div>
+        <div class="text-center mt-3">
+            <button id="apiCallRawLoadBtn" class="text-sm text-primary-600 hover:underline">查看原始记录</button>
+        </div>
     `;
 
     container.innerHTML = tableHtml;
+
+    const loadBtn = document.getElementById('apiCallRawLoadBtn');
+    let nextCursor = null;
+    loadBtn.addEventListener('click', async () => {
+        loadBtn.disabled = true;
+        try {
+            nextCursor = await loadApiCallRecords(period, nextCursor);
+            if (nextCursor === null) {
+                loadBtn.parentElement.remove();
+            } else {
+                loadBtn.textContent = '加载更多';
+                loadBtn.disabled = false;
+            }
+        } catch (error) {
+            console.error('获取原始调用记录失败:', error);
+            showNotification(`获取原始记录失败: ${error.message}`, 'error');
+            loadBtn.disabled = false;
+        }
+    });
+}
+
+// 分页加载原始调用记录，返回下一页游标 (没有更多时为 null)
+async function loadApiCallRecords(period, cursor) {
+    let url = `/api/stats/details/raw?period=${period}&limit=100`;
+    if (cursor !== null) {
+        url += `&cursor=${cursor}`;
+    }
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`服务器错误: ${response.status}`);
+    }
+    const data = await response.json();
+
+    const target = document.getElementById('apiCallRawRecords');
+    let tbody = target.querySelector('tbody');
+    if (!tbody) {
+        target.innerHTML = `
+            <table class="min-w-full divide-y divide-gray-200">
+                <thead class="bg-gray-50">
+                    <tr>
+                        <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">时间</th>
+                        <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">密钥 (部分)</th>
+                        <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">模型</th>
+                        <th scope="col" class="px-4 py-2 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">状态</th>
+                    </tr>
+                </thead>
+                <tbody class="bg-white divide-y divide-gray-200"></tbody>
+            </table>`;
+        tbody = target.querySelector('tbody');
+    }
+
+    let rowsHtml = '';
+    data.items.forEach(call => {
+        rowsHtml += `
+            <tr>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-700">${new Date(call.timestamp).toLocaleString()}</td>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500 font-mono">${maskKey(call.key)}</td>
+                <td class="px-4 py-2 whitespace-nowrap text-sm text-gray-500">${call.model || 'N/A'}</td>
+                ${renderStatusCell(call.status)}
+            </tr>
+        `;
+    });
+    tbody.insertAdjacentHTML('beforeend', rowsHtml);
+
+    return data.next_cursor;
 }
@@ -0,0 +1,91 @@
+// 请求追踪页面JavaScript
+
+let tracesTable;
+let noDataMessage;
+let errorMessage;
+
+document.addEventListener('DOMContentLoaded', function() {
+    tracesTable = document.getElementById('tracesTable');
+    noDataMessage = document.getElementById('noDataMessage');
+    errorMessage = document.getElementById('errorMessage');
+    document.getElementById('refreshTracesBtn').addEventListener('click', loadTraces);
+    loadTraces();
+});
+
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;');
+}
+
+function formatMs(value) {
+    return value === null || value === undefined ? '-' : value.toFixed(1);
+}
+
+async function loadTraces() {
+    errorMessage.classList.add('hidden');
+    try {
+        const response = await fetch('/api/traces?limit=100');
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        document.getElementById('sampleRate').textContent = data.sample_rate;
+        renderTraces(data.traces || []);
+    } catch (error) {
+        console.error('Error loading traces:', error);
+        errorMessage.classList.remove('hidden');
+    }
+}
+
+function renderTraces(traces) {
+    tracesTable.innerHTML = '';
+    noDataMessage.classList.toggle('hidden', traces.length > 0);
+    traces.forEach(trace => {
+        const row = document.createElement('tr');
+        row.className = 'trace-row';
+        const statusClass = trace.status === 'ok' ? 'text-success-600' : 'text-danger-600';
+        row.innerHTML = `
+            <td>${escapeHtml(trace.started_at.replace('T', ' '))}</td>
+            <td class="font-mono">${escapeHtml(trace.name)}</td>
+            <td class="${statusClass} font-medium">${escapeHtml(trace.status)}${trace.attributes.status_code ? ` (${trace.attributes.status_code})` : ''}</td>
+            <td>${formatMs(trace.duration_ms)}</td>
+            <td class="font-mono text-gray-500">${escapeHtml(trace.trace_id)}</td>
+        `;
+        const detailRow = document.createElement('tr');
+        detailRow.className = 'hidden';
+        detailRow.innerHTML = `<td colspan="5" class="bg-gray-50">${renderSpans(trace)}</td>`;
+        row.addEventListener('click', () => detailRow.classList.toggle('hidden'));
+        tracesTable.appendChild(row);
+        tracesTable.appendChild(detailRow);
+    });
+}
+
+function renderSpans(trace) {
+    if (!trace.spans.length) {
+        return '<p class="text-gray-500 py-2">无阶段记录</p>';
+    }
+    const total = Math.max(trace.duration_ms || 0, 1);
+    const rows = trace.spans.map(span => {
+        const left = Math.min(span.start_ms / total * 100, 100);
+        const isEvent = span.duration_ms === null;
+        const width = isEvent ? 0 : Math.min(span.duration_ms / total * 100, 100 - left);
+        const classes = ['span-bar'];
+        if (isEvent) classes.push('event');
+        if (span.attributes.error) classes.push('error');
+        const attributes = Object.keys(span.attributes).length ? escapeHtml(JSON.stringify(span.attributes)) : '';
+        return `
+            <div class="grid grid-cols-12 gap-2 items-center py-1 text-xs">
+                <div class="col-span-3 font-mono">${escapeHtml(span.name)}</div>
+                <div class="col-span-2 text-gray-600">+${formatMs(span.start_ms)} ms${isEvent ? '' : ` / ${formatMs(span.duration_ms)} ms`}</div>
+                <div class="col-span-4 relative h-3 bg-gray-100 rounded">
+                    <div class="${classes.join(' ')} absolute top-0" style="left: ${left}%; width: ${isEvent ? '2px' : width + '%'}"></div>
+                </div>
+                <div class="col-span-3 font-mono text-gray-500 truncate" title="${attributes}">${attributes}</div>
+            </div>
+        `;
+    });
+    return `<div class="py-2">${rows.join('')}</div>`;
+}
@@ -0,0 +1,98 @@
+"""
+进程内缓存工具模块
+"""
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+# 所有存活的缓存实例，供监控指标采集命中率
+_caches: "weakref.WeakSet[LRUCache]" = weakref.WeakSet()
+
+
+def iter_caches() -> Iterator["LRUCache"]:
+    """遍历当前存活的缓存实例"""
+    return iter(list(_caches))
+
+
+class LRUCache:
+    """
+    带容量上限和可选过期时间的 LRU 缓存
+
+    仅供单个事件循环内使用，不做线程同步。
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl_seconds: Optional[float] = None,
+        name: str = "default",
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ):
+        """
+        Args:
+            maxsize: 最大条目数，<= 0 表示禁用缓存
+            ttl_seconds: 条目过期时间（秒），None 表示不过期
+            name: 缓存名称，用于统计
+            on_evict: 条目因淘汰、过期、覆盖或清空被移除时以其值调用，pop 取出的条目不会触发
+        """
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        _caches.add(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取缓存值，未命中或已过期时返回 default"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self._evicted(value)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        previous = self._data.get(key)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if previous is not None and previous[0] is not value:
+            self._evicted(previous[0])
+        while len(self._data) > self.maxsize:
+            self._evicted(self._data.popitem(last=False)[1][0])
+
+    def _evicted(self, value: Any) -> None:
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """移除并返回缓存值"""
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self) -> None:
+        """清空缓存"""
+        values = [entry[0] for entry in self._data.values()] if self.on_evict is not None else ()
+        self._data.clear()
+        for value in values:
+            self._evicted(value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
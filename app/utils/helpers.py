@@ -10,6 +10,24 @@ from typing import Dict, Any, List, Optional, Tuple
 from app.core.constants import DATA_URL_PATTERN, IMAGE_URL_PATTERN, VALID_IMAGE_RATIOS
 
 
+def extract_status_code(error: BaseException) -> Optional[int]:
+    """
+    从异常及其 __cause__ 链的消息中解析上游返回的 HTTP 状态码
+
+    Args:
+        error: 异常对象，上游调用失败的消息形如 "API call failed with status code 429, ..."
+
+    Returns:
+        Optional[int]: 状态码，无法解析时返回 None
+    """
+    while error is not None:
+        match = re.search(r"status code (\d+)", str(error))
+        if match:
+            return int(match.group(1))
+        error = error.__cause__
+    return None
+
+
 def extract_mime_type_and_data(base64_string: str) -> Tuple[Optional[str], str]:
     """
     从 base64 字符串中提取 MIME 类型和数据
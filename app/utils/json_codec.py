@@ -0,0 +1,118 @@
+"""
+JSON 编解码模块
+
+请求与响应路径上的 JSON 编解码统一经由本模块，按 orjson、msgspec、标准库 json 的顺序选用已安装的实现。
+各实现的输出均为紧凑格式且不转义非 ASCII 字符，切换实现不会改变语义。
+"""
+import json
+from typing import Any, Dict, Tuple, Union
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec 为可选依赖
+    msgspec = None
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # 超出 64 位的整数等 orjson 不支持的值交给标准库处理
+            return _stdlib_dumps(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+    loads = orjson.loads
+
+elif msgspec is not None:
+    JSON_BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return _encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _stdlib_dumps(obj).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # 与其他实现一致，解析失败时抛出 ValueError
+            raise ValueError(str(e)) from e
+
+else:
+    JSON_BACKEND = "json"
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return _stdlib_dumps(obj).encode("utf-8")
+
+    dumps = _stdlib_dumps
+    loads = json.loads
+
+
+# id(obj) -> (obj, 预编码字节)，保存对象引用以保证 id 不会被复用
+_frozen: Dict[int, Tuple[Any, bytes]] = {}
+_key_prefixes: Dict[str, bytes] = {}
+
+
+def freeze(obj: Any) -> Any:
+    """
+    登记一个之后不会再修改的对象并预先编码
+
+    dumps_payload 遇到登记过的对象时直接拼接预编码的字节，不再重复序列化。
+    """
+    _frozen[id(obj)] = (obj, dumps_bytes(obj))
+    return obj
+
+
+def unfreeze(obj: Any) -> None:
+    """取消 freeze 的登记，用于释放不再使用的对象 (如被缓存淘汰的条目)"""
+    frozen = _frozen.get(id(obj))
+    if frozen is not None and frozen[0] is obj:
+        del _frozen[id(obj)]
+
+
+def dumps_payload(payload: Dict[str, Any]) -> bytes:
+    """序列化请求载荷，顶层值为 freeze 登记过的对象时使用其预编码字节"""
+    pieces = []
+    for key, value in payload.items():
+        frozen = _frozen.get(id(value))
+        encoded = frozen[1] if frozen is not None and frozen[0] is value else dumps_bytes(value)
+        prefix = _key_prefixes.get(key)
+        if prefix is None:
+            prefix = _key_prefixes[key] = dumps_bytes(key) + b":"
+        pieces.append(prefix + encoded)
+    return b"{" + b",".join(pieces) + b"}"
+
+
+def sse_data(obj: Any) -> str:
+    """序列化为一条 SSE data 事件"""
+    return f"data: {dumps(obj)}\n\n"
+
+
+class CodecJSONResponse(JSONResponse):
+    """使用本模块编码响应体的 JSONResponse，作为应用的默认响应类"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -0,0 +1,95 @@
+"""
+请求载荷的精简、压缩与解压工具
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖，未安装时使用 gzip
+    zstandard = None
+
+from app.core.constants import PAYLOAD_INLINE_DATA_KEYS
+
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+
+
+def _digest_base64(data: str) -> Dict[str, Any]:
+    """以内容哈希和解码后的字节数代替 base64 数据"""
+    padding = len(data) - len(data.rstrip("="))
+    return {
+        "sha256": hashlib.sha256(data.encode("utf-8")).hexdigest(),
+        "size": len(data) * 3 // 4 - padding,
+    }
+
+
+def strip_binary_parts(value: Any) -> Any:
+    """
+    返回去掉大块二进制内容后的载荷副本
+
+    inline_data/inlineData 中的 data 替换为 {"sha256", "size"}，
+    base64 data URL 替换为 "data:<mime>;sha256=<hash>;size=<bytes>"。原对象不会被修改。
+    """
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in PAYLOAD_INLINE_DATA_KEYS and isinstance(item, dict) and isinstance(item.get("data"), str):
+                stripped = {k: v for k, v in item.items() if k != "data"}
+                stripped["data"] = _digest_base64(item["data"])
+                result[key] = stripped
+            else:
+                result[key] = strip_binary_parts(item)
+        return result
+    if isinstance(value, list):
+        return [strip_binary_parts(item) for item in value]
+    if isinstance(value, str) and value.startswith("data:") and ";base64," in value:
+        header, _, data = value.partition(";base64,")
+        digest = _digest_base64(data)
+        return f"{header};sha256={digest['sha256']};size={digest['size']}"
+    return value
+
+
+def serialize_payload(payload: Any) -> Tuple[str, bytes]:
+    """
+    精简并序列化载荷
+
+    Returns:
+        Tuple[str, bytes]: (序列化结果的 sha256, 序列化后的 JSON 字节)
+    """
+    raw = json.dumps(
+        strip_binary_parts(payload), ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    ).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest(), raw
+
+
+def compress_payload(raw: bytes) -> Tuple[str, bytes]:
+    """
+    压缩序列化后的载荷
+
+    Returns:
+        Tuple[str, bytes]: (压缩编码, 压缩后的字节)
+    """
+    if zstandard is not None:
+        return ENCODING_ZSTD, zstandard.ZstdCompressor(level=6).compress(raw)
+    return ENCODING_GZIP, gzip.compress(raw, compresslevel=6)
+
+
+def decompress_payload(blob: bytes, encoding: str) -> Any:
+    """
+    解压并反序列化载荷
+
+    Raises:
+        ValueError: 压缩编码不受支持
+    """
+    if encoding == ENCODING_GZIP:
+        raw = gzip.decompress(blob)
+    elif encoding == ENCODING_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstandard is required to decode zstd payloads")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raise ValueError(f"Unsupported payload encoding: {encoding}")
+    return json.loads(raw)
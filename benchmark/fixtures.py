@@ -0,0 +1,161 @@
+"""
+微基准测试使用的固定数据
+
+覆盖长对话历史、工具调用、图片、思考模型和搜索引用等场景，数据按固定规则生成，
+保证多次运行之间完全一致。图片只使用 data URL，避免转换时访问网络。
+"""
+import base64
+from typing import Any, Dict, List
+
+PARAGRAPH = (
+    "Gemini Balance 在多个 API 密钥之间轮询转发请求，并将 OpenAI 格式的消息转换为 Gemini 格式。"
+    "This paragraph mixes languages and punctuation so that the fixtures resemble real chat traffic, "
+    "including code like `print('hello')` and numbers such as 3.14159."
+)
+
+# 约 48KB 的 base64 图片数据，内容无需是有效图片
+IMAGE_DATA_URL = "data:image/png;base64," + base64.b64encode(bytes(range(256)) * 144).decode()
+
+
+def long_history(turns: int = 40) -> List[Dict[str, Any]]:
+    """系统提示加多轮问答，倒数第二条 assistant 消息包含多个段落"""
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": "You are a helpful assistant. " * 20}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn}: {PARAGRAPH}"})
+        messages.append({"role": "assistant", "content": "\n\n".join([f"Answer {turn}.", PARAGRAPH, PARAGRAPH])})
+    messages.append({"role": "user", "content": "Summarize the conversation above."})
+    return messages
+
+
+def tool_definitions(count: int = 12) -> List[Dict[str, Any]]:
+    """OpenAI 格式的函数定义，包含嵌套参数和无参数函数"""
+    tools = []
+    for index in range(count):
+        parameters: Dict[str, Any] = {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Search query"},
+                "limit": {"type": "integer", "minimum": 1, "maximum": 50},
+                "filters": {
+                    "type": "object",
+                    "properties": {
+                        "tags": {"type": "array", "items": {"type": "string"}},
+                        "since": {"type": "string", "format": "date-time"},
+                    },
+                },
+            },
+            "required": ["query"],
+        }
+        if index % 4 == 3:
+            parameters = {"type": "object", "properties": {}}
+        tools.append({
+            "type": "function",
+            "function": {"name": f"tool_{index}", "description": f"Tool number {index}. " * 4, "parameters": parameters},
+        })
+    return tools
+
+
+def tool_call_history(rounds: int = 6) -> List[Dict[str, Any]]:
+    """包含 assistant 工具调用和 tool 结果的多轮对话"""
+    messages: List[Dict[str, Any]] = [{"role": "user", "content": "Find recent issues about streaming."}]
+    for index in range(rounds):
+        messages.append({
+            "role": "assistant",
+            "tool_calls": [{
+                "id": f"call_{index}",
+                "type": "function",
+                "function": {"name": f"tool_{index % 12}", "arguments": '{"query": "streaming", "limit": 10, "filters": {"tags": ["bug"]}}'},
+            }],
+        })
+        messages.append({"role": "tool", "tool_call_id": f"call_{index}", "content": PARAGRAPH * 2})
+    messages.append({"role": "user", "content": "Now summarize the findings."})
+    return messages
+
+
+def image_messages(images: int = 2) -> List[Dict[str, Any]]:
+    """多模态消息，图片使用 data URL"""
+    content: List[Any] = [{"type": "text", "text": "Describe the differences between these images."}]
+    content.extend({"type": "image_url", "image_url": {"url": IMAGE_DATA_URL}} for _ in range(images))
+    return [{"role": "user", "content": content}]
+
+
+def stream_text_chunk(text: str = PARAGRAPH[:80]) -> Dict[str, Any]:
+    """普通流式响应块"""
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}],
+        "modelVersion": "gemini-2.0-flash",
+    }
+
+
+def stream_tool_call_chunk() -> Dict[str, Any]:
+    """包含函数调用的流式响应块"""
+    return {
+        "candidates": [{
+            "content": {
+                "parts": [{"functionCall": {"name": "tool_0", "args": {"query": "streaming", "limit": 10}}}],
+                "role": "model",
+            },
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+    }
+
+
+def stream_code_execution_chunk() -> Dict[str, Any]:
+    """同时包含文本、代码和执行结果的流式响应块"""
+    return {
+        "candidates": [{
+            "content": {
+                "parts": [
+                    {"text": "Let me compute that."},
+                    {"executableCode": {"language": "PYTHON", "code": "print(sum(range(100)))"}},
+                    {"codeExecutionResult": {"outcome": "OUTCOME_OK", "output": "4950\n"}},
+                ],
+                "role": "model",
+            },
+            "index": 0,
+        }],
+    }
+
+
+def thinking_response() -> Dict[str, Any]:
+    """思考模型的非流式响应，第一部分为思考过程"""
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": PARAGRAPH * 10}, {"text": PARAGRAPH * 5}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": 120, "candidatesTokenCount": 300, "thoughtsTokenCount": 600, "totalTokenCount": 1020},
+    }
+
+
+def search_response(sources: int = 8) -> Dict[str, Any]:
+    """带搜索引用的非流式响应"""
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": PARAGRAPH * 6}], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+            "groundingMetadata": {
+                "groundingChunks": [
+                    {"web": {"uri": f"https://example.com/articles/{index}", "title": f"Example article {index}"}}
+                    for index in range(sources)
+                ],
+                "webSearchQueries": ["gemini balance streaming"],
+            },
+        }],
+        "usageMetadata": {"promptTokenCount": 40, "candidatesTokenCount": 200, "totalTokenCount": 240},
+    }
+
+
+def long_response(parts: int = 12) -> Dict[str, Any]:
+    """多个文本部分组成的长响应"""
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": PARAGRAPH} for _ in range(parts)], "role": "model"},
+            "finishReason": "STOP",
+            "index": 0,
+        }],
+        "usageMetadata": {"promptTokenCount": 2000, "candidatesTokenCount": 800, "totalTokenCount": 2800},
+    }
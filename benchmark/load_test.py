@@ -0,0 +1,414 @@
+"""
+代理压测脚本
+
+以固定并发向代理发送 OpenAI 或 Gemini 格式的请求，统计吞吐量、延迟 p50/p99、
+流式首 token 时间 (TTFT)、每请求 CPU 时间和内存占用，结果以 JSON 保存到 benchmark/results/，
+可用 --baseline 与之前的结果对比，衡量热路径上的性能回归。
+
+用法:
+    # 自动启动模拟上游和代理 (代理仍需要可用的数据库配置，与正常启动相同)
+    python -m benchmark.load_test --spawn --api openai --stream --concurrency 32 --requests 2000
+
+    # 压测已在运行的代理，--app-pid 用于采集代理进程的 CPU 和内存
+    python -m benchmark.load_test --target http://127.0.0.1:8000 --token sk-xxx --app-pid 12345
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARK_DIR.parent
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+# 与 --baseline 对比的指标及其方向 (True 表示越大越好)
+COMPARED_METRICS = {
+    "throughput_rps": True,
+    "latency_ms.p50": False,
+    "latency_ms.p99": False,
+    "ttft_ms.p50": False,
+    "ttft_ms.p99": False,
+    "cpu_ms_per_request": False,
+    "rss_mb.peak": False,
+}
+
+try:
+    import psutil  # type: ignore
+except ImportError:
+    psutil = None
+
+
+class ProcessSampler:
+    """采集进程的累计 CPU 时间和常驻内存，优先使用 psutil，否则读取 /proc"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._process = psutil.Process(pid) if psutil is not None else None
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            if self._process is not None:
+                times = self._process.cpu_times()
+                return times.user + times.system
+            with open(f"/proc/{self.pid}/stat") as f:
+                # 进程名可能包含空格，从最后一个右括号之后开始解析
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self._clock_ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_bytes(self) -> Optional[int]:
+        try:
+            if self._process is not None:
+                return self._process.memory_info().rss
+            with open(f"/proc/{self.pid}/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, IndexError, ValueError):
+            return None
+
+
+class RunStats:
+    """单次压测的原始测量值"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.status_codes: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.response_bytes = 0
+        self.rss_samples: List[int] = []
+
+    def record_status(self, status: Any) -> None:
+        key = str(status)
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+
+    def record_error(self, error: BaseException) -> None:
+        key = type(error).__name__
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "count": len(values),
+        "mean": ms(sum(values) / len(values)) if values else None,
+        "p50": ms(percentile(values, 50)),
+        "p90": ms(percentile(values, 90)),
+        "p99": ms(percentile(values, 99)),
+        "max": ms(max(values)) if values else None,
+    }
+
+
+def build_request(args: argparse.Namespace) -> Dict[str, Any]:
+    """构造请求的 URL、请求头和请求体，所有请求共用同一份"""
+    prompt = ("benchmark prompt " * (args.prompt_chars // 17 + 1))[: args.prompt_chars]
+    if args.api == "openai":
+        return {
+            "url": f"{args.target}/v1/chat/completions",
+            "headers": {"Authorization": f"Bearer {args.token}"},
+            "json": {
+                "model": args.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": args.stream,
+            },
+        }
+    action = "streamGenerateContent?alt=sse" if args.stream else "generateContent"
+    return {
+        "url": f"{args.target}/v1beta/models/{args.model}:{action}",
+        "headers": {"x-goog-api-key": args.token},
+        "json": {"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
+    }
+
+
+async def send_one(client: httpx.AsyncClient, request: Dict[str, Any], stream: bool, stats: RunStats) -> None:
+    start = time.perf_counter()
+    try:
+        if stream:
+            async with client.stream("POST", request["url"], headers=request["headers"], json=request["json"]) as response:
+                first_token = None
+                async for line in response.aiter_lines():
+                    stats.response_bytes += len(line)
+                    if first_token is None and line.startswith("data:") and "[DONE]" not in line:
+                        first_token = time.perf_counter()
+                if first_token is not None and response.status_code == 200:
+                    stats.ttfts.append(first_token - start)
+        else:
+            response = await client.post(request["url"], headers=request["headers"], json=request["json"])
+            stats.response_bytes += len(response.content)
+    except httpx.HTTPError as e:
+        stats.record_error(e)
+        stats.record_status("error")
+        return
+    stats.record_status(response.status_code)
+    if response.status_code == 200:
+        stats.latencies.append(time.perf_counter() - start)
+
+
+async def run_load(args: argparse.Namespace, sampler: Optional[ProcessSampler]) -> Dict[str, Any]:
+    request = build_request(args)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        if args.warmup:
+            await asyncio.gather(*(send_one(client, request, args.stream, RunStats()) for _ in range(args.warmup)))
+
+        stats = RunStats()
+        remaining = args.requests
+        deadline = time.perf_counter() + args.duration if args.duration else None
+
+        def take() -> bool:
+            nonlocal remaining
+            if deadline is not None:
+                return time.perf_counter() < deadline
+            if remaining <= 0:
+                return False
+            remaining -= 1
+            return True
+
+        async def worker() -> None:
+            while take():
+                await send_one(client, request, args.stream, stats)
+
+        async def sample_memory() -> None:
+            while True:
+                rss = sampler.rss_bytes()
+                if rss is not None:
+                    stats.rss_samples.append(rss)
+                await asyncio.sleep(args.sample_interval)
+
+        cpu_before = sampler.cpu_seconds() if sampler else None
+        memory_task = asyncio.create_task(sample_memory()) if sampler else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        if memory_task is not None:
+            memory_task.cancel()
+        cpu_after = sampler.cpu_seconds() if sampler else None
+
+    total = sum(stats.status_codes.values())
+    succeeded = len(stats.latencies)
+    result: Dict[str, Any] = {
+        "requests": total,
+        "succeeded": succeeded,
+        "failed": total - succeeded,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(succeeded / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": summarize(stats.latencies),
+        "ttft_ms": summarize(stats.ttfts) if args.stream else None,
+        "status_codes": stats.status_codes,
+        "errors": stats.errors,
+        "response_bytes": stats.response_bytes,
+        "cpu_ms_per_request": None,
+        "rss_mb": None,
+    }
+    if cpu_before is not None and cpu_after is not None and total:
+        result["cpu_ms_per_request"] = round((cpu_after - cpu_before) * 1000 / total, 3)
+    if stats.rss_samples:
+        result["rss_mb"] = {
+            "start": round(stats.rss_samples[0] / 1048576, 2),
+            "end": round(stats.rss_samples[-1] / 1048576, 2),
+            "peak": round(max(stats.rss_samples) / 1048576, 2),
+        }
+    return result
+
+
+def wait_for_port(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def spawn_servers(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """启动模拟上游和代理，代理的 BASE_URL 指向模拟上游"""
+    mock_cmd = [
+        sys.executable, "-m", "benchmark.mock_gemini",
+        "--port", str(args.mock_port),
+        "--latency-ms", str(args.mock_latency_ms),
+        "--chunks", str(args.mock_chunks),
+        "--chunk-interval-ms", str(args.mock_chunk_interval_ms),
+        "--chunk-chars", str(args.mock_chunk_chars),
+        "--error-rate", str(args.mock_error_rate),
+        "--rate-limit-rate", str(args.mock_rate_limit_rate),
+    ]
+    processes = [subprocess.Popen(mock_cmd, cwd=PROJECT_ROOT)]
+    wait_for_port(f"http://127.0.0.1:{args.mock_port}/v1beta/models", args.startup_timeout)
+
+    env = dict(os.environ)
+    env["BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/v1beta"
+    env.setdefault("API_KEYS", json.dumps([f"bench-key-{i}" for i in range(args.spawn_keys)]))
+    env.setdefault("ALLOWED_TOKENS", json.dumps([args.token]))
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(args.app_port),
+        "--no-access-log", "--log-level", "warning",
+    ]
+    processes.append(subprocess.Popen(app_cmd, cwd=PROJECT_ROOT, env=env))
+    wait_for_port(f"http://127.0.0.1:{args.app_port}/health", args.startup_timeout)
+    return processes
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold_pct: float) -> Dict[str, Dict[str, Any]]:
+    """计算相对基线的变化百分比，regression 表示指标变差超过 threshold_pct"""
+    comparison = {}
+    for path, higher_is_better in COMPARED_METRICS.items():
+        current, previous = lookup(result, path), lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous * 100
+        comparison[path] = {
+            "baseline": previous,
+            "current": current,
+            "change_pct": round(change, 2),
+            "regression": -change > threshold_pct if higher_is_better else change > threshold_pct,
+        }
+    return comparison
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    result = report["result"]
+    print(f"requests: {result['requests']}  succeeded: {result['succeeded']}  failed: {result['failed']}")
+    print(f"throughput: {result['throughput_rps']} req/s  elapsed: {result['elapsed_s']} s")
+    latency = result["latency_ms"]
+    print(f"latency ms: p50={latency['p50']} p90={latency['p90']} p99={latency['p99']} max={latency['max']}")
+    if result["ttft_ms"]:
+        ttft = result["ttft_ms"]
+        print(f"ttft ms:    p50={ttft['p50']} p90={ttft['p90']} p99={ttft['p99']} max={ttft['max']}")
+    print(f"cpu ms/request: {result['cpu_ms_per_request']}  rss mb: {result['rss_mb']}")
+    print(f"status codes: {result['status_codes']}  errors: {result['errors']}")
+    for path, item in report.get("comparison", {}).items():
+        flag = "REGRESSION" if item["regression"] else "ok"
+        print(f"  {path}: {item['baseline']} -> {item['current']} ({item['change_pct']:+.2f}%) {flag}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="以固定并发压测代理")
+    parser.add_argument("--target", default=None, help="代理地址，默认 http://127.0.0.1:<app-port>")
+    parser.add_argument("--token", default="sk-bench", help="访问代理使用的令牌")
+    parser.add_argument("--api", choices=("openai", "gemini"), default="openai")
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    parser.add_argument("--stream", action="store_true", help="使用流式接口并统计 TTFT")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="请求总数，指定 --duration 时忽略")
+    parser.add_argument("--duration", type=float, default=0, help="按时长压测的秒数")
+    parser.add_argument("--warmup", type=int, default=20, help="正式计时前的预热请求数")
+    parser.add_argument("--prompt-chars", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--app-pid", type=int, default=None, help="代理进程 PID，用于采集 CPU 和内存")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="内存采样间隔秒数")
+    parser.add_argument("--label", default=None, help="结果文件名中的标签")
+    parser.add_argument("--output", default=None, help="结果文件路径，默认写入 benchmark/results/")
+    parser.add_argument("--baseline", default=None, help="用于对比的历史结果文件")
+    parser.add_argument("--regression-threshold", type=float, default=5.0, help="指标变差超过该百分比时标记为回归")
+
+    spawn = parser.add_argument_group("spawn", "由脚本启动模拟上游和代理")
+    spawn.add_argument("--spawn", action="store_true")
+    spawn.add_argument("--app-port", type=int, default=18000)
+    spawn.add_argument("--mock-port", type=int, default=18099)
+    spawn.add_argument("--spawn-keys", type=int, default=8, help="未设置 API_KEYS 时生成的模拟密钥数")
+    spawn.add_argument("--startup-timeout", type=float, default=30)
+    spawn.add_argument("--mock-latency-ms", type=float, default=100.0)
+    spawn.add_argument("--mock-chunks", type=int, default=10)
+    spawn.add_argument("--mock-chunk-interval-ms", type=float, default=20.0)
+    spawn.add_argument("--mock-chunk-chars", type=int, default=64)
+    spawn.add_argument("--mock-error-rate", type=float, default=0.0)
+    spawn.add_argument("--mock-rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    if args.target is None:
+        args.target = f"http://127.0.0.1:{args.app_port}"
+    args.target = args.target.rstrip("/")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    processes: List[subprocess.Popen] = []
+    try:
+        if args.spawn:
+            processes = spawn_servers(args)
+            if args.app_pid is None:
+                args.app_pid = processes[-1].pid
+        sampler = ProcessSampler(args.app_pid) if args.app_pid else None
+        result = asyncio.run(run_load(args, sampler))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("token", "output", "baseline")}
+    report: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "result": result,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare(result, json.load(f)["result"], args.regression_threshold)
+
+    if args.output:
+        output = Path(args.output)
+    else:
+        name = "-".join(filter(None, [
+            datetime.now().strftime("%Y%m%d-%H%M%S"), args.label, args.api, "stream" if args.stream else "unary",
+        ]))
+        output = RESULTS_DIR / f"{name}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    print(f"results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
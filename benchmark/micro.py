@@ -0,0 +1,334 @@
+"""
+热路径函数的微基准测试
+
+对每个请求或每个流式块都会执行的纯函数计时：消息转换、载荷与工具构造、响应解析和流式输出优化。
+安装了 pyperf 时使用 pyperf (多进程、自动校准)，否则回退到 timeit。
+结果与 benchmark/micro_baselines.json 中的基线对比，变慢超过阈值的函数标记为回归。
+
+用法:
+    python -m benchmark.micro                      # 运行并与基线对比
+    python -m benchmark.micro --filter convert     # 只运行名称包含 convert 的用例
+    python -m benchmark.micro --update-baseline    # 以本次结果更新基线
+"""
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARK_DIR.parent
+BASELINE_FILE = BENCHMARK_DIR / "micro_baselines.json"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+# pyperf 的工作进程以脚本方式运行本文件
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+# 被测函数不使用以下配置，仅为满足 Settings 的必填项，已有 .env 时其中的值不会用到
+for _name, _value in {
+    "MYSQL_HOST": "localhost", "MYSQL_PORT": "3306", "MYSQL_USER": "bench",
+    "MYSQL_PASSWORD": "bench", "MYSQL_DATABASE": "bench",
+    "API_KEYS": '["bench-key"]', "ALLOWED_TOKENS": '["sk-bench"]',
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from app.config.config import settings  # noqa: E402
+from app.domain.openai_models import ChatRequest  # noqa: E402
+from app.handler.message_converter import OpenAIMessageConverter, _prefix_cache  # noqa: E402
+from app.handler.response_handler import _extract_result, _handle_openai_stream_response  # noqa: E402
+from app.handler.stream_optimizer import StreamOptimizer  # noqa: E402
+from app.service.chat.openai_chat_service import _build_payload, _build_tools  # noqa: E402
+from app.service.key.key_affinity import KeyAffinity  # noqa: E402
+from app.utils import json_codec  # noqa: E402
+from benchmark import fixtures  # noqa: E402
+
+try:
+    import pyperf
+except ImportError:
+    pyperf = None
+
+# 影响被测分支的配置固定为以下值，保证结果与 .env 无关
+PINNED_SETTINGS = {
+    "TOOLS_CODE_EXECUTION_ENABLED": True,
+    "SHOW_SEARCH_LINK": True,
+    "SHOW_THINKING_PROCESS": True,
+}
+
+
+class Case:
+    """
+    一个基准用例
+
+    make_args 返回调用 func 的位置参数；mutates 为 True 时 func 会修改参数，
+    每次调用前都使用一份新的深拷贝 (拷贝在计时之外完成)。
+    """
+
+    __slots__ = ("name", "func", "make_args", "mutates", "is_async")
+
+    def __init__(self, name: str, func: Callable, make_args: Callable[[], Tuple], mutates: bool = False, is_async: bool = False):
+        self.name = name
+        self.func = func
+        self.make_args = make_args
+        self.mutates = mutates
+        self.is_async = is_async
+
+
+def _request(model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None) -> ChatRequest:
+    return ChatRequest(model=model, messages=messages, tools=tools or [], max_tokens=2048)
+
+
+def _payload_args(model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None) -> Tuple:
+    converted, instruction = OpenAIMessageConverter().convert(copy.deepcopy(messages))
+    return _request(model, messages, tools), converted, instruction
+
+
+def _convert_cold(converter: OpenAIMessageConverter, messages: List[Dict[str, Any]]) -> Tuple:
+    # 清空前缀缓存，测量首轮完整转换的耗时
+    _prefix_cache.clear()
+    return converter.convert(messages)
+
+
+def _encode_payload(request: ChatRequest, messages: List[Dict[str, Any]], instruction: Optional[Dict[str, Any]]) -> bytes:
+    return json_codec.dumps_payload(_build_payload(request, messages, instruction))
+
+
+def _acquire_and_release(affinity: KeyAffinity, identifier: str) -> None:
+    affinity.release(affinity.acquire(identifier, bool))
+
+
+async def _drain_optimizer(text: str) -> None:
+    optimizer = StreamOptimizer(min_delay=0, max_delay=0)
+    async for _ in optimizer.optimize_stream_output(
+        text,
+        lambda chunk: {"choices": [{"index": 0, "delta": {"content": chunk}}]},
+        lambda chunk: f"data: {json.dumps(chunk)}\n\n",
+    ):
+        pass
+
+
+def build_cases() -> List[Case]:
+    converter = OpenAIMessageConverter()
+    history = fixtures.long_history()
+    tools = fixtures.tool_definitions()
+    affinity = KeyAffinity([f"bench-key-{index}" for index in range(50)])
+    return [
+        Case("convert.long_history", converter.convert, lambda: (history,)),
+        Case("convert.long_history_cold", _convert_cold, lambda: (converter, history)),
+        Case("convert.tool_calls", converter.convert, lambda: (fixtures.tool_call_history(),)),
+        Case("convert.images", converter.convert, lambda: (fixtures.image_messages(),)),
+        Case("build_tools.functions", _build_tools, lambda: _payload_args("gemini-2.0-flash", fixtures.tool_call_history(), tools)[:2]),
+        Case("build_tools.code_execution", _build_tools, lambda: _payload_args("gemini-2.0-flash", history)[:2]),
+        Case("build_payload.long_history", _build_payload, lambda: _payload_args("gemini-2.0-flash", history)),
+        Case("build_payload.tools", _build_payload, lambda: _payload_args("gemini-2.0-flash", fixtures.tool_call_history(), tools)),
+        Case("build_payload.search", _build_payload, lambda: _payload_args("gemini-2.0-flash-search", history)),
+        Case("build_payload.thinking", _build_payload, lambda: _payload_args("gemini-2.0-flash-thinking-exp", history)),
+        Case("extract_result.stream_text", _extract_result, lambda: (fixtures.stream_text_chunk(), "gemini-2.0-flash", True)),
+        Case("extract_result.stream_tool_call", _extract_result, lambda: (fixtures.stream_tool_call_chunk(), "gemini-2.0-flash", True)),
+        Case("extract_result.stream_code_execution", _extract_result, lambda: (fixtures.stream_code_execution_chunk(), "gemini-2.0-flash", True)),
+        Case("extract_result.thinking", _extract_result, lambda: (fixtures.thinking_response(), "gemini-2.0-flash-thinking-exp")),
+        Case("extract_result.search", _extract_result, lambda: (fixtures.search_response(), "gemini-2.0-flash-search")),
+        Case("extract_result.long_response", _extract_result, lambda: (fixtures.long_response(), "gemini-2.0-flash")),
+        Case("openai_stream_response.text", _handle_openai_stream_response, lambda: (fixtures.stream_text_chunk(), "gemini-2.0-flash", None)),
+        Case("openai_stream_response.tool_call", _handle_openai_stream_response, lambda: (fixtures.stream_tool_call_chunk(), "gemini-2.0-flash", "stop")),
+        Case("json_codec.decode_sse_line", json_codec.loads, lambda: (json_codec.dumps(fixtures.stream_text_chunk()),)),
+        Case("json_codec.encode_sse_chunk", json_codec.sse_data, lambda: (_handle_openai_stream_response(fixtures.stream_text_chunk(), "gemini-2.0-flash", None),)),
+        Case("json_codec.build_and_encode_tools", _encode_payload, lambda: _payload_args("gemini-2.0-flash", fixtures.tool_call_history(), tools)),
+        Case("json_codec.encode_payload", json_codec.dumps_payload, lambda: (_build_payload(*_payload_args("gemini-2.0-flash", history)),)),
+        Case("key_affinity.acquire", _acquire_and_release, lambda: (affinity, "conversation-1")),
+        Case("stream_optimizer.short_text", _drain_optimizer, lambda: (fixtures.PARAGRAPH[:40],), is_async=True),
+        Case("stream_optimizer.long_text", _drain_optimizer, lambda: (fixtures.PARAGRAPH * 4,), is_async=True),
+    ]
+
+
+def time_case(loops: int, case: Case) -> float:
+    """执行 loops 次用例并返回总耗时 (秒)，签名符合 pyperf.Runner.bench_time_func"""
+    if case.is_async:
+        args = case.make_args()
+
+        async def run() -> float:
+            start = time.perf_counter()
+            for _ in range(loops):
+                await case.func(*args)
+            return time.perf_counter() - start
+
+        return asyncio.run(run())
+    if case.mutates:
+        template = case.make_args()
+        batches = [copy.deepcopy(template) for _ in range(loops)]
+        func = case.func
+        start = time.perf_counter()
+        for args in batches:
+            func(*args)
+        return time.perf_counter() - start
+    args = case.make_args()
+    func = case.func
+    start = time.perf_counter()
+    for _ in range(loops):
+        func(*args)
+    return time.perf_counter() - start
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    """values 为单次调用耗时 (秒)，换算为微秒"""
+    return {
+        "mean_us": round(statistics.mean(values) * 1e6, 3),
+        "stdev_us": round(statistics.stdev(values) * 1e6, 3) if len(values) > 1 else 0.0,
+        "min_us": round(min(values) * 1e6, 3),
+        "runs": len(values),
+    }
+
+
+def run_timeit(cases: List[Case], repeat: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for case in cases:
+        # 与 timeit.Timer.autorange 相同的校准方式：循环次数按 1, 2, 5, 10... 增长直到单轮耗时达到 min_time
+        loops = 1
+        while True:
+            elapsed = time_case(loops, case)
+            if elapsed >= min_time:
+                break
+            loops = _next_loops(loops)
+        values = [time_case(loops, case) / loops for _ in range(repeat)]
+        results[case.name] = _summary(values)
+        print(f"{case.name}: {results[case.name]['mean_us']:.2f} us +- {results[case.name]['stdev_us']:.2f} us")
+    return results
+
+
+def _next_loops(loops: int) -> int:
+    exponent = 10 ** int(math.log10(loops))
+    for step in (2, 5, 10):
+        if loops < step * exponent:
+            return step * exponent
+    return loops * 2
+
+
+def run_pyperf(cases: List[Case], runner: "pyperf.Runner") -> Optional[Dict[str, Dict[str, float]]]:
+    """pyperf 的工作进程中返回 None，结果只在主进程中汇总"""
+    results = {}
+    for case in cases:
+        benchmark = runner.bench_time_func(case.name, time_case, case)
+        if benchmark is not None and not runner.args.worker:
+            results[case.name] = _summary(list(benchmark.get_values()))
+    return None if runner.args.worker else results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold_pct: float) -> List[str]:
+    """打印与基线的对比，返回回归的用例名"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous:
+            print(f"  {name}: no baseline")
+            continue
+        change = (result["mean_us"] - previous["mean_us"]) / previous["mean_us"] * 100
+        regressed = change > threshold_pct
+        if regressed:
+            regressions.append(name)
+        flag = "REGRESSION" if regressed else "ok"
+        print(f"  {name}: {previous['mean_us']:.2f} -> {result['mean_us']:.2f} us ({change:+.1f}%) {flag}")
+    return regressions
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """两种后端共用的参数，pyperf 后端的校准参数 (--fast、--min-time 等) 由 pyperf 提供"""
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--backend", choices=("auto", "pyperf", "timeit"), default="auto")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="基线文件")
+    parser.add_argument("--threshold", type=float, default=20.0, help="平均耗时增加超过该百分比时标记为回归")
+    parser.add_argument("--update-baseline", action="store_true", help="以本次结果覆盖基线文件")
+    parser.add_argument("--results", default=None, help="结果文件路径，默认写入 benchmark/results/")
+
+
+def main() -> int:
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--backend", choices=("auto", "pyperf", "timeit"), default="auto")
+    backend = pre_parser.parse_known_args()[0].backend
+    if backend == "auto":
+        backend = "pyperf" if pyperf is not None else "timeit"
+    if backend == "pyperf" and pyperf is None:
+        print("pyperf is not installed, use --backend timeit or pip install pyperf", file=sys.stderr)
+        return 2
+
+    for name, value in PINNED_SETTINGS.items():
+        setattr(settings, name, value)
+
+    runner = None
+    if backend == "pyperf":
+        def add_cmdline_args(cmd: List[str], args: argparse.Namespace) -> None:
+            cmd.extend(["--backend", "pyperf"])
+            if args.filter:
+                cmd.extend(["--filter", args.filter])
+
+        runner = pyperf.Runner(add_cmdline_args=add_cmdline_args)
+        add_arguments(runner.argparser)
+        args = runner.parse_args()
+    else:
+        parser = argparse.ArgumentParser(description="热路径函数的微基准测试")
+        add_arguments(parser)
+        parser.add_argument("--repeat", type=int, default=7, help="重复轮数")
+        parser.add_argument("--min-time", type=float, default=0.2, help="每轮的最短耗时 (秒)")
+        args = parser.parse_args()
+
+    cases = [case for case in build_cases() if not args.filter or args.filter in case.name]
+    if runner is not None:
+        results = run_pyperf(cases, runner)
+        if results is None:
+            return 0
+    else:
+        results = run_timeit(cases, args.repeat, args.min_time)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "backend": backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+    output = Path(args.results) if args.results else RESULTS_DIR / f"micro-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {output}")
+
+    baseline_path = Path(args.baseline)
+    regressions: List[str] = []
+    if baseline_path.exists():
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"compared with baseline {baseline_path} ({baseline.get('git_revision')}, {baseline.get('backend')}):")
+        regressions = compare(results, baseline, args.threshold)
+    if args.update_baseline:
+        if baseline_path.exists() and args.filter:
+            # 只运行了部分用例时保留其余用例的基线
+            with open(baseline_path, encoding="utf-8") as f:
+                report["benchmarks"] = {**json.load(f).get("benchmarks", {}), **results}
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"baseline updated: {baseline_path}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+本地 Gemini 模拟上游
+
+实现 generateContent、streamGenerateContent、models 列表和 cachedContents 接口，响应延迟、流式分块节奏、
+错误率、429 比例和响应大小均可配置，用于在不访问真实服务的情况下压测代理。
+上下文缓存只能由创建它的密钥使用，引用缓存的请求在 usageMetadata 中返回 cachedContentTokenCount。
+
+用法:
+    python -m benchmark.mock_gemini --port 18099 --latency-ms 200 --chunks 20 --chunk-interval-ms 30
+    BASE_URL=http://127.0.0.1:18099/v1beta uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple, Union
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+API_VERSION = "v1beta"
+MOCK_MODELS = ("gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash")
+
+
+@dataclass
+class MockConfig:
+    """模拟上游的行为参数，时间单位均为毫秒"""
+
+    latency_ms: float = 100.0
+    latency_jitter_ms: float = 0.0
+    chunks: int = 10
+    chunk_interval_ms: float = 20.0
+    chunk_chars: int = 64
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: int = 0
+    cache_min_tokens: int = 1024
+
+
+def _error(status_code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"code": status_code, "message": message, "status": status}},
+        status_code=status_code,
+    )
+
+
+def _candidate(text: str, finish: bool) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+def _usage(prompt_tokens: int, output_chars: int, cached_tokens: int = 0) -> Dict[str, int]:
+    # 按约 4 个字符一个 token 估算，足以驱动代理的用量统计
+    candidates_tokens = max(output_chars // 4, 1)
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": candidates_tokens,
+        "totalTokenCount": prompt_tokens + candidates_tokens,
+    }
+    if cached_tokens:
+        usage["cachedContentTokenCount"] = cached_tokens
+    return usage
+
+
+def create_app(config: MockConfig) -> Starlette:
+    """按配置创建模拟上游应用"""
+    rng = random.Random(config.seed)
+    chunk_text = ("lorem ipsum " * (config.chunk_chars // 12 + 1))[: config.chunk_chars]
+
+    async def simulate_latency() -> None:
+        delay = config.latency_ms
+        if config.latency_jitter_ms > 0:
+            delay += rng.uniform(-config.latency_jitter_ms, config.latency_jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def injected_error() -> Optional[Response]:
+        """按配置的比例返回 429 或 500，未命中时返回 None"""
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            return _error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).")
+        if roll < config.rate_limit_rate + config.error_rate:
+            return _error(500, "INTERNAL", "An internal error has occurred.")
+        return None
+
+    # 缓存名称 -> (创建缓存的密钥, token 数, 过期的 monotonic 时间)
+    cached_contents: Dict[str, Tuple[Optional[str], int, float]] = {}
+
+    async def prompt_tokens(request: Request) -> Union[Tuple[int, int], Response]:
+        """返回 (prompt token 数, 其中命中缓存的 token 数)，引用的缓存不可用时返回错误响应"""
+        body = await request.body()
+        tokens = max(len(body) // 4, 1)
+        name = json.loads(body).get("cachedContent") if body else None
+        if not name:
+            return tokens, 0
+        cached = cached_contents.get(name)
+        if cached is None or cached[2] <= time.monotonic():
+            return _error(404, "NOT_FOUND", f"CachedContent not found (or permission denied): {name}")
+        if cached[0] != request.query_params.get("key"):
+            return _error(403, "PERMISSION_DENIED", f"CachedContent not found (or permission denied): {name}")
+        return tokens + cached[1], cached[1]
+
+    async def create_cached_content(request: Request) -> Response:
+        body = await request.body()
+        data = json.loads(body)
+        tokens = max(len(body) // 4, 1)
+        if tokens < config.cache_min_tokens:
+            return _error(
+                400, "INVALID_ARGUMENT",
+                f"Cached content is too small. total_token_count={tokens}, min_total_token_count={config.cache_min_tokens}",
+            )
+        ttl = float(str(data.get("ttl", "3600s")).rstrip("s"))
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        cached_contents[name] = (request.query_params.get("key"), tokens, time.monotonic() + ttl)
+        return JSONResponse({
+            "name": name,
+            "model": data.get("model"),
+            "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+            "usageMetadata": {"totalTokenCount": tokens},
+        })
+
+    async def delete_cached_content(request: Request) -> Response:
+        name = f"cachedContents/{request.path_params['cache_id']}"
+        cached = cached_contents.get(name)
+        if cached is None or cached[0] != request.query_params.get("key"):
+            return _error(404, "NOT_FOUND", f"CachedContent not found (or permission denied): {name}")
+        del cached_contents[name]
+        return JSONResponse({})
+
+    async def list_models(request: Request) -> JSONResponse:
+        return JSONResponse({
+            "models": [
+                {
+                    "name": f"models/{name}",
+                    "displayName": name,
+                    "inputTokenLimit": 1048576,
+                    "outputTokenLimit": 8192,
+                    "supportedGenerationMethods": ["generateContent", "countTokens"],
+                }
+                for name in MOCK_MODELS
+            ]
+        })
+
+    async def generate_content(request: Request) -> Response:
+        prompt = await prompt_tokens(request)
+        if isinstance(prompt, Response):
+            return prompt
+        tokens, cached_tokens = prompt
+        await simulate_latency()
+        error = injected_error()
+        if error is not None:
+            return error
+        text = chunk_text * max(config.chunks, 1)
+        return JSONResponse({
+            "candidates": [_candidate(text, finish=True)],
+            "usageMetadata": _usage(tokens, len(text), cached_tokens),
+            "modelVersion": request.path_params["model"],
+        })
+
+    async def stream_generate_content(request: Request) -> Response:
+        prompt = await prompt_tokens(request)
+        if isinstance(prompt, Response):
+            return prompt
+        tokens, cached_tokens = prompt
+        await simulate_latency()
+        error = injected_error()
+        if error is not None:
+            return error
+        model = request.path_params["model"]
+        chunks = max(config.chunks, 1)
+
+        async def events() -> AsyncGenerator[str, None]:
+            for index in range(chunks):
+                if index and config.chunk_interval_ms > 0:
+                    await asyncio.sleep(config.chunk_interval_ms / 1000)
+                last = index == chunks - 1
+                data: Dict[str, Any] = {"candidates": [_candidate(chunk_text, finish=last)], "modelVersion": model}
+                if last:
+                    data["usageMetadata"] = _usage(tokens, len(chunk_text) * chunks, cached_tokens)
+                yield f"data: {json.dumps(data)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[
+        Route(f"/{API_VERSION}/models", list_models, methods=["GET"]),
+        Route(f"/{API_VERSION}/models/{{model}}:generateContent", generate_content, methods=["POST"]),
+        Route(f"/{API_VERSION}/models/{{model}}:streamGenerateContent", stream_generate_content, methods=["POST"]),
+        Route(f"/{API_VERSION}/cachedContents", create_cached_content, methods=["POST"]),
+        Route(f"/{API_VERSION}/cachedContents/{{cache_id}}", delete_cached_content, methods=["DELETE"]),
+    ])
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地 Gemini 模拟上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18099)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="首字节前的延迟")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0, help="延迟的随机抖动范围 (±)")
+    parser.add_argument("--chunks", type=int, default=10, help="流式响应的分块数，非流式响应为等量文本")
+    parser.add_argument("--chunk-interval-ms", type=float, default=20.0, help="流式分块之间的间隔")
+    parser.add_argument("--chunk-chars", type=int, default=64, help="每个分块的文本字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子，保证多次运行的错误分布一致")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="创建上下文缓存要求的最小 token 数")
+    return parser.parse_args(argv)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        chunks=args.chunks,
+        chunk_interval_ms=args.chunk_interval_ms,
+        chunk_chars=args.chunk_chars,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+        cache_min_tokens=args.cache_min_tokens,
+    )
+
+
+def main(argv=None) -> None:
+    import uvicorn
+
+    args = parse_args(argv)
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+测试公共配置
+
+Settings 的 API_KEYS、ALLOWED_TOKENS 等字段没有默认值，在导入 app 模块前提供占位配置。
+测试不连接数据库，数据库相关调用在各测试中替换。
+"""
+import os
+
+os.environ.setdefault("MYSQL_HOST", "localhost")
+os.environ.setdefault("MYSQL_PORT", "3306")
+os.environ.setdefault("MYSQL_USER", "test")
+os.environ.setdefault("MYSQL_PASSWORD", "test")
+os.environ.setdefault("MYSQL_DATABASE", "test")
+os.environ.setdefault("API_KEYS", '["AIzaTestKeyA","AIzaTestKeyB","AIzaTestKeyC"]')
+os.environ.setdefault("ALLOWED_TOKENS", '["sk-test"]')
+os.environ.setdefault("AUTH_TOKEN", "sk-test")
@@ -0,0 +1,181 @@
+"""准入控制：优先级顺序、超时拒绝与释放后唤醒"""
+import asyncio
+from typing import Optional
+
+import pytest
+
+from app.config.config import settings
+from app.exception.exceptions import ServiceUnavailableError
+from app.service.key import key_manager as key_manager_module
+from app.service.key.admission_controller import AdmissionController
+
+
+class _FakeKeyManager:
+    def __init__(self, available: int, valid: Optional[int] = None):
+        self.available = available
+        self.valid = available if valid is None else valid
+        self.cooldown_expiry: Optional[float] = None
+
+    def valid_key_count(self) -> int:
+        return self.valid
+
+    def available_key_count(self) -> int:
+        return self.available
+
+    def next_cooldown_expiry(self) -> Optional[float]:
+        return self.cooldown_expiry
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    fake = _FakeKeyManager(available=1)
+    monkeypatch.setattr(key_manager_module, "_singleton_instance", fake)
+    monkeypatch.setattr(settings, "KEY_MAX_CONCURRENT_REQUESTS", 1)
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_SIZE", 10)
+    return fake
+
+
+def test_grants_immediately_within_capacity(manager):
+    async def scenario():
+        controller = AdmissionController()
+        lease = await controller.acquire(priority=5, deadline=1)
+        assert controller._in_flight == 1
+        lease.release()
+        lease.release()
+        assert controller._in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiters_are_granted_in_priority_order(manager):
+    async def scenario():
+        controller = AdmissionController()
+        held = await controller.acquire(priority=5, deadline=60)
+        granted = []
+
+        async def waiter(name: str, priority: int):
+            lease = await controller.acquire(priority=priority, deadline=60)
+            granted.append(name)
+            lease.release()
+
+        tasks = []
+        for name, priority in (("low", 7), ("high-1", 1), ("mid", 4), ("high-2", 1)):
+            tasks.append(asyncio.create_task(waiter(name, priority)))
+            await asyncio.sleep(0)
+        assert controller._queued == 4
+
+        held.release()
+        await asyncio.gather(*tasks)
+        # 数值越小越优先，同优先级按入队顺序
+        assert granted == ["high-1", "high-2", "mid", "low"]
+        assert controller._in_flight == 0
+        assert controller._queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_wakes_the_next_waiter(manager):
+    async def scenario():
+        controller = AdmissionController()
+        held = await controller.acquire(priority=5, deadline=60)
+        waiter = asyncio.create_task(controller.acquire(priority=5, deadline=60))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        held.release()
+        lease = await asyncio.wait_for(waiter, 1)
+        # 容量直接转交给等待者
+        assert controller._in_flight == 1
+        assert controller._queued == 0
+        lease.release()
+        assert controller._in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cooldown_expiry_wakes_waiters_without_release(manager):
+    async def scenario():
+        manager.available = 0
+        manager.cooldown_expiry = 0.05
+        controller = AdmissionController()
+        waiter = asyncio.create_task(controller.acquire(priority=5, deadline=60))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        manager.available = 1
+        manager.cooldown_expiry = None
+        lease = await asyncio.wait_for(waiter, 1)
+        assert controller._in_flight == 1
+        lease.release()
+
+    asyncio.run(scenario())
+
+
+def test_sheds_when_estimated_wait_exceeds_deadline(manager):
+    async def scenario():
+        controller = AdmissionController()
+        held = await controller.acquire(priority=5, deadline=60)
+        # 初始估计每个请求占用 ADMISSION_INITIAL_SERVICE_SECONDS，远超 0.1 秒
+        with pytest.raises(ServiceUnavailableError) as excinfo:
+            await controller.acquire(priority=5, deadline=0.1)
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.headers["Retry-After"]
+        assert controller._queued == 0
+        held.release()
+
+    asyncio.run(scenario())
+
+
+def test_sheds_waiter_on_timeout_and_skips_it_on_release(manager):
+    async def scenario():
+        controller = AdmissionController()
+        controller._service_seconds = 0.001
+        held = await controller.acquire(priority=5, deadline=60)
+
+        with pytest.raises(ServiceUnavailableError):
+            await controller.acquire(priority=5, deadline=0.05)
+        assert controller._queued == 0
+
+        # 超时的等待者不再占用释放出的容量
+        held.release()
+        assert controller._in_flight == 0
+        assert controller._queue == []
+
+    asyncio.run(scenario())
+
+
+def test_sheds_when_queue_is_full(manager, monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_QUEUE_SIZE", 1)
+
+    async def scenario():
+        controller = AdmissionController()
+        held = await controller.acquire(priority=5, deadline=60)
+        waiter = asyncio.create_task(controller.acquire(priority=5, deadline=60))
+        await asyncio.sleep(0)
+
+        with pytest.raises(ServiceUnavailableError):
+            await controller.acquire(priority=0, deadline=60)
+
+        held.release()
+        (await waiter).release()
+        assert controller._in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue(manager):
+    async def scenario():
+        controller = AdmissionController()
+        held = await controller.acquire(priority=5, deadline=60)
+        waiter = asyncio.create_task(controller.acquire(priority=5, deadline=60))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller._queued == 0
+
+        held.release()
+        assert controller._in_flight == 0
+
+    asyncio.run(scenario())
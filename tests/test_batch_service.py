@@ -0,0 +1,35 @@
+"""批处理记录：在线程中保存时不会以旧记录覆盖新记录"""
+import asyncio
+
+from app.service.batch.batch_service import _BatchJob
+from app.utils import json_codec
+
+
+def _job(tmp_path):
+    record = {"batch": {"id": "batch_test", "status": "in_progress", "request_counts": {"completed": 0}}, "owner": "client"}
+    return _BatchJob(record, tmp_path / "batch_test.json")
+
+
+def test_concurrent_saves_keep_the_latest_record(tmp_path):
+    job = _job(tmp_path)
+
+    async def scenario():
+        saves = []
+        for completed in range(1, 21):
+            job.batch["request_counts"]["completed"] = completed
+            saves.append(asyncio.create_task(job.save()))
+        await job.set_status("completed")
+        await asyncio.gather(*saves)
+
+    asyncio.run(scenario())
+    saved = json_codec.loads(job.path.read_bytes())
+    assert saved["batch"]["status"] == "completed"
+    assert saved["batch"]["request_counts"]["completed"] == 20
+    assert not job.path.with_suffix(".json.tmp").exists()
+
+
+def test_stale_write_is_dropped(tmp_path):
+    job = _job(tmp_path)
+    job._write(2, b'{"version": 2}')
+    job._write(1, b'{"version": 1}')
+    assert json_codec.loads(job.path.read_bytes()) == {"version": 2}
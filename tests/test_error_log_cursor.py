@@ -0,0 +1,115 @@
+"""错误日志的游标分页：游标编码与 (request_time, id) 边界"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+from app.database import services
+from app.database.models import ErrorLog
+
+
+class _SQLiteDatabase:
+    """以内存 SQLite 执行 get_error_logs 构建的查询，代替 MySQL 连接"""
+
+    def __init__(self):
+        self.engine = create_engine("sqlite://")
+        ErrorLog.__table__.create(self.engine)
+
+    def insert(self, rows):
+        with self.engine.begin() as conn:
+            conn.execute(insert(ErrorLog), rows)
+
+    async def fetch_all(self, query):
+        with self.engine.connect() as conn:
+            return [row._mapping for row in conn.execute(query)]
+
+
+BASE_TIME = datetime(2026, 1, 1, 12, 0, 0, 123456)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = _SQLiteDatabase()
+    # 每个时间点有多条日志，id 的顺序与时间顺序不一致，覆盖同一时间点跨页的情况
+    rows = []
+    for index in range(12):
+        rows.append({
+            "id": 100 - index * 7 % 12,
+            "gemini_key": f"AIza{index % 3}",
+            "error_type": "gemini_chat_service",
+            "error_log": f"error {index}",
+            "error_code": 500,
+            "request_time": BASE_TIME + timedelta(seconds=index // 3),
+        })
+    db.insert(rows)
+    monkeypatch.setattr(services, "database", db)
+    return db
+
+
+def _page(**kwargs):
+    return asyncio.run(services.get_error_logs(**kwargs))
+
+
+def _all_pages(limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        logs = _page(limit=limit, cursor=cursor, **kwargs)
+        if logs:
+            pages.append([log["id"] for log in logs])
+        if len(logs) < limit:
+            return pages
+        cursor = services.encode_error_log_cursor(logs[-1])
+
+
+def test_cursor_round_trip_keeps_microseconds():
+    cursor = services.encode_error_log_cursor({"id": 42, "request_time": BASE_TIME})
+    assert services.decode_error_log_cursor(cursor) == (BASE_TIME, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "42", "_42", "2026-01-01T12:00:00_", "not-a-time_42", "2026-01-01T12:00:00_x"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        services.decode_error_log_cursor(cursor)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5, 12])
+def test_pages_cover_every_log_exactly_once(database, limit):
+    expected = [log["id"] for log in _page(limit=100)]
+    assert len(expected) == 12
+    pages = _all_pages(limit)
+    assert [log_id for page in pages for log_id in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_pages_are_ordered_by_time_then_id(database):
+    logs = _page(limit=100)
+    keys = [(log["request_time"], log["id"]) for log in logs]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_cursor_at_tied_timestamp_continues_with_lower_ids(database):
+    logs = _page(limit=100)
+    boundary = logs[1]
+    assert boundary["request_time"] == logs[2]["request_time"]
+    rest = _page(limit=100, cursor=services.encode_error_log_cursor(boundary))
+    assert [log["id"] for log in rest] == [log["id"] for log in logs[2:]]
+
+
+def test_cursor_ignores_offset(database):
+    logs = _page(limit=100)
+    cursor = services.encode_error_log_cursor(logs[3])
+    assert _page(limit=2, offset=5, cursor=cursor) == logs[4:6]
+    assert _page(limit=2, offset=5) == logs[5:7]
+
+
+def test_cursor_after_last_log_returns_empty_page(database):
+    logs = _page(limit=100)
+    assert _page(limit=5, cursor=services.encode_error_log_cursor(logs[-1])) == []
+
+
+def test_cursor_combines_with_filters(database):
+    expected = [log["id"] for log in _page(limit=100, key_search="AIza1")]
+    assert len(expected) == 4
+    pages = _all_pages(1, key_search="AIza1")
+    assert [log_id for page in pages for log_id in page] == expected
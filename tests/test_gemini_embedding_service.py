@@ -0,0 +1,88 @@
+"""Gemini 原生嵌入：上游的请求错误不重试也不计入密钥失败次数"""
+import asyncio
+
+import pytest
+
+from app.config.config import settings
+from app.exception.exceptions import APIError
+from app.service.embedding import gemini_embedding_service
+from app.service.embedding.gemini_embedding_service import GeminiEmbeddingService
+
+
+class _FakeKeyManager:
+    def __init__(self):
+        self.failures = []
+
+    async def get_next_working_key(self):
+        return "AIzaTestKeyB"
+
+    async def handle_api_failure(self, api_key, retries, status_code=None):
+        self.failures.append((api_key, retries, status_code))
+        return "AIzaTestKeyC"
+
+
+class _FakeApiClient:
+    def __init__(self, error: str):
+        self.error = error
+        self.calls = []
+
+    async def batch_embed_contents(self, payload, model, api_key):
+        self.calls.append(api_key)
+        raise Exception(self.error)
+
+    async def embed_content(self, payload, model, api_key):
+        self.calls.append(api_key)
+        raise Exception(self.error)
+
+
+async def _no_log(**kwargs):
+    return True
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def install(error: str) -> _FakeApiClient:
+        client = _FakeApiClient(error)
+        monkeypatch.setattr(gemini_embedding_service, "_api_client", lambda: client)
+        return client
+
+    monkeypatch.setattr(gemini_embedding_service, "add_error_log", _no_log)
+    monkeypatch.setattr(gemini_embedding_service, "add_request_log", _no_log)
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_PATH", "")
+    return install
+
+
+def _requests(count: int):
+    return {"requests": [{"content": {"parts": [{"text": f"text {index}"}]}, "taskType": "BAD"} for index in range(count)]}
+
+
+def test_batch_bad_request_is_not_retried_or_charged(upstream):
+    client = upstream("API call failed with status code 400, invalid taskType")
+    key_manager = _FakeKeyManager()
+    service = GeminiEmbeddingService(key_manager)
+    with pytest.raises(APIError) as excinfo:
+        asyncio.run(service.batch_embed_contents("text-embedding-004", _requests(250), "AIzaTestKeyA"))
+    assert excinfo.value.status_code == 400
+    # 每个子批次最多请求一次
+    assert len(client.calls) <= 3
+    assert key_manager.failures == []
+
+
+def test_single_bad_request_is_not_retried_or_charged(upstream):
+    client = upstream("API call failed with status code 400, invalid content")
+    key_manager = _FakeKeyManager()
+    service = GeminiEmbeddingService(key_manager)
+    with pytest.raises(APIError):
+        asyncio.run(service.embed_content("text-embedding-004", {"content": {"parts": [{"text": "x"}]}}, "AIzaTestKeyA"))
+    assert client.calls == ["AIzaTestKeyA"]
+    assert key_manager.failures == []
+
+
+def test_rate_limited_batch_is_retried_on_other_keys(upstream):
+    client = upstream("API call failed with status code 429, quota exceeded")
+    key_manager = _FakeKeyManager()
+    service = GeminiEmbeddingService(key_manager)
+    with pytest.raises(Exception):
+        asyncio.run(service.batch_embed_contents("text-embedding-004", _requests(1), "AIzaTestKeyA"))
+    assert len(client.calls) == settings.MAX_RETRIES
+    assert key_manager.failures[0] == ("AIzaTestKeyA", 1, 429)
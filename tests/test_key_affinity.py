@@ -0,0 +1,75 @@
+"""密钥亲和：一致性哈希环上的有界负载选择"""
+import math
+
+from app.core.constants import KEY_AFFINITY_LOAD_FACTOR
+from app.service.key.key_affinity import KeyAffinity
+
+KEYS = ["key-a", "key-b", "key-c", "key-d"]
+
+
+def _usable(key: str) -> bool:
+    return True
+
+
+def test_walk_visits_every_key_once():
+    affinity = KeyAffinity(KEYS + ["key-a"])
+    order = list(affinity.walk("conversation-1"))
+    assert sorted(order) == sorted(KEYS)
+
+
+def test_same_identifier_sticks_to_the_same_key():
+    affinity = KeyAffinity(KEYS)
+    first = affinity.acquire("conversation-1", _usable)
+    affinity.release(first)
+    for _ in range(5):
+        key = affinity.acquire("conversation-1", _usable)
+        assert key == first
+        affinity.release(key)
+
+
+def test_skips_unusable_keys_in_ring_order():
+    affinity = KeyAffinity(KEYS)
+    order = list(affinity.walk("conversation-1"))
+    key = affinity.acquire("conversation-1", lambda k: k != order[0])
+    assert key == order[1]
+
+
+def test_load_is_bounded_per_key():
+    affinity = KeyAffinity(KEYS)
+    acquired = [affinity.acquire("hot-conversation", _usable) for _ in range(8)]
+    # KEY_AFFINITY_LOAD_FACTOR 倍平均负载以内，热门会话溢出到环上的后续密钥
+    counts = {key: acquired.count(key) for key in set(acquired)}
+    assert len(counts) > 1
+    assert acquired[0] == next(affinity.walk("hot-conversation"))
+    assert max(counts.values()) <= math.ceil(KEY_AFFINITY_LOAD_FACTOR * len(acquired) / len(KEYS))
+    assert affinity._total == len(acquired)
+
+
+def test_falls_back_to_first_usable_key_when_all_are_full():
+    affinity = KeyAffinity(KEYS)
+    order = list(affinity.walk("conversation-1"))
+    only = order[2]
+    keys = [affinity.acquire("conversation-1", lambda k: k == only) for _ in range(3)]
+    assert keys == [only, only, only]
+    assert affinity._in_flight[only] == 3
+
+
+def test_returns_none_without_usable_keys():
+    affinity = KeyAffinity(KEYS)
+    assert affinity.acquire("conversation-1", lambda k: False) is None
+    assert affinity._total == 0
+    assert KeyAffinity([]).acquire("conversation-1", _usable) is None
+
+
+def test_release_restores_capacity():
+    affinity = KeyAffinity(KEYS)
+    acquired = [affinity.acquire("hot-conversation", _usable) for _ in range(8)]
+    for key in acquired:
+        affinity.release(key)
+    assert affinity._total == 0
+    assert all(count == 0 for count in affinity._in_flight.values())
+    # 多余的 release 和未知密钥不会使计数变为负数
+    affinity.release(acquired[0])
+    affinity.release("unknown-key")
+    assert affinity._total == 0
+    assert affinity.acquire("hot-conversation", _usable) == acquired[0]
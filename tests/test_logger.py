@@ -0,0 +1,36 @@
+"""日志队列：消息在后台线程格式化，参数可变时在调用线程固定"""
+import logging
+import queue
+
+from app.log.logger import _LazyQueueHandler
+
+
+def _record(msg, args):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+
+def _enqueue(record):
+    records = queue.SimpleQueue()
+    _LazyQueueHandler(records).handle(record)
+    return records.get_nowait()
+
+
+def test_immutable_args_are_formatted_later():
+    record = _enqueue(_record("Using API key: %s (%d)", ("AIzaTestKeyA", 3)))
+    assert record.msg == "Using API key: %s (%d)"
+    assert record.args == ("AIzaTestKeyA", 3)
+    assert record.getMessage() == "Using API key: AIzaTestKeyA (3)"
+
+
+def test_mutable_args_are_formatted_on_the_calling_thread():
+    keys = ["AIzaTestKeyA"]
+    record = _enqueue(_record("Keys: %s", (keys,)))
+    keys.append("AIzaTestKeyB")
+    assert record.args is None
+    assert record.getMessage() == "Keys: ['AIzaTestKeyA']"
+
+
+def test_mapping_args_are_formatted_on_the_calling_thread():
+    record = _enqueue(_record("Key: %(key)s", ({"key": "AIzaTestKeyA"},)))
+    assert record.args is None
+    assert record.getMessage() == "Key: AIzaTestKeyA"
@@ -0,0 +1,114 @@
+"""OpenAI 消息转换：会话前缀的复用与失效"""
+import copy
+
+import pytest
+
+from app.handler import message_converter
+from app.handler.message_converter import OpenAIMessageConverter
+
+
+def _history(turns: int):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn}"})
+        messages.append({"role": "assistant", "content": f"answer {turn}\n\nsecond paragraph {turn}"})
+    messages.append({"role": "user", "content": "latest question"})
+    return messages
+
+
+@pytest.fixture
+def converted(monkeypatch):
+    """清空前缀缓存，并记录实际转换的消息"""
+    message_converter._prefix_cache.clear()
+    seen = []
+    convert_message = message_converter._convert_message
+
+    def counting(msg, is_penultimate, is_last):
+        seen.append(msg)
+        return convert_message(msg, is_penultimate, is_last)
+
+    monkeypatch.setattr(message_converter, "_convert_message", counting)
+    yield seen
+    message_converter._prefix_cache.clear()
+
+
+def _cold(messages):
+    message_converter._prefix_cache.clear()
+    return OpenAIMessageConverter().convert(messages)
+
+
+def test_next_turn_converts_only_new_messages(converted):
+    converter = OpenAIMessageConverter()
+    first = _history(3)
+    converter.convert(first)
+    assert len(converted) == len(first)
+
+    second = first + [{"role": "assistant", "content": "reply"}, {"role": "user", "content": "follow up"}]
+    converted.clear()
+    result = converter.convert(second)
+    # 上一轮缓存的前缀不含倒数两条消息，这两条随新增的两条一起重新转换
+    assert converted == second[len(first) - 2:]
+    assert result == _cold(second)
+
+
+def test_position_dependent_messages_are_not_reused(converted):
+    converter = OpenAIMessageConverter()
+    messages = _history(2)
+    converter.convert(messages)
+
+    # 倒数第二条 assistant 消息按段落分割，成为历史消息后不再分割
+    longer = messages + [{"role": "assistant", "content": "a\n\nb"}, {"role": "user", "content": "next"}]
+    contents = converter.convert(longer)[0]
+    assert contents[-2]["parts"] == [{"text": "a"}, {"text": "b"}]
+    # system 消息进入 systemInstruction，contents 的下标比原消息小 1
+    assert contents[len(messages) - 3]["parts"] == [{"text": "answer 1\n\nsecond paragraph 1"}]
+    assert contents == _cold(longer)[0]
+
+
+def test_edited_history_invalidates_the_rest_of_the_prefix(converted):
+    converter = OpenAIMessageConverter()
+    messages = _history(4)
+    converter.convert(messages)
+
+    edited = copy.deepcopy(messages)
+    edited[4]["content"] = "edited answer"
+    converted.clear()
+    result = converter.convert(edited)
+    assert converted == edited[4:]
+    assert result == _cold(edited)
+
+
+def test_different_conversation_with_same_opening_is_not_reused(converted):
+    converter = OpenAIMessageConverter()
+    converter.convert(_history(3))
+
+    other = _history(3)
+    other[3]["content"] = "another conversation"
+    converted.clear()
+    result = converter.convert(other)
+    assert converted == other[3:]
+    assert result == _cold(other)
+
+
+def test_short_conversations_are_not_cached(converted):
+    converter = OpenAIMessageConverter()
+    converter.convert([{"role": "user", "content": "hi"}])
+    converter.convert([{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}])
+    assert len(message_converter._prefix_cache) == 0
+
+
+def test_tool_calls_are_not_mutated(converted):
+    messages = [
+        {"role": "system", "content": "s"},
+        {"role": "user", "content": "weather?"},
+        {
+            "role": "assistant",
+            "tool_calls": [{"id": "call_1", "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'}}],
+        },
+        {"role": "tool", "content": "sunny"},
+        {"role": "user", "content": "thanks"},
+    ]
+    original = copy.deepcopy(messages)
+    contents = OpenAIMessageConverter().convert(messages)[0]
+    assert messages == original
+    assert contents[1]["parts"] == [{"functionCall": {"name": "get_weather", "args": {"city": "Paris"}}}]
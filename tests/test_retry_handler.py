@@ -0,0 +1,100 @@
+"""重试处理：请求错误不重试也不计入密钥失败次数"""
+import asyncio
+
+import pytest
+
+from app.config.config import settings
+from app.domain.gemini_models import GeminiRequest
+from app.exception.exceptions import APIError
+from app.handler.retry_handler import RetryHandler, upstream_client_error
+from app.router import gemini_routes
+
+
+class _FakeKeyManager:
+    def __init__(self):
+        self.failures = []
+
+    async def handle_api_failure(self, api_key, retries, status_code=None):
+        self.failures.append((api_key, retries, status_code))
+        return "AIzaNextKey"
+
+
+class _FailingChatService:
+    def __init__(self, error: Exception):
+        self.error = error
+        self.calls = 0
+
+    async def generate_content(self, model, request, api_key, client_id=None):
+        self.calls += 1
+        raise self.error
+
+
+def _generate(model_name, key_manager, chat_service):
+    return asyncio.run(gemini_routes.generate_content(
+        model_name=model_name,
+        request=GeminiRequest(contents=[{"role": "user", "parts": [{"text": "hi"}]}]),
+        token="sk-test",
+        quota=None,
+        api_key="AIzaTestKeyA",
+        key_manager=key_manager,
+        chat_service=chat_service,
+    ))
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("API call failed with status code 400, invalid argument", 400),
+    ("API call failed with status code 404, model not found", 404),
+    ("API call failed with status code 429, quota exceeded", None),
+    ("API call failed with status code 403, permission denied", None),
+    ("API call failed with status code 400, API key not valid (API_KEY_INVALID)", None),
+    ("API call failed with status code 500, internal", None),
+    ("connection reset", None),
+])
+def test_upstream_client_error(message, expected):
+    error = upstream_client_error(Exception(message), "failed")
+    assert (error.status_code if error is not None else None) == expected
+
+
+def test_api_error_is_not_retried_or_charged():
+    key_manager = _FakeKeyManager()
+    calls = []
+
+    @RetryHandler(max_retries=3, key_arg="api_key")
+    async def call(api_key, key_manager):
+        calls.append(api_key)
+        raise APIError(400, "bad request", "invalid_request_error")
+
+    with pytest.raises(APIError):
+        asyncio.run(call(api_key="AIzaTestKeyA", key_manager=key_manager))
+    assert calls == ["AIzaTestKeyA"]
+    assert key_manager.failures == []
+
+
+def test_unsupported_model_does_not_charge_keys(monkeypatch):
+    monkeypatch.setattr(settings, "FILTERED_MODELS", ["filtered-model"])
+    key_manager = _FakeKeyManager()
+    chat_service = _FailingChatService(Exception("unused"))
+    with pytest.raises(APIError) as excinfo:
+        _generate("filtered-model", key_manager, chat_service)
+    assert excinfo.value.status_code == 400
+    assert chat_service.calls == 0
+    assert key_manager.failures == []
+
+
+def test_upstream_bad_request_does_not_charge_keys():
+    key_manager = _FakeKeyManager()
+    chat_service = _FailingChatService(Exception("API call failed with status code 400, invalid argument"))
+    with pytest.raises(APIError) as excinfo:
+        _generate("gemini-2.0-flash", key_manager, chat_service)
+    assert excinfo.value.status_code == 400
+    assert chat_service.calls == 1
+    assert key_manager.failures == []
+
+
+def test_upstream_server_error_is_retried_on_other_keys():
+    key_manager = _FakeKeyManager()
+    chat_service = _FailingChatService(Exception("API call failed with status code 500, internal"))
+    with pytest.raises(Exception):
+        _generate("gemini-2.0-flash", key_manager, chat_service)
+    assert chat_service.calls == settings.MAX_RETRIES
+    assert key_manager.failures[0] == ("AIzaTestKeyA", 1, 500)
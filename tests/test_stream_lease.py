@@ -0,0 +1,90 @@
+"""流式名额：响应结束时释放，包括流从未启动的情况"""
+import asyncio
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from app.router.batch_routes import DuplexStreamingResponse
+from app.service.usage.client_quota import ClientQuota, LeasedStreamingResponse
+
+
+@pytest.fixture
+def quota():
+    return ClientQuota("client", (0, 0, 1))
+
+
+class _Stream:
+    """记录是否被启动的流"""
+
+    def __init__(self):
+        self.started = False
+
+    async def __aiter__(self):
+        self.started = True
+        yield "data: 1\n\n"
+
+
+def _scope(spec_version: str):
+    return {"type": "http", "asgi": {"spec_version": spec_version}}
+
+
+async def _never_disconnect():
+    await asyncio.Event().wait()
+
+
+def test_lease_is_released_after_the_stream(quota):
+    async def scenario():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        lease = quota.open_stream()
+        response = LeasedStreamingResponse(_Stream(), lease, media_type="text/event-stream")
+        await response(_scope("2.4"), _never_disconnect, send)
+        assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+    asyncio.run(scenario())
+    assert quota.active_streams == 0
+
+
+def test_lease_is_released_when_send_fails_before_first_chunk(quota):
+    async def send(message):
+        raise OSError("connection reset")
+
+    stream = _Stream()
+    lease = quota.open_stream()
+    response = LeasedStreamingResponse(stream, lease, media_type="text/event-stream")
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(response(_scope("2.4"), _never_disconnect, send))
+    assert not stream.started
+    assert quota.active_streams == 0
+    # 名额已释放，可以再打开一个流
+    quota.open_stream().release()
+    lease.release()
+    assert quota.active_streams == 0
+
+
+def test_lease_is_released_when_disconnect_wins_on_old_servers(quota):
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.Event().wait()
+
+    stream = _Stream()
+    response = LeasedStreamingResponse(stream, quota.open_stream(), media_type="text/event-stream")
+    asyncio.run(response(_scope("2.3"), receive, send))
+    assert not stream.started
+    assert quota.active_streams == 0
+
+
+def test_duplex_response_releases_lease_when_send_fails(quota):
+    async def send(message):
+        raise OSError("connection reset")
+
+    stream = _Stream()
+    response = DuplexStreamingResponse(stream.__aiter__(), quota.open_stream(), media_type="application/x-ndjson")
+    asyncio.run(response(_scope("2.4"), _never_disconnect, send))
+    assert not stream.started
+    assert quota.active_streams == 0